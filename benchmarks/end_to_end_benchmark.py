@@ -0,0 +1,157 @@
+"""
+End-to-end benchmark of tags_to_atlas, audit_tags, rules_to_ranger and policy_cache_sync against local
+stand-ins for Atlas, Ranger and Hive on synthetic workloads. Each command runs in a forked process on a
+freshly populated stand-in, reporting time, throughput, requests per client and peak memory.
+
+Usage: python -m benchmarks.end_to_end_benchmark [--scale 1k --scale 100k] [--latency-ms 2] [--command tags_to_atlas]
+"""
+from __future__ import print_function
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks import standins
+from benchmarks import synthetic
+
+ENVIRONMENT = 'bench'
+PROJECT = 'bench_project'
+COMMANDS = ['tags_to_atlas', 'tags_to_atlas_hdfs', 'audit_tags', 'rules_to_ranger', 'policy_cache_sync']
+SCALES = {'1k': 1000, '100k': 100000, '1M': 1000000}
+
+
+def _use_stand_ins(latency):
+    """
+    Make the CLI talk to the stand-ins: no Kerberos authentication and a fake Hive client.
+    Only called in the forked process running a command.
+    """
+    from policytool import configfile
+    from policytool import hive
+    configfile.kerberos_auth = lambda: None
+    hive.Client = lambda *args, **kwargs: standins.FakeHiveClient(latency)
+
+
+def _run_command(command, workdir, latency):
+    from policytool import cli
+    from policytool import policycache
+    from policytool.configfile import JSONPropertiesFile
+    config = os.path.join(workdir, 'config.json')
+    srcdir = os.path.join(workdir, 'src')
+    if command in ('tags_to_atlas', 'tags_to_atlas_hdfs'):
+        cli._tags_to_atlas(srcdir, [ENVIRONMENT], command == 'tags_to_atlas_hdfs', 0, 0, config,
+                           'table_tags.csv', 'column_tags.csv', os.path.join(workdir, 'checkpoint'))
+    elif command == 'audit_tags':
+        cli._audit(srcdir, ENVIRONMENT, config, 'table_tags.csv', 'column_tags.csv')
+    elif command == 'rules_to_ranger':
+        cli._rules_to_ranger_cmd(srcdir, PROJECT, [ENVIRONMENT], config, 0, False, 'table_tags.csv',
+                                 'column_tags.csv', 'ranger_policies.json')
+    elif command == 'policy_cache_sync':
+        conf = JSONPropertiesFile(config).get(ENVIRONMENT)
+        policycache.extract_policy_cache(conf, os.path.join(workdir, 'policycache.json'))
+    else:
+        raise ValueError("Unknown command " + command)
+
+
+def _child(command, workdir, latency, results):
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    _use_stand_ins(latency)
+    start = time.time()
+    error = None
+    try:
+        _run_command(command, workdir, latency)
+    except BaseException as e:
+        error = repr(e)
+    # ru_maxrss is in kilobytes on Linux.
+    results.put((time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, error))
+
+
+def _prepare(workdir, columns, atlas, ranger):
+    srcdir = os.path.join(workdir, 'src')
+    os.mkdir(srcdir)
+    synthetic.write_sources(srcdir, columns)
+    synthetic.write_policy_cache(os.path.join(workdir, 'policycache.json'), ENVIRONMENT, columns)
+    with open(os.path.join(workdir, 'config.json'), 'w') as f:
+        json.dump({'environments': [{
+            'name': ENVIRONMENT,
+            'atlas_api_url': atlas.url,
+            'ranger_api_url': ranger.url,
+            'hive_server': 'localhost',
+            'hive_port': '10000',
+            'request_retries': 0,
+        }]}, f)
+
+
+def run(command, columns, workdir, atlas, ranger, latency):
+    """
+    Run command in a forked process against freshly populated stand-ins.
+    :return: Dict with seconds, entities_per_second, atlas_requests, ranger_requests, peak_rss_mb and error.
+    """
+    atlas.reset()
+    ranger.reset()
+    synthetic.populate_atlas(atlas, ENVIRONMENT, columns)
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_child, args=(command, workdir, latency, results))
+    process.start()
+    (seconds, max_rss_kb, error) = results.get()
+    process.join()
+    entities = columns + columns // synthetic.COLUMNS_PER_TABLE
+    return {'command': command,
+            'columns': columns,
+            'seconds': seconds,
+            'entities_per_second': entities / seconds if seconds else 0,
+            'atlas_requests': atlas.request_count(),
+            'ranger_requests': ranger.request_count(),
+            'peak_rss_mb': max_rss_kb / 1024.0,
+            'error': error}
+
+
+def _parse_scale(scale):
+    return SCALES[scale] if scale in SCALES else int(scale)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', action='append', help='Number of columns, 1k, 100k, 1M or a number. '
+                                                         'Can be given many times. Default 1k.')
+    parser.add_argument('--command', action='append', choices=COMMANDS, help='Default all commands.')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Latency added to every request.')
+    parser.add_argument('--json', help='Also write results as json to this file.')
+    args = parser.parse_args()
+    latency = args.latency_ms / 1000.0
+
+    atlas = standins.AtlasStandIn(latency).start()
+    ranger = standins.RangerStandIn(latency).start()
+    results = []
+    print("{:20} {:>9} {:>9} {:>11} {:>8} {:>8} {:>9}".format(
+        'command', 'columns', 'seconds', 'entities/s', 'atlas', 'ranger', 'peak MB'))
+    try:
+        for scale in args.scale or ['1k']:
+            columns = _parse_scale(scale)
+            workdir = tempfile.mkdtemp(prefix='policytool-benchmark-')
+            try:
+                _prepare(workdir, columns, atlas, ranger)
+                for command in args.command or COMMANDS:
+                    result = run(command, columns, workdir, atlas, ranger, latency)
+                    results.append(result)
+                    print("{command:20} {columns:9d} {seconds:9.2f} {entities_per_second:11.0f} "
+                          "{atlas_requests:8d} {ranger_requests:8d} {peak_rss_mb:9.1f}".format(**result))
+                    if result['error'] is not None:
+                        print("  failed: " + result['error'])
+            finally:
+                shutil.rmtree(workdir)
+    finally:
+        atlas.stop()
+        ranger.stop()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
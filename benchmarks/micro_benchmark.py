@@ -0,0 +1,161 @@
+"""
+Micro-benchmarks of the CPU heavy policy expansion in rangersync, template and policyutil, on a generated
+context with thousands of tables. Results are compared with a stored baseline and the run fails if a case is
+slower than the baseline by more than the threshold. Baselines depend on the machine, save a new one with
+--save-baseline before comparing on another machine.
+
+Usage: python -m benchmarks.micro_benchmark [--tables 5000] [--threshold 0.25] [--save-baseline]
+"""
+from __future__ import print_function
+import argparse
+import copy
+import json
+import os
+import sys
+import timeit
+from collections import defaultdict
+
+from benchmarks import standins
+from benchmarks import synthetic
+from policytool import policyutil
+from policytool import rangersync
+from policytool.template import Context, apply_context
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'micro_baseline.json')
+
+
+def _context(table_count):
+    tables = []
+    table_columns = defaultdict(list)
+    columns = table_count * synthetic.COLUMNS_PER_TABLE
+    for i, (schema, table) in enumerate(synthetic.tables(columns)):
+        tables.append({'schema': schema, 'table': table, 'tags': ','.join(synthetic._tags(synthetic.TABLE_TAGS, i))})
+    for i, (schema, table, column) in enumerate(synthetic.table_columns(columns)):
+        table_columns[schema + '.' + table].append(
+            {'schema': schema, 'table': table, 'attribute': column,
+             'tags': ','.join(synthetic._tags(synthetic.COLUMN_TAGS, i))})
+    return Context({'project_name': u'bench_project', 'environment': u'bench', 'tables': tables,
+                    'table_columns': table_columns, 'hive_client': standins.FakeHiveClient(),
+                    'user_suffix': u'', 'installation': u'bench'})
+
+
+def _unicode(data):
+    # Policy files are read with json, which gives unicode strings.
+    return json.loads(json.dumps(data))
+
+
+def _tag_policy():
+    return _unicode({
+        "service": "${installation}_tag",
+        "name": "${project_name}_${environment}_read_pii",
+        "policyType": 0,
+        "isEnabled": True,
+        "resources": {"tag": {"values": ["PII"], "isExcludes": False, "isRecursive": False}},
+        "policyItems": [{
+            "accesses": [{"type": "hive:select", "isAllowed": True}, {"type": "hive:update", "isAllowed": True}],
+            "users": ["etl${user_suffix}"], "groups": [], "conditions": [], "delegateAdmin": False
+        } for _ in range(20)]
+    })
+
+
+def _database_policy(table_count):
+    return _unicode({
+        "service": "${installation}_hive",
+        "name": "${project_name}_${environment}_schema_read",
+        "policyType": 0,
+        "isEnabled": True,
+        "resources": {
+            "database": {"values": ["schema_0_${environment}"], "isExcludes": False, "isRecursive": False},
+            "table": {"values": ["table_{}".format(i) for i in range(table_count)],
+                      "isExcludes": False, "isRecursive": False},
+            "column": {"values": ["*"], "isExcludes": False, "isRecursive": False}
+        },
+        "policyItems": [{
+            "accesses": [{"type": "select", "isAllowed": True}, {"type": "read", "isAllowed": True}],
+            "users": ["etl${user_suffix}"], "groups": [], "conditions": [], "delegateAdmin": False
+        }]
+    })
+
+
+def cases(table_count):
+    """
+    :return: List of (name, function without arguments) to benchmark.
+    """
+    context = _context(table_count)
+    row_rule = _unicode(synthetic.policy_commands()[0])
+    tag_policy = _tag_policy()
+    database_policy = _database_policy(table_count)
+    # apply_rule_command expands the template before converting it, as the hive client needs real schema names.
+    expanded_database_policy = apply_context(database_policy, context)
+    hdfs_options = {'expandHiveResourceToHdfs': True, 'hdfsService': 'bench_hdfs'}
+    commands = [row_rule,
+                {'command': 'apply_rule', 'policy': tag_policy, 'options': hdfs_options},
+                {'command': 'apply_rule', 'policy': database_policy, 'options': hdfs_options}]
+    big_template = [copy.deepcopy(tag_policy) for _ in range(table_count // 10)]
+    return [
+        ('apply_commands', lambda: rangersync.apply_commands(commands, context)),
+        ('apply_tag_row_rule_command',
+         lambda: rangersync.apply_tag_row_rule_command(row_rule['filters'], row_rule['policy'], context)),
+        ('apply_context', lambda: apply_context(big_template, context)),
+        ('extend_tag_policy_with_hdfs', lambda: [policyutil.extend_tag_policy_with_hdfs(p) for p in big_template]),
+        ('_convert_hive_resource_policy_to_hdfs_policy',
+         lambda: rangersync._convert_hive_resource_policy_to_hdfs_policy(expanded_database_policy, context,
+                                                                         hdfs_options)),
+    ]
+
+
+def run(table_count, repeat):
+    """
+    :return: Dict case name -> best time in seconds of repeat runs.
+    """
+    return dict((name, min(timeit.repeat(func, number=1, repeat=repeat))) for (name, func) in cases(table_count))
+
+
+def compare(results, baseline, threshold):
+    """
+    :return: List of names of cases slower than baseline by more than threshold, a fraction.
+    """
+    return [name for name in sorted(results)
+            if name in baseline and results[name] > baseline[name] * (1 + threshold)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tables', type=int, default=5000, help='Number of tables in context.')
+    parser.add_argument('--repeat', type=int, default=10, help='Runs per case, best time is used.')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Allowed slowdown compared to baseline.')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='Baseline json file.')
+    parser.add_argument('--save-baseline', action='store_true', help='Save results as new baseline.')
+    args = parser.parse_args()
+
+    results = run(args.tables, args.repeat)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get(str(args.tables), {})
+    for name in sorted(results):
+        if name in baseline:
+            change = "{:+.0%}".format(results[name] / baseline[name] - 1)
+        else:
+            change = "no baseline"
+        print("{:46} {:8.4f}s  {}".format(name, results[name], change))
+
+    if args.save_baseline:
+        baselines = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baselines = json.load(f)
+        baselines[str(args.tables)] = results
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True, separators=(',', ': '))
+        print("Baseline saved to " + args.baseline)
+        return
+
+    regressions = compare(results, baseline, args.threshold)
+    if len(regressions) != 0:
+        print("Slower than baseline by more than {:.0%}: {}".format(args.threshold, ", ".join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Benchmark of resource classification and tag resolution in PolicyCache on a synthetic policy cache.
+
+Usage: python -m benchmarks.policycache_benchmark [--resources 1000000]
+"""
+from __future__ import print_function
+import argparse
+import time
+from collections import Counter
+
+from policytool.policycache import PolicyCache
+
+
+def synthetic_service_resources(n):
+    """
+    :param n: Number of resources.
+    :return: serviceResources with 1 database resource per 10 table resources and 10 column resources per table.
+    """
+    resources = []
+    for i in range(n):
+        db = {u'values': [u'db_%d' % (i // 10000)], u'isExcludes': False, u'isRecursive': False}
+        table = {u'values': [u'table_%d' % (i // 100)], u'isExcludes': False, u'isRecursive': False}
+        column = {u'values': [u'column_%d' % i], u'isExcludes': False, u'isRecursive': False}
+        if i % 100 == 0:
+            elements = {u'database': db}
+        elif i % 10 == 0:
+            elements = {u'database': db, u'table': table}
+        else:
+            elements = {u'database': db, u'table': table, u'column': column}
+        resources.append({u'id': i, u'isEnabled': True, u'resourceElements': elements})
+    return resources
+
+
+def _extract_resources_three_pass(policy_cache_dict, resource):
+    # Implementation before classifying all resources in one pass, kept as reference.
+    expected_resource_elements = {'db': [u'database'],
+                                  'table': [u'database', u'table'],
+                                  'column': [u'database', u'table', u'column']}[resource]
+    expected_counter = Counter(expected_resource_elements)
+    result = {}
+    for res in policy_cache_dict['serviceResources']:
+        if Counter(res['resourceElements'].keys()) == expected_counter:
+            qualified_key = []
+            for k in expected_resource_elements:
+                qualified_key.append(res['resourceElements'][k]['values'][0])
+            result[tuple(qualified_key)] = res['id']
+    return result
+
+
+def _classify_one_pass(service_resources):
+    policy_cache = PolicyCache()
+    for res in service_resources:
+        policy_cache._add_resource(res)
+    return {'db': policy_cache.dbResources, 'table': policy_cache.tableResources, 'column': policy_cache.columnResources}
+
+
+def synthetic_resource_to_tag_ids(n, tag_count=50):
+    # Resources share a small number of tag combinations, like in a real policy cache.
+    return dict((str(i), [1000 + (i % tag_count), 1000 + (i % 7)]) for i in range(n))
+
+
+def _tag_strings_str_keyed(cache, resources):
+    # Implementation before memoised tag strings on integer keys, kept as reference.
+    result = []
+    for resource_id in resources.values():
+        tag_ids = cache['resourceToTagIds'][str(resource_id)]
+        result.append(','.join([str(cache['tags'][str(tag_id)]['type']) for tag_id in tag_ids]))
+    return result
+
+
+def _timed(func):
+    start = time.time()
+    result = func()
+    return time.time() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--resources', type=int, default=1000000)
+    args = parser.parse_args()
+
+    cache = {'serviceResources': synthetic_service_resources(args.resources),
+             'tags': dict((str(1000 + i), {'type': 'TAG_%d' % i}) for i in range(50)),
+             'resourceToTagIds': synthetic_resource_to_tag_ids(args.resources)}
+    three_pass_time, three_pass = _timed(
+        lambda: dict((kind, _extract_resources_three_pass(cache, kind)) for kind in ['db', 'table', 'column']))
+    one_pass_time, one_pass = _timed(lambda: _classify_one_pass(cache['serviceResources']))
+    assert three_pass == one_pass
+    print("Resources: {}".format(args.resources))
+    print("Three pass with Counter: {:.2f}s".format(three_pass_time))
+    print("One pass: {:.2f}s".format(one_pass_time))
+    print("Speedup: {:.1f}x".format(three_pass_time / one_pass_time))
+
+    policy_cache = PolicyCache(cache)
+    str_keyed_time, str_keyed = _timed(lambda: _tag_strings_str_keyed(cache, policy_cache.columnResources))
+    memoised_time, memoised = _timed(
+        lambda: [policy_cache._tag_string(resource_id) for resource_id in policy_cache.columnResources.values()])
+    assert sorted(str_keyed) == sorted(memoised)
+    print("Column tag strings, string keys: {:.2f}s".format(str_keyed_time))
+    print("Column tag strings, memoised: {:.2f}s".format(memoised_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+"""
+Local stand-ins for Atlas, Ranger and Hive used by the benchmarks. The HTTP stand-ins implement the parts
+of the Atlas v2 and Ranger public and plugin APIs used by policytool, keep state in memory, count requests
+per endpoint and can add latency to every request.
+"""
+import BaseHTTPServer
+import SocketServer
+import itertools
+import json
+import re
+import threading
+import time
+import urlparse
+import uuid
+from collections import Counter
+
+from policytool.hive import Client as HiveClient
+from policytool.instrumentation import http_endpoint
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one packet, otherwise delayed ACKs add 40ms to every keep-alive request.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def _handle(self):
+        url = urlparse.urlparse(self.path)
+        query = {}
+        for (key, value) in urlparse.parse_qsl(url.query):
+            # Repeated parameters, e.g. guid in bulk requests, are given as a list.
+            query[key] = query[key] + [value] if isinstance(query.get(key), list) else \
+                [query[key], value] if query.has_key(key) else value
+        length = int(self.headers.getheader('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        (status, response) = self.server.stand_in.handle(self.command, url.path, query, body)
+        content = json.dumps(response) if response is not None else ''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandIn(object):
+    """
+    Base of the HTTP stand-ins. Subclasses define ROUTES, a list of (method, path regex, name of method
+    handling the request). Handling methods take (query, body, *groups of path regex) and return (status, json).
+    """
+    ROUTES = []
+
+    def __init__(self, latency=0.0):
+        """
+        :param latency: Seconds to sleep before answering every request.
+        """
+        self.latency = latency
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._routes = [(method, re.compile('^' + path + '$'), name) for (method, path, name) in self.ROUTES]
+        self._server = None
+
+    def start(self):
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.stand_in = self
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self._server.server_address[1])
+
+    def handle(self, method, path, query, body):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests[http_endpoint(method, path)] += 1
+            for (route_method, pattern, name) in self._routes:
+                match = pattern.match(path)
+                if route_method == method and match:
+                    return getattr(self, name)(query, body, *match.groups())
+        return 404, {'errorMessage': 'No route for {} {}'.format(method, path)}
+
+    def request_count(self):
+        return sum(self.requests.values())
+
+
+class AtlasStandIn(StandIn):
+    """
+    Atlas with hive_table, hive_column and hdfs_path entities. Url prefix of the API is /api/atlas.
+    """
+    ROUTES = [
+        ('POST', '/api/atlas/v2/search/basic', '_search'),
+        ('GET', '/api/atlas/v2/search/dsl', '_dsl_search'),
+        ('GET', '/api/atlas/v2/types/typedefs/headers', '_typedef_headers'),
+        ('POST', '/api/atlas/v2/types/typedefs', '_add_typedefs'),
+        ('POST', '/api/atlas/v2/entity/guid/([^/]+)/classifications', '_add_classifications'),
+        ('DELETE', '/api/atlas/v2/entity/guid/([^/]+)/classification/([^/]+)', '_delete_classification'),
+        ('POST', '/api/atlas/v2/entity', '_create_entity'),
+        ('POST', '/api/atlas/v2/entity/bulk', '_create_entities'),
+        ('GET', '/api/atlas/v2/entity/bulk', '_get_entities'),
+        ('POST', '/api/atlas/v2/entity/bulk/classification', '_add_classification_to_entities'),
+        ('GET', '/api/atlas/v2/entity/uniqueAttribute/type/hdfs_path', '_get_hdfs_path'),
+        ('GET', '/api/atlas/v2/entity/guid/([^/]+)', '_get_entity'),
+    ]
+
+    def __init__(self, latency=0.0, cluster='bench'):
+        StandIn.__init__(self, latency)
+        self.cluster = cluster
+        self.reset()
+
+    def reset(self):
+        self.entities = {}
+        self.classifications = set()
+        self._db_guids = {}
+        self._tables_by_db = {}
+        self._columns_by_table = {}
+        self._guid_by_name = {}
+        self.requests = Counter()
+
+    @property
+    def url(self):
+        return StandIn.url.fget(self) + '/api/atlas'
+
+    def _add(self, type_name, qualified_name, name, tags):
+        guid = str(uuid.uuid4())
+        self.entities[guid] = {'typeName': type_name, 'qualifiedName': qualified_name, 'name': name,
+                               'tags': set(tags)}
+        self._guid_by_name[(type_name, qualified_name)] = guid
+        self.classifications.update(tags)
+        return guid
+
+    def add_table(self, db, table, tags=()):
+        if db not in self._db_guids:
+            self._db_guids[db] = self._add('hive_db', '{}@{}'.format(db, self.cluster), db, ())
+        guid = self._add('hive_table', '{}.{}@{}'.format(db, table, self.cluster), table, tags)
+        self._tables_by_db.setdefault(db, []).append(guid)
+
+    def add_column(self, db, table, column, tags=()):
+        guid = self._add('hive_column', '{}.{}.{}@{}'.format(db, table, column, self.cluster), column, tags)
+        self._columns_by_table.setdefault((db, table), []).append(guid)
+
+    def _entity_header(self, guid):
+        entity = self.entities[guid]
+        return {'guid': guid, 'typeName': entity['typeName'], 'status': 'ACTIVE', 'displayText': entity['name'],
+                'attributes': {'qualifiedName': entity['qualifiedName'], 'name': entity['name']},
+                'classificationNames': sorted(entity['tags'])}
+
+    def _search(self, query, body):
+        values = [c['attributeValue'] for c in body['entityFilters']['criterion']
+                  if c['attributeName'] == 'qualifiedName']
+        if body['typeName'] == 'hive_db':
+            names = [c['attributeValue'] for c in body['entityFilters']['criterion'] if c['attributeName'] == 'name']
+            guids = [self._db_guids[names[0]]] if names[0] in self._db_guids else []
+        elif body['typeName'] == 'hive_table':
+            guids = self._tables_by_db.get(values[0], [])
+        elif body['typeName'] == 'hive_column':
+            guids = self._columns_by_table.get((values[0], values[1]), [])
+        else:
+            guids = []
+        return 200, {'entities': [self._entity_header(guid) for guid in guids]}
+
+    def _dsl_search(self, query, body):
+        # Only queries on the start of qualified name, as made by the client, are supported, and the bare type
+        # name the client probes DSL support with.
+        if query.get('query') in ('hive_table', 'hive_column'):
+            return 200, {'queryType': 'DSL', 'entities': []}
+        match = re.match(r'(hive_table|hive_column) where qualifiedName like "([^"*]*)\*"', query.get('query', ''))
+        if match is None:
+            return 400, {'errorMessage': 'Unsupported query ' + query.get('query', '')}
+        names = match.group(2).split('.')[:-1]
+        if match.group(1) == 'hive_table':
+            guids = self._tables_by_db.get(names[0], [])
+        else:
+            guids = self._columns_by_table.get(tuple(names), [])
+        return 200, {'queryType': 'DSL', 'entities': [self._entity_header(guid) for guid in guids]}
+
+    def _typedef_headers(self, query, body):
+        return 200, [{'category': 'CLASSIFICATION', 'name': name, 'guid': name} for name in self.classifications]
+
+    def _add_typedefs(self, query, body):
+        names = [d['name'] for d in body.get('classificationDefs', [])]
+        existing = [name for name in names if name in self.classifications]
+        if len(existing) != 0:
+            # Like Atlas, no type in the request is created if one exists.
+            return 409, {'errorCode': 'ATLAS-409-00-001',
+                         'errorMessage': 'Given type {} already exists'.format(existing[0])}
+        self.classifications.update(names)
+        return 200, body
+
+    def _add_classifications(self, query, body, guid):
+        if guid not in self.entities:
+            return 404, {'errorMessage': 'No entity ' + guid}
+        self.entities[guid]['tags'].update(c['typeName'] for c in body)
+        return 204, None
+
+    def _delete_classification(self, query, body, guid, name):
+        if guid not in self.entities:
+            return 404, {'errorMessage': 'No entity ' + guid}
+        self.entities[guid]['tags'].discard(name)
+        return 204, None
+
+    def _create_entity(self, query, body):
+        attributes = body['entity']['attributes']
+        key = (body['entity']['typeName'], attributes['qualifiedName'])
+        guid = self._guid_by_name.get(key)
+        if guid is None:
+            guid = self._add(key[0], key[1], attributes.get('name'), ())
+        return 200, {'guidAssignments': {'-1': guid}}
+
+    def _create_entities(self, query, body):
+        guid_assignments = {}
+        for entity in body['entities']:
+            key = (entity['typeName'], entity['attributes']['qualifiedName'])
+            guid = self._guid_by_name.get(key)
+            if guid is None:
+                guid = self._add(key[0], key[1], entity['attributes'].get('name'), ())
+            guid_assignments[str(entity['guid'])] = guid
+        return 200, {'guidAssignments': guid_assignments}
+
+    def _entity(self, guid):
+        entity = self.entities[guid]
+        attributes = {'qualifiedName': entity['qualifiedName'], 'name': entity['name']}
+        if entity['typeName'] == 'hive_table':
+            (db, table) = entity['qualifiedName'].split('@')[0].split('.')
+            attributes['temporary'] = False
+            attributes['columns'] = [{'guid': column, 'typeName': 'hive_column'}
+                                     for column in self._columns_by_table.get((db, table), [])]
+        result = {'guid': guid, 'typeName': entity['typeName'], 'status': 'ACTIVE', 'attributes': attributes,
+                  'classifications': [{'typeName': tag, 'entityGuid': guid} for tag in sorted(entity['tags'])]}
+        if entity['typeName'] == 'hive_db':
+            result['relationshipAttributes'] = {'tables': [
+                {'guid': table_guid, 'typeName': 'hive_table', 'entityStatus': 'ACTIVE', 'relationshipStatus': 'ACTIVE'}
+                for table_guid in self._tables_by_db.get(entity['name'], [])]}
+        return result
+
+    def _get_entity(self, query, body, guid):
+        if guid not in self.entities:
+            return 404, {'errorMessage': 'No entity ' + guid}
+        return 200, {'entity': self._entity(guid), 'referredEntities': {}}
+
+    def _get_entities(self, query, body):
+        guids = query.get('guid', [])
+        guids = [guids] if isinstance(guids, basestring) else guids
+        if any(guid not in self.entities for guid in guids):
+            return 404, {'errorMessage': 'No entity'}
+        entities = [self._entity(guid) for guid in guids]
+        referred_entities = {}
+        if query.get('minExtInfo') == 'false':
+            for entity in entities:
+                for column in entity['attributes'].get('columns', []):
+                    referred_entities[column['guid']] = self._entity(column['guid'])
+        return 200, {'entities': entities, 'referredEntities': referred_entities}
+
+    def _add_classification_to_entities(self, query, body):
+        for guid in body['entityGuids']:
+            if guid not in self.entities:
+                return 404, {'errorMessage': 'No entity ' + guid}
+        for guid in body['entityGuids']:
+            self.entities[guid]['tags'].add(body['classification']['typeName'])
+        return 204, None
+
+    def _get_hdfs_path(self, query, body):
+        guid = self._guid_by_name.get(('hdfs_path', query.get('attr:qualifiedName')))
+        if guid is None:
+            return 404, {'errorMessage': 'No hdfs_path'}
+        return 200, {'entity': {'guid': guid, 'classifications': [
+            {'typeName': tag, 'entityGuid': guid} for tag in sorted(self.entities[guid]['tags'])]}}
+
+
+class RangerStandIn(StandIn):
+    """
+    Ranger with policies in any number of services.
+    """
+    ROUTES = [
+        ('GET', '/service/public/v2/api/service/name/([^/]+)', '_get_service'),
+        ('GET', '/service/public/v2/api/service/([^/]+)/policy/([^/]+)', '_get_policy_by_name'),
+        ('GET', '/service/public/v2/api/policy', '_search_policies'),
+        ('DELETE', '/service/public/v2/api/policy', '_delete_policy'),
+        ('POST', '/service/plugins/policies', '_create_policy'),
+        ('PUT', '/service/plugins/policies/([0-9]+)', '_update_policy'),
+    ]
+
+    def __init__(self, latency=0.0):
+        StandIn.__init__(self, latency)
+        self.reset()
+
+    def reset(self):
+        self.policies = {}
+        self._ids = itertools.count(1)
+        self.requests = Counter()
+
+    def add_policy(self, policy):
+        policy = dict(policy, id=next(self._ids))
+        self.policies[policy['id']] = policy
+        return policy['id']
+
+    def _find(self, service, name):
+        for policy in self.policies.values():
+            if policy['service'] == service and policy['name'] == name:
+                return policy
+        return None
+
+    def _get_service(self, query, body, service):
+        return 200, {'name': service}
+
+    def _get_policy_by_name(self, query, body, service, name):
+        policy = self._find(service, name)
+        return (200, policy) if policy is not None else (404, {'errorMessage': 'Not found'})
+
+    def _search_policies(self, query, body):
+        policies = [p for p in sorted(self.policies.values(), key=lambda p: p['id'])
+                    if p['service'] == query.get('serviceName') and query.get('policyNamePartial', '') in p['name']]
+        start = int(query.get('startIndex', 0))
+        return 200, policies[start:start + int(query.get('pageSize', len(policies)))]
+
+    def _delete_policy(self, query, body):
+        policy = self._find(query.get('servicename'), query.get('policyname'))
+        if policy is None:
+            return 404, {'errorMessage': 'Not found'}
+        del self.policies[policy['id']]
+        return 204, None
+
+    def _create_policy(self, query, body):
+        if self._find(body['service'], body['name']) is not None:
+            return 400, {'msgDesc': 'Policy exists'}
+        return 200, self.policies[self.add_policy(body)]
+
+    def _update_policy(self, query, body, policy_id):
+        if int(policy_id) not in self.policies:
+            return 404, {'errorMessage': 'Not found'}
+        self.policies[int(policy_id)] = dict(body, id=int(policy_id))
+        return 200, self.policies[int(policy_id)]
+
+
+class FakeHiveClient(HiveClient):
+    """
+    Replaces hive.Client, every table is stored in the default warehouse directory. Only the queries are
+    replaced, get_locations runs them in parallel as hive.Client does.
+    """
+
+    def __init__(self, latency=0.0, cluster='bench'):
+        HiveClient.__init__(self, 'fake')
+        self.latency = latency
+        self.cluster = cluster
+        self.queries = 0
+
+    def get_location(self, database, table=None):
+        if self.latency:
+            time.sleep(self.latency)
+        self.queries += 1
+        location = 'hdfs://{}/apps/hive/warehouse/{}.db'.format(self.cluster, database)
+        if table is not None and table != '*':
+            location += '/' + table
+        return location
@@ -0,0 +1,55 @@
+"""
+Benchmark of CLI startup, the time until `cobra-policy --help` has printed its output. Also checks that
+no slow to import library, e.g. requests, Kerberos or Thrift, is imported just to show help.
+
+Usage: python -m benchmarks.startup_benchmark [--runs 20] [--target-ms 100]
+"""
+from __future__ import print_function
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ['requests', 'requests_kerberos', 'kerberos', 'pyhive', 'thrift', 'thrift_sasl', 'sasl']
+
+_HELP = "from policytool.cli import cli; cli(['--help'])"
+_IMPORTED = ("import sys\n"
+             "from policytool.cli import cli\n"
+             "try:\n"
+             "    cli(['--help'])\n"
+             "except SystemExit:\n"
+             "    pass\n"
+             "print(' '.join(m for m in {} if m in sys.modules))\n").format(HEAVY_MODULES)
+
+
+def _time_ms(code, runs):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(runs):
+            start = time.time()
+            subprocess.check_call([sys.executable, '-c', code], cwd=root, stdout=devnull)
+            times.append((time.time() - start) * 1000)
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20, help='Number of runs, median is reported.')
+    parser.add_argument('--target-ms', type=float, default=100, help='Fail if --help takes longer.')
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    interpreter_ms = _time_ms('pass', args.runs)
+    help_ms = _time_ms(_HELP, args.runs)
+    imported = subprocess.check_output([sys.executable, '-c', _IMPORTED], cwd=root).split('\n')[-2].split()
+    print("Interpreter start: {:.0f}ms".format(interpreter_ms))
+    print("cobra-policy --help: {:.0f}ms".format(help_ms))
+    print("Heavy modules imported: {}".format(", ".join(imported) if imported else "none"))
+    if help_ms > args.target_ms or imported:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
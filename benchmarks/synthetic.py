@@ -0,0 +1,163 @@
+"""
+Synthetic source files, Atlas content and policy caches for the benchmarks. A workload of n columns has
+10 columns per table and 100 tables per schema. About a third of the entities in Atlas have tags differing
+from the source files, so a sync has work to do.
+"""
+import csv
+import json
+import os
+
+COLUMNS_PER_TABLE = 10
+TABLES_PER_SCHEMA = 100
+TABLE_TAGS = ['PII_table', 'SensitiveInformation_table', 'end_date_table']
+COLUMN_TAGS = ['PII', 'SensitiveInformation', 'end_date']
+
+
+def tables(columns):
+    """
+    :param columns: Number of columns in workload.
+    :return: Generator of (schema, table).
+    """
+    for i in range(max(1, columns // COLUMNS_PER_TABLE)):
+        yield 'schema_{}'.format(i // TABLES_PER_SCHEMA), 'table_{}'.format(i)
+
+
+def table_columns(columns):
+    """
+    :return: Generator of (schema, table, column).
+    """
+    for (schema, table) in tables(columns):
+        for j in range(COLUMNS_PER_TABLE):
+            yield schema, table, 'column_{}'.format(j)
+
+
+def _tags(tag_names, i):
+    return [tag_names[k] for k in range(len(tag_names)) if (i >> k) & 1]
+
+
+def write_sources(srcdir, columns):
+    """
+    Write table_tags.csv, column_tags.csv and ranger_policies.json to srcdir.
+    """
+    with open(os.path.join(srcdir, 'table_tags.csv'), 'wb') as f:
+        writer = csv.writer(f, delimiter=';', lineterminator='\n')
+        writer.writerow(['schema', 'table', 'tags'])
+        for i, (schema, table) in enumerate(tables(columns)):
+            writer.writerow([schema, table, ','.join(_tags(TABLE_TAGS, i))])
+    with open(os.path.join(srcdir, 'column_tags.csv'), 'wb') as f:
+        writer = csv.writer(f, delimiter=';', lineterminator='\n')
+        writer.writerow(['schema', 'table', 'attribute', 'tags'])
+        for i, (schema, table, column) in enumerate(table_columns(columns)):
+            writer.writerow([schema, table, column, ','.join(_tags(COLUMN_TAGS, i))])
+    with open(os.path.join(srcdir, 'ranger_policies.json'), 'w') as f:
+        json.dump(policy_commands(), f, indent=2)
+
+
+def populate_atlas(atlas, environment, columns):
+    """
+    Add tables and columns of workload to an AtlasStandIn, with schemas suffixed by environment.
+    Every third entity has tags differing from the source files.
+    """
+    for i, (schema, table) in enumerate(tables(columns)):
+        atlas.add_table(schema + '_' + environment, table, _tags(TABLE_TAGS, i + (i % 3 == 0)))
+    for i, (schema, table, column) in enumerate(table_columns(columns)):
+        atlas.add_column(schema + '_' + environment, table, column, _tags(COLUMN_TAGS, i + (i % 3 == 0)))
+
+
+def write_policy_cache(path, environment, columns):
+    """
+    Write a Ranger tag policy cache with the tags of the workload in the source files.
+    """
+    tag_names = TABLE_TAGS + COLUMN_TAGS
+    resources = []
+    resource_tags = {}
+    for i, (schema, table) in enumerate(tables(columns)):
+        resource_tags[len(resources)] = [k for k, t in enumerate(tag_names) if t in _tags(TABLE_TAGS, i)]
+        resources.append({'database': schema + '_' + environment, 'table': table})
+    for i, (schema, table, column) in enumerate(table_columns(columns)):
+        resource_tags[len(resources)] = [k for k, t in enumerate(tag_names) if t in _tags(COLUMN_TAGS, i)]
+        resources.append({'database': schema + '_' + environment, 'table': table, 'column': column})
+    with open(path, 'w') as f:
+        f.write('{"serviceName": "bench_tag", "serviceResources": [')
+        for i, resource in enumerate(resources):
+            elements = dict((k, {'values': [v], 'isExcludes': False, 'isRecursive': False})
+                            for k, v in resource.items())
+            f.write((',' if i else '') + json.dumps({'id': i, 'isEnabled': True, 'resourceElements': elements}))
+        f.write('], "tags": ')
+        json.dump(dict((str(k), {'type': t, 'id': k}) for k, t in enumerate(tag_names)), f)
+        f.write(', "resourceToTagIds": ')
+        json.dump(dict((str(k), v) for k, v in resource_tags.items() if len(v) != 0), f)
+        f.write('}')
+
+
+def policy_commands():
+    """
+    :return: Policy file with one row filter rule per table tagged PII_table, one tag based masking rule and
+    read and write rules on the tables of the first schema, overlapping on half of the tables, expanded to hdfs.
+    """
+    return [{
+        "command": "apply_tag_row_rule",
+        "filters": [{
+            "groups": [],
+            "users": ["etl"],
+            "tagFilterExprs": [{
+                "tags": ["PII_table"],
+                "filterExpr": "exists (select 1 from whitelist where whitelist.id=${table}.customer_id)"
+            }, {
+                "tags": ["PII_table", "end_date_table"],
+                "filterExpr": "datediff(current_date, ${table}.${end_date_column}) > 365"
+            }]
+        }],
+        "policy": {
+            "service": "bench_hive",
+            "name": "${project_name}_${environment}_${schema}_${table}",
+            "description": "Row filter for ${schema}.${table}.",
+            "policyType": 2,
+            "isEnabled": True,
+            "resources": {
+                "database": {"isExcludes": False, "values": ["${schema}_${environment}"], "isRecursive": False},
+                "table": {"isExcludes": False, "values": ["${table}"], "isRecursive": False}
+            },
+            "isAuditEnabled": True
+        }
+    }, {
+        "command": "apply_rule",
+        "policy": {
+            "service": "bench_tag",
+            "name": "${project_name}_${environment}_mask_pii",
+            "policyType": 1,
+            "description": "Mask PII",
+            "isAuditEnabled": True,
+            "resources": {"tag": {"values": ["PII"], "isExcludes": False, "isRecursive": False}},
+            "dataMaskPolicyItems": [{
+                "dataMaskInfo": {"dataMaskType": "MASK"},
+                "accesses": [{"type": "hive:select", "isAllowed": True}],
+                "users": ["etl"], "groups": [], "conditions": [], "delegateAdmin": False
+            }],
+            "isEnabled": True
+        }
+    }] + [_database_rule('read', 'select', range(TABLES_PER_SCHEMA // 2 + 1)),
+          _database_rule('write', 'update', range(TABLES_PER_SCHEMA // 2, TABLES_PER_SCHEMA))]
+
+
+def _database_rule(name, access, table_numbers):
+    return {
+        "command": "apply_rule",
+        "options": {"expandHiveResourceToHdfs": True, "hdfsService": "bench_hdfs"},
+        "policy": {
+            "service": "bench_hive",
+            "name": "${project_name}_${environment}_schema_0_" + name,
+            "policyType": 0,
+            "isEnabled": True,
+            "resources": {
+                "database": {"values": ["schema_0_${environment}"], "isExcludes": False, "isRecursive": False},
+                "table": {"values": ["table_{}".format(i) for i in table_numbers],
+                          "isExcludes": False, "isRecursive": False},
+                "column": {"values": ["*"], "isExcludes": False, "isRecursive": False}
+            },
+            "policyItems": [{
+                "accesses": [{"type": access, "isAllowed": True}],
+                "users": ["etl"], "groups": [], "conditions": [], "delegateAdmin": False
+            }]
+        }
+    }
@@ -1,23 +1,58 @@
+import jsonstream
 import requests
-
+import urllib3
 import urlutil
+from retry import HttpRetry, call_with_retry
+
+# Guids in a bulk lookup are sent in the url, 100 guids make an url of about 4kB.
+BULK_CHUNK_SIZE = 100
+# Strategies to search for tables and columns, see Client._get_qualified_name.
+BASIC_SEARCH = 'basic'
+DSL_SEARCH = 'dsl'
+# Bytes read at a time from search responses, which are decoded as they are received.
+STREAM_CHUNK_SIZE = 64 * 1024
+# Error code of Atlas when creating a type that already exists, some versions send it with HTTP 400.
+TYPE_ALREADY_EXISTS = 'ATLAS-409-00-001'
+
+
+def _chunks(items, chunk_size):
+    items = list(items)
+    return [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
 
 
 class Client:
 
-    def __init__(self, url_prefix, auth=None):
+    def __init__(self, url_prefix, auth=None, retries=3, bulk_chunk_size=BULK_CHUNK_SIZE,
+                 query_strategy=BASIC_SEARCH):
         """
         :param url_prefix: Prefix of the URL to the Atlas API. Example: 'http://atlas.host:21000/api/atlas'
         :param auth: If authentication is used. For Kerberos HTTPKerberosAuth(principal="user@MY.REALM")
+        :param retries: Number of retries of a single request on connection errors or transient server errors.
+        :param bulk_chunk_size: Max number of entities in one request of bulk operations.
+        :param query_strategy: BASIC_SEARCH or DSL_SEARCH, how to search for tables and columns,
+        see _get_qualified_name.
         """
+        if query_strategy not in (BASIC_SEARCH, DSL_SEARCH):
+            raise AtlasError("Unknown query strategy {}, use {} or {}.".format(
+                query_strategy, BASIC_SEARCH, DSL_SEARCH))
         self.url_prefix = url_prefix # http://atlas.host.my.org:21000/api/atlas/
         self.auth=auth
+        self.bulk_chunk_size = bulk_chunk_size
+        self.query_strategy = query_strategy
+        # One session per client to reuse connections between requests.
+        self.http = HttpRetry(retries, session=requests.Session(), client='atlas')
+
+    def _search(self, query, stream=False):
+        # Searches do not change anything, safe to retry even if sent with POST.
+        return self.http.request('POST', self.url_prefix + "/v2/search/basic", json=query, auth=self.auth,
+                                 stream=stream, idempotent=True)
 
-    def _search(self, query):
-        return requests.post(self.url_prefix + "/v2/search/basic", json=query, auth=self.auth)
+    def _dsl_search(self, query, limit, stream=False):
+        return self.http.request('GET', self.url_prefix + "/v2/search/dsl", params={'query': query, 'limit': limit},
+                                 auth=self.auth, stream=stream)
 
     def _post_entity(self, entity):
-        return requests.post(self.url_prefix + "/v2/entity", json=entity, auth=self.auth)
+        return self.http.request('POST', self.url_prefix + "/v2/entity", json=entity, auth=self.auth)
 
     def _create_qualifiedname_query(self, type_name, *values):
         """
@@ -51,8 +86,81 @@ class Client:
         query['entityFilters'] = entity_filter
         return query
 
-    def _filter_entities_on_qualifiedName(self, entities, qualtified_name):
-        return [e for e in entities if e['attributes']['qualifiedName'].startswith(qualtified_name)]
+    def _create_dsl_query(self, type_name, *values):
+        """
+        DSL query matching the start of the qualified name. The pattern is matched as a regular expression
+        on the graph, not on the tokens of the search index as in basic search, so dots and underscores
+        are safe. A dot in the pattern matches any character, the client side filter makes the match exact.
+        :param type_name: type of expected entities
+        :param values: Provide as many as you know of schema, table, column in that order.
+        :return: Query to be sent to Atlas DSL search.
+        """
+        query = '{} where qualifiedName like "{}*"'.format(type_name, self._create_qualifiedName_prefix(*values))
+        if type_name == 'hive_table':
+            # Ignore temporary tables.
+            query += ' and temporary = false'
+        return query
+
+    def _search_entities(self, type_name, *values):
+        """
+        :return: Streamed response of the query for type_name and values, with either query strategy.
+        """
+        if self.query_strategy == DSL_SEARCH:
+            response = self._dsl_search(self._create_dsl_query(type_name, *values), 10000, stream=True)
+            if response.status_code == 200:
+                return response
+            # Read the error before closing, the content of a closed streamed response is lost.
+            error = AtlasError(response.content, response.status_code)
+            response.close()
+            if response.status_code != 400:
+                raise error
+            if self._dsl_rejected(type_name):
+                # DSL support differs between Atlas versions, use basic search from now on.
+                self.query_strategy = BASIC_SEARCH
+        response = self._search(self._create_qualifiedname_query(type_name, *values), stream=True)
+        if response.status_code != 200:
+            raise AtlasError(response.content, response.status_code)
+        return response
+
+    def _dsl_rejected(self, type_name):
+        """
+        Probe DSL search with the simplest query for type_name, to tell a DSL search Atlas does not support from
+        a query Atlas could not run for the values in it.
+        :return: True if Atlas rejects DSL search.
+        """
+        response = self._dsl_search(type_name, 1)
+        if response.status_code == 200:
+            return False
+        if response.status_code in (400, 404, 405):
+            return True
+        raise AtlasError(response.content, response.status_code)
+
+    def _filter_entities_on_qualifiedName(self, response, qualtified_name):
+        """
+        Decode the entities in a search response as they are received, keeping only the entities with a
+        qualified name starting with qualified_name and only the fields used, see _search_header.
+        Search responses of wide schemas are big, most of them is never kept in memory.
+        :param response: Streamed response of a search.
+        :return: Array of entity headers.
+        """
+        result = []
+        try:
+            # Content is gzip encoded if Atlas compresses responses, requests asks for it by default.
+            response.raw.decode_content = True
+            for (key, _, entity) in jsonstream.iter_object(response.raw, ['entities'], STREAM_CHUNK_SIZE):
+                if key == 'entities' and entity['attributes']['qualifiedName'].startswith(qualtified_name):
+                    result.append(_search_header(entity))
+            # Read to the end, then the connection is reused for the next request.
+            while response.raw.read(STREAM_CHUNK_SIZE):
+                pass
+        except jsonstream.JSONStreamError as e:
+            raise AtlasError("Invalid search response: " + e.message)
+        except (urllib3.exceptions.HTTPError, requests.RequestException) as e:
+            # The connection broke or timed out while the response was read, after HttpRetry returned it.
+            raise SearchInterruptedError("Search response interrupted: " + str(e))
+        finally:
+            response.close()
+        return result
 
     def _create_qualifiedName_prefix(self, *values):
         return ".".join(values)+"."
@@ -67,30 +175,30 @@ class Client:
         of our wanted result, but it is of a reasonable size. Then we do the final fully correct filtering on the
         client side.
 
+        With query strategy DSL_SEARCH the search is instead done with a DSL query matching the start of
+        the qualified name, which returns only a few more entities than wanted. If Atlas rejects the DSL query
+        as a bad request, that search is done with basic search. If Atlas also rejects the simplest DSL query,
+        DSL search is not supported and the client uses basic search from then on. Other errors are raised.
+
+        The response is decoded as it is received and only the fields below are kept. If the connection
+        breaks while reading it, the search is redone.
+
         :param type: type of wanted entities
         :param values: Provide as many as you know of schema, table, column in that order.
         :return: Array of one dict per entity. Dict is on form:
             {u'status': u'ACTIVE',
              u'guid': u'1bbe630c-927e-43f5-846b-94513db1d625',
              u'typeName': u'hive_table',
-             u'displayText': u'tablename',
              u'attributes': {
-                u'owner': u'owner',
                 u'qualifiedName': u'database.tablename@dhadoopname',
-                u'name': u'tablename',
-                u'description': None},
+                u'name': u'tablename'},
              u'classificationNames': [u'TAG1', u'TAG2']}
         """
-        query = self._create_qualifiedname_query(type, *values)
-        response = self._search(query)
-        if response.status_code == 200:
-            json_response = response.json()
-            if json_response.has_key('entities'):
-                return self._filter_entities_on_qualifiedName(json_response['entities'], self._create_qualifiedName_prefix(*values))
-            else:
-                return []
-        else:
-            raise AtlasError(response.content, response.status_code)
+        return call_with_retry(
+            lambda: self._filter_entities_on_qualifiedName(self._search_entities(type, *values),
+                                                           self._create_qualifiedName_prefix(*values)),
+            self.http.retries, self.http.base_delay, self.http.max_delay,
+            lambda result, e: isinstance(e, SearchInterruptedError))
 
     def get_tables(self, db):
         """
@@ -100,12 +208,9 @@ class Client:
             {u'status': u'ACTIVE',
              u'guid': u'1bbe630c-927e-43f5-846b-94513db1d625',
              u'typeName': u'hive_table',
-             u'displayText': u'tablename',
              u'attributes': {
-                u'owner': u'owner',
                 u'qualifiedName': u'database.tablename@hadoopname',
-                u'name': u'tablename',
-                u'description': None},
+                u'name': u'tablename'},
              u'classificationNames': [u'TAG1', u'TAG2']}
         """
         return self._get_qualified_name("hive_table", db)
@@ -119,17 +224,71 @@ class Client:
             {u'status': u'ACTIVE',
              u'guid': u'7880d2a3-fec5-4b35-a91b-bea6c75f56b1',
              u'typeName': u'hive_column',
-             u'displayText': u'columnname',
              u'attributes': {
-                u'owner': u'user',
                 u'qualifiedName': u'database.table.columnname@hadoopname',
-                u'name': u'columnname',
-                u'description': None},
+                u'name': u'columnname'},
             u'classificationNames': [u'TAG1', u'TAG2']}
 
         """
         return self._get_qualified_name("hive_column", db, table)
 
+    def _get_db_guids(self, db):
+        """
+        :return: Guids of active hive databases named db, there is one per cluster.
+        """
+        query = {
+            'typeName': 'hive_db',
+            'excludeDeletedEntities': True,
+            'entityFilters': {'condition': 'AND',
+                              'criterion': [{'attributeName': 'name', 'operator': '=', 'attributeValue': db}]}
+        }
+        response = self._search(query)
+        if response.status_code != 200:
+            raise AtlasError(response.content, response.status_code)
+        return [e['guid'] for e in response.json().get('entities', [])
+                if e['attributes']['qualifiedName'].split('@')[0] == db]
+
+    def get_schema(self, db):
+        """
+        Get all active tables in a hive database and all their columns, following relationships from the
+        database instead of searching. The tables are read in bulk, bulk_chunk_size tables per request, with
+        their columns included as referred entities. For a database with n tables this takes 2 + n/bulk_chunk_size
+        requests, compared to 1 + n searches with get_tables and get_columns.
+        :param db: Name of database.
+        :return: (tables, columns), arrays of dicts on the same form as returned by get_tables and get_columns.
+        Tags are only those set directly on the entities.
+        """
+        table_guids = []
+        for db_guid in self._get_db_guids(db):
+            response = self.http.request('GET', self.url_prefix + "/v2/entity/guid/" + db_guid,
+                                         params={'minExtInfo': 'true'}, auth=self.auth)
+            if response.status_code != 200:
+                raise AtlasError(response.content, response.status_code)
+            relations = response.json()['entity'].get('relationshipAttributes', {}).get('tables') or []
+            table_guids.extend(t['guid'] for t in relations
+                               if t.get('entityStatus', 'ACTIVE') == 'ACTIVE' and
+                               t.get('relationshipStatus', 'ACTIVE') == 'ACTIVE')
+        tables = []
+        columns = []
+        for chunk in _chunks(table_guids, self.bulk_chunk_size):
+            response = self.http.request('GET', self.url_prefix + "/v2/entity/bulk",
+                                         params={'guid': chunk, 'minExtInfo': 'false'}, auth=self.auth)
+            if response.status_code != 200:
+                raise AtlasError(response.content, response.status_code)
+            json_response = response.json()
+            referred_entities = json_response.get('referredEntities', {})
+            for table in json_response.get('entities', []):
+                if table.get('status') == 'DELETED' or table['attributes'].get('temporary'):
+                    continue
+                tables.append(_entity_header(table))
+                column_ids = table['attributes'].get('columns') or \
+                    table.get('relationshipAttributes', {}).get('columns') or []
+                for column_id in column_ids:
+                    column = referred_entities.get(column_id['guid'])
+                    if column is not None and column.get('status') != 'DELETED':
+                        columns.append(_entity_header(column))
+        return tables, columns
+
     def add_tags_on_guid(self, guid, tags):
         """
         Add Tags to an entity.
@@ -140,7 +299,7 @@ class Client:
         for t in tags:
             tags_struct.append({"typeName": t})
 
-        response = requests.post(self.url_prefix + "/v2/entity/guid/" + guid + "/classifications", json=tags_struct, auth=self.auth)
+        response = self.http.request('POST', self.url_prefix + "/v2/entity/guid/" + guid + "/classifications", json=tags_struct, auth=self.auth)
         if response.status_code != 204:
             raise AtlasError(response.content, response.status_code)
 
@@ -152,7 +311,7 @@ class Client:
         """
         failed_tags = []
         for t in tags:
-            response = requests.delete(self.url_prefix + "/v2/entity/guid/" + guid + "/classification/" + t, auth=self.auth)
+            response = self.http.request('DELETE', self.url_prefix + "/v2/entity/guid/" + guid + "/classification/" + t, auth=self.auth)
             if response.status_code != 204:
                 failed_tags.append(t)
         if len(failed_tags) != 0:
@@ -164,7 +323,7 @@ class Client:
         :return: Array of one dict per tag. Dict is on form:
             {u'category': u'CLASSIFICATION', u'guid': u'5a76bab9-02ec-434d-bbee-1c7294f0cf31', u'name': u'PII'}
         """
-        response = requests.get(self.url_prefix + "/v2/types/typedefs/headers", auth=self.auth)
+        response = self.http.request('GET', self.url_prefix + "/v2/types/typedefs/headers", auth=self.auth)
         if response.status_code == 200:
             return [e for e in response.json() if e['category']=='CLASSIFICATION']
         else:
@@ -172,30 +331,37 @@ class Client:
 
     def add_tag_definitions(self, tags):
         """
-        Create new tag definitions in Atlas.
-        :param tags: Array of strings that are new tags. Tags must not exist in Atlas. Use known_tags() to figure out.
-        :return: None
+        Create new tag definitions in Atlas, in one request. Tags that already exist, e.g. created by a
+        concurrent run, are not an error. Atlas creates all tags in a request or none, so on conflict the
+        tags still missing are created again.
+        :param tags: Array of strings that are new tags. Use known_tags() to figure out.
+        :return: Set of tags created by this call.
         """
-        post_data={"classificationDefs": list([{"name": t, "description":"", "superTypes":[], "attributeDefs":[]} for t in tags])}
-        response=requests.post(self.url_prefix + "/v2/types/typedefs?type=classification", auth=self.auth, json=post_data)
-        if response.status_code != 200:
-            raise AtlasError(response.content, response.status_code)
+        missing_tags = set(tags)
+        while len(missing_tags) != 0:
+            post_data={"classificationDefs": list([{"name": t, "description":"", "superTypes":[], "attributeDefs":[]} for t in missing_tags])}
+            response=self.http.request('POST', self.url_prefix + "/v2/types/typedefs?type=classification", auth=self.auth, json=post_data)
+            if response.status_code == 200:
+                return missing_tags
+            if not _type_already_exists(response):
+                raise AtlasError(response.content, response.status_code)
+            existing_tags = missing_tags & set([t['name'] for t in self.known_tags()])
+            if len(existing_tags) == 0:
+                # The conflict is not on a tag, e.g. another kind of type with the same name.
+                raise AtlasError(response.content, response.status_code)
+            missing_tags = missing_tags - existing_tags
+        return missing_tags
 
     def get_tags_on_guid(self, guid):
         """
-        Return tags on the entity guid in Atlas.
+        Return tags on the entity guid in Atlas, see get_classifications to look up many entities.
         :param guid: Guid to find tags for
-        :return: List of tags.
+        :return: Set of tags.
         """
-        response = requests.get(self.url_prefix + "/entities/" + guid, auth=self.auth)
-        if response.status_code == 200:
-            json_response = response.json()
-            if json_response['definition'].has_key('traitNames'):
-                return set(json_response['definition']['traitNames'])
-            else:
-                return set()
-        else:
-            raise AtlasError("Cannot look up guid {}.".format(guid, response.status_code))
+        tags = self.get_classifications([guid])
+        if not tags.has_key(guid):
+            raise AtlasError("Cannot look up guid {}.".format(guid), 404)
+        return tags[guid]
 
     def add_hdfs_path(self, hdfs_path):
         """
@@ -205,20 +371,8 @@ class Client:
         :param hdfs_path: Full url to the file or directory hdfs://environment/my/path/
         :return: guid assigned
         """
-        cluster_name = urlutil.get_host(hdfs_path)
-        name = urlutil.get_path(hdfs_path)
         entity = {
-            "entity": {
-                "typeName": "hdfs_path",
-                "attributes": {
-                    "description": "Created/Updated by cobra-policytool.",
-                    "name": name,
-                    "qualifiedName": hdfs_path,
-                    "path": hdfs_path,
-                    "clusterName": cluster_name,
-                },
-                "guid": -1
-            },
+            "entity": _hdfs_path_entity(hdfs_path, -1),
         }
         response = self._post_entity(entity)
         if response.status_code == 200:
@@ -230,6 +384,158 @@ class Client:
         else:
             raise AtlasError(response.content, response.status_code)
 
+    def add_hdfs_paths(self, hdfs_paths):
+        """
+        Create or update many hdfs_path entities, bulk_chunk_size per request, see add_hdfs_path.
+        Post to http://atlas.hadoop.svenskaspel.se/api/atlas/v2/entity/bulk
+        :param hdfs_paths: List of full urls to files or directories.
+        :return: Dict hdfs path -> guid assigned.
+        """
+        result = {}
+        for chunk in _chunks(hdfs_paths, self.bulk_chunk_size):
+            result.update(self._add_hdfs_paths(chunk))
+        return result
+
+    def _add_hdfs_paths(self, hdfs_paths):
+        entities = [_hdfs_path_entity(hdfs_path, -(i + 1)) for (i, hdfs_path) in enumerate(hdfs_paths)]
+        response = self.http.request('POST', self.url_prefix + "/v2/entity/bulk", json={"entities": entities},
+                                     auth=self.auth)
+        if response.status_code != 200:
+            raise AtlasError(response.content, response.status_code)
+        guid_assignments = response.json().get('guidAssignments', {})
+        result = {}
+        for (i, hdfs_path) in enumerate(hdfs_paths):
+            if not guid_assignments.has_key(str(-(i + 1))):
+                raise AtlasError("Failed to add hdfs path {} content mismatch {}".format(hdfs_path, response.content))
+            result[hdfs_path] = guid_assignments[str(-(i + 1))]
+        return result
+
+    def get_classifications(self, guids, chunk_size=None):
+        """
+        Return tags on many entities, chunk_size entities per request.
+        Get http://atlas.hadoop.svenskaspel.se/api/atlas/v2/entity/bulk?guid=guid1&guid=guid2&minExtInfo=true
+        :param guids: List of guids.
+        :param chunk_size: Max number of guids per request, defaults to bulk_chunk_size of the client.
+        :return: Dict guid -> set of tags set directly on the entity, propagated tags are not included.
+        Guids of entities not found or deleted are left out.
+        """
+        result = {}
+        for chunk in _chunks(guids, chunk_size or self.bulk_chunk_size):
+            result.update(self._get_classifications(chunk))
+        return result
+
+    def _get_classifications(self, guids):
+        response = self.http.request('GET', self.url_prefix + "/v2/entity/bulk",
+                                     params={'guid': guids, 'minExtInfo': 'true', 'ignoreRelationships': 'true'},
+                                     auth=self.auth)
+        if response.status_code == 404:
+            # Atlas fails the whole request if one guid is not found, look up halves to find the others.
+            if len(guids) == 1:
+                return {}
+            result = self._get_classifications(guids[:len(guids) // 2])
+            result.update(self._get_classifications(guids[len(guids) // 2:]))
+            return result
+        if response.status_code != 200:
+            raise AtlasError(response.content, response.status_code)
+        result = {}
+        for entity in response.json().get('entities', []):
+            if entity.get('status') == 'DELETED':
+                continue
+            result[entity['guid']] = _direct_classifications(entity)
+        return result
+
+    def add_tag_on_guids(self, tag, guids):
+        """
+        Add a tag to many entities, bulk_chunk_size entities per request.
+        Post to http://atlas.hadoop.svenskaspel.se/api/atlas/v2/entity/bulk/classification
+        :param tag: Tag to add.
+        :param guids: List of guids of entities to tag.
+        """
+        for chunk in _chunks(guids, self.bulk_chunk_size):
+            post_data = {"classification": {"typeName": tag}, "entityGuids": chunk}
+            response = self.http.request('POST', self.url_prefix + "/v2/entity/bulk/classification",
+                                         json=post_data, auth=self.auth)
+            if response.status_code != 204:
+                raise AtlasError(response.content, response.status_code)
+
+    def get_hdfs_path(self, hdfs_path):
+        """
+        Look up a hdfs_path entity without creating it.
+        Get http://atlas.hadoop.svenskaspel.se/api/atlas/v2/entity/uniqueAttribute/type/hdfs_path?attr:qualifiedName=hdfs://svsprod/my/path
+        :param hdfs_path: Full url to the file or directory hdfs://environment/my/path/
+        :return: Tuple (guid, set of tags) or None if there is no such entity in Atlas.
+        """
+        response = self.http.request('GET', self.url_prefix + "/v2/entity/uniqueAttribute/type/hdfs_path",
+                                     params={'attr:qualifiedName': hdfs_path}, auth=self.auth)
+        if response.status_code == 404:
+            return None
+        elif response.status_code == 200:
+            entity = response.json()['entity']
+            return entity['guid'], _direct_classifications(entity)
+        else:
+            raise AtlasError(response.content, response.status_code)
+
+
+def _type_already_exists(response):
+    """
+    True if response is the error Atlas gives when creating a type that already exists.
+    """
+    if response.status_code == 409:
+        return True
+    try:
+        return response.json().get('errorCode') == TYPE_ALREADY_EXISTS
+    except (ValueError, AttributeError):
+        return False
+
+
+def _direct_classifications(entity):
+    """
+    :return: Set of tags set directly on the entity, propagated tags are not included.
+    """
+    return set(c['typeName'] for c in entity.get('classifications') or []
+               if c.get('entityGuid', entity['guid']) == entity['guid'])
+
+
+def _search_header(header):
+    """
+    :return: The fields used of an entity header returned by a search.
+    """
+    return {'guid': header['guid'],
+            'typeName': header.get('typeName'),
+            'status': header.get('status', 'ACTIVE'),
+            'attributes': {'qualifiedName': header['attributes']['qualifiedName'],
+                           'name': header['attributes'].get('name')},
+            'classificationNames': header.get('classificationNames') or []}
+
+
+def _entity_header(entity):
+    """
+    :return: Header of entity, on the form returned by searches.
+    """
+    return {'guid': entity['guid'],
+            'typeName': entity['typeName'],
+            'status': entity.get('status', 'ACTIVE'),
+            'attributes': {'qualifiedName': entity['attributes']['qualifiedName'],
+                           'name': entity['attributes'].get('name')},
+            'classificationNames': sorted(_direct_classifications(entity))}
+
+
+def _hdfs_path_entity(hdfs_path, guid):
+    """
+    :return: Atlas hdfs_path entity for hdfs_path, with guid, a negative number for a new entity.
+    """
+    return {
+        "typeName": "hdfs_path",
+        "attributes": {
+            "description": "Created/Updated by cobra-policytool.",
+            "name": urlutil.get_path(hdfs_path),
+            "qualifiedName": hdfs_path,
+            "path": hdfs_path,
+            "clusterName": urlutil.get_host(hdfs_path),
+        },
+        "guid": guid
+    }
+
 
 class AtlasError(Exception):
     def __init__(self, message, http_code=None):
@@ -238,3 +544,9 @@ class AtlasError(Exception):
 
     def __str__(self):
         return "HTTP code: " + repr(self.http_code) + " Message: " + repr(self.message)
+
+
+class SearchInterruptedError(AtlasError):
+    """
+    Raised when the connection breaks while a streamed search response is read.
+    """
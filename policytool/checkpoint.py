@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+
+
+class Journal:
+    """
+    Checkpoint journal of entities synced to Atlas, used to resume an interrupted sync.
+    Each synced entity is appended to the journal file as one JSON object per line:
+        {"phase": "table", "entity": "schema.table", "tags": ["TAG1"], "added": ["TAG1"], "deleted": []}
+    An entity is only regarded as done if it was synced with the same tags as expected now, so a
+    changed source file is synced again even when resuming.
+    Without a path the journal is only kept in memory.
+    The journal file is kept open for appending until the journal is closed or removed.
+    """
+
+    def __init__(self, path=None, resume=False, fsync=False):
+        """
+        :param path: File to write the journal to, or None to not persist it.
+        :param resume: If true entities in an existing journal file are regarded as done,
+        otherwise the journal file is truncated.
+        :param fsync: If true each record is synced to disk, not only flushed to the OS.
+        """
+        self.path = path
+        self._done = {}
+        self._lock = threading.Lock()
+        self._fsync = fsync
+        self._file = None
+        if path is not None:
+            if resume and os.path.exists(path):
+                self._load()
+                self._file = open(path, 'a')
+            else:
+                self._file = open(path, 'w')
+
+    def _load(self):
+        with open(self.path) as f:
+            for line in f:
+                if line.strip() == '':
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Last line may be half written if the process was killed.
+                    continue
+                self._done[(entry['phase'], entry['entity'])] = frozenset(entry['tags'])
+
+    def is_done(self, phase, entity, expected_tags):
+        """
+        :param phase: What kind of sync, e.g. table, column or storage.
+        :param entity: Name of the entity, e.g. schema.table.
+        :param expected_tags: Set of tags the entity shall have.
+        :return: True if entity is synced with expected_tags according to the journal.
+        """
+        return self._done.get((phase, entity)) == frozenset(expected_tags)
+
+    def record(self, phase, entity, expected_tags, added=(), deleted=()):
+        """
+        Mark entity as synced.
+        :param phase: What kind of sync, e.g. table, column or storage.
+        :param entity: Name of the entity, e.g. schema.table.
+        :param expected_tags: Set of tags the entity now has.
+        :param added: Tags added to the entity.
+        :param deleted: Tags deleted from the entity.
+        """
+        with self._lock:
+            self._done[(phase, entity)] = frozenset(expected_tags)
+            if self._file is not None:
+                entry = {'phase': phase, 'entity': entity, 'tags': sorted(expected_tags),
+                         'added': sorted(added), 'deleted': sorted(deleted)}
+                self._file.write(json.dumps(entry) + '\n')
+                self._file.flush()
+                if self._fsync:
+                    os.fsync(self._file.fileno())
+
+    def __len__(self):
+        return len(self._done)
+
+    def close(self):
+        """
+        Close the journal file, keeping it to resume from.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def remove(self):
+        """
+        Remove the journal file, to be called when the sync is completed.
+        """
+        self.close()
+        self._done = {}
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
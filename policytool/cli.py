@@ -2,22 +2,30 @@
 from __future__ import print_function
 import click
 from click import ClickException
-from requests_kerberos import HTTPKerberosAuth
-import atlas
-import hive
-import policycache
-import tagsync
-import ranger
-import rangersync
+import checkpoint
+import configfile
+import instrumentation
+import plan
 from policytool.configfile import JSONPropertiesFile
-from template import Context
+import copy
 import os
 import os.path
 import json
+import threading
 from collections import defaultdict
 
+# Modules talking to Atlas, Ranger and Hive import requests, Kerberos and Thrift libraries, which are slow to
+# import. They are imported in the functions using them, to keep --help and config errors fast.
 
-SLEEP_ON_RETRY_SECONDS = 60
+
+RETRY_DELAY_SECONDS = 10
+MAX_RETRY_DELAY_SECONDS = 120
+# Retries of a single request to Atlas, Ranger or Hive, override with 'request_retries' in config.
+REQUEST_RETRIES = 3
+
+
+def _default_checkpoint_file(environment):
+    return ".cobra-policytool-{}.checkpoint".format(environment)
 
 
 def _missing_files(files):
@@ -29,12 +37,89 @@ def _missing_files(files):
 
 
 @click.group()
-def cli():
-    pass
-
-
-def _tags_to_atlas(srcdir, environment, hdfs, retry, verbose, config, tabletagfile, columntagfile):
-    conf = JSONPropertiesFile(config).get(environment)
+@click.option('--metrics-file', help='Write counts, latencies, bytes and retries of requests to Atlas, Ranger '
+                                     'and Hive to this file when the command is done.', type=click.Path())
+@click.option('--metrics-format', help='Format of metrics file.', type=click.Choice(['json', 'prometheus']),
+              default='json')
+@click.option('--profile', 'profile_file', help='Profile the command and write a pstats file, then print hotspots '
+                                                'split into local CPU and Atlas/Ranger/Hive I/O.', type=click.Path())
+@click.option('--profile-sample-interval', help='Also sample stacks of all threads with this interval in seconds, '
+                                                'written to <profile>.samples.', type=float)
+@click.pass_context
+def cli(ctx, metrics_file, metrics_format, profile_file, profile_sample_interval):
+    if metrics_file is not None:
+        recorder = instrumentation.Recorder()
+        instrumentation.set_recorder(recorder)
+        ctx.call_on_close(lambda: recorder.write(metrics_file, metrics_format))
+    if profile_file is not None:
+        import profiling
+        profiler = profiling.Profiler(profile_sample_interval)
+
+        def write_profile():
+            profiler.stop()
+            profiler.write(profile_file)
+            profiler.print_hotspots(echo=lambda line: click.echo(line, err=True))
+
+        profiler.start()
+        ctx.call_on_close(write_profile)
+
+
+def _run_for_environments(environments, run_environment, parallel):
+    """
+    Run run_environment for each environment, concurrently if there are many environments.
+    Output from an environment is buffered and printed when it is done, to not mix output between environments.
+    :param environments: List of environment names.
+    :param run_environment: Function taking (environment, echo) where echo is a function to print a line.
+    :param parallel: Max number of environments to run at the same time.
+    :return: Dict environment -> exception or None if successful.
+    """
+    from multiprocessing.pool import ThreadPool
+    if len(environments) == 1:
+        run_environment(environments[0], print)
+        return {environments[0]: None}
+
+    print_lock = threading.Lock()
+
+    def run(environment):
+        lines = []
+        error = None
+        try:
+            run_environment(environment, lines.append)
+        except Exception as e:
+            error = e
+        with print_lock:
+            print("=== {} ===".format(environment))
+            for line in lines:
+                print(line)
+        return environment, error
+
+    pool = ThreadPool(min(parallel, len(environments)))
+    try:
+        return dict(pool.map(run, environments))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _print_environment_summary(results):
+    failed = [env for env in results if results[env] is not None]
+    if len(results) > 1:
+        print("Summary:")
+        for env in sorted(results):
+            if results[env] is None:
+                print("  {}: done".format(env))
+            else:
+                print("  {}: FAILED {}".format(env, results[env]))
+    if len(failed) != 0:
+        raise ClickException("Not complete for environment(s) {}, fix errors and re-run.".format(", ".join(failed)))
+
+
+def _tags_to_atlas(srcdir, environments, hdfs, retry, verbose, config, tabletagfile, columntagfile,
+                   checkpoint_file=None, resume=False, parallel=4, plan_out=None):
+    import tagsync
+    if isinstance(environments, basestring):
+        environments = [environments]
+    properties = JSONPropertiesFile(config)
     table_file = os.path.join(srcdir, tabletagfile)
     column_file = os.path.join(srcdir, columntagfile)
     missing_files = _missing_files([table_file, column_file])
@@ -43,64 +128,189 @@ def _tags_to_atlas(srcdir, environment, hdfs, retry, verbose, config, tabletagfi
         print("Will not run, exiting!")
         return 0
 
-    auth = HTTPKerberosAuth()
-    atlas_client = atlas.Client(conf['atlas_api_url'], auth=auth)
+    src_data_table = tagsync.read_file(table_file)
+    src_data_column = tagsync.read_file(column_file)
+    # All tags are created in the first sync against each Atlas, and not again by the syncs of other environments.
+    tag_definitions = _shared_tag_definitions(tagsync.tags_from_src(src_data_table) |
+                                              tagsync.tags_from_src(src_data_column))
+
+    tag_plans = plan.new_plan()
+
+    def run_environment(environment, echo):
+        conf = properties.get(environment)
+        if plan_out is not None:
+            tag_plan = _plan_tags_for_environment(
+                conf, environment,
+                copy.deepcopy(src_data_table), copy.deepcopy(src_data_column), hdfs, tag_definitions(conf))
+            plan.add_environment_plan(tag_plans, environment, 'tags', tag_plan)
+            echo("Planned {} tag changes for {}.".format(len(tag_plan['changes']), environment))
+            return
+        if checkpoint_file is None:
+            # Without --resume there is nothing to continue from, only write a checkpoint file when asked for.
+            environment_checkpoint_file = _default_checkpoint_file(environment) if resume else None
+        elif len(environments) > 1:
+            environment_checkpoint_file = "{}.{}".format(checkpoint_file, environment)
+        else:
+            environment_checkpoint_file = checkpoint_file
+        _tags_to_atlas_for_environment(
+            conf, environment,
+            copy.deepcopy(src_data_table), copy.deepcopy(src_data_column),
+            hdfs, retry, verbose, environment_checkpoint_file, resume, echo, tag_definitions(conf))
+
+    results = _run_for_environments(list(environments), run_environment, parallel)
+    _save_plan_if_complete(tag_plans, plan_out, results)
+    _print_environment_summary(results)
+
+
+def _save_plan_if_complete(plans, plan_out, results):
+    if plan_out is not None and all(error is None for error in results.values()):
+        plan.save(plans, plan_out)
+        print("Plan saved to {}, apply it with apply_plan.".format(plan_out))
+
+
+def _atlas_client(conf):
+    import atlas
+    return atlas.Client(conf['atlas_api_url'], auth=configfile.kerberos_auth(),
+                        retries=conf.get('request_retries', REQUEST_RETRIES),
+                        bulk_chunk_size=conf.get('atlas_bulk_chunk_size', atlas.BULK_CHUNK_SIZE),
+                        query_strategy=conf.get('atlas_query_strategy', atlas.BASIC_SEARCH))
+
+
+def _shared_tag_definitions(required_tags=()):
+    """
+    :param required_tags: Tags to create in every Atlas, with the tags of the first sync against it.
+    :return: Function taking the config of an environment and returning the tagsync.TagDefinitions of its Atlas,
+    shared by all environments with the same atlas_api_url.
+    """
+    import tagsync
+    tag_definitions = {}
+    lock = threading.Lock()
+
+    def for_environment(conf):
+        with lock:
+            url = conf['atlas_api_url']
+            if not tag_definitions.has_key(url):
+                tag_definitions[url] = tagsync.TagDefinitions(_atlas_client(conf), required_tags=required_tags)
+            return tag_definitions[url]
+    return for_environment
+
+
+def _atlas_and_hive_clients(conf, hdfs):
+    request_retries = conf.get('request_retries', REQUEST_RETRIES)
+    atlas_client = _atlas_client(conf)
     hive_client = None
     if hdfs:
-        hive_client = hive.Client(conf['hive_server'], conf['hive_port'])
-    sync_client = tagsync.Sync(atlas_client, retry*conf.get('retries', 1), SLEEP_ON_RETRY_SECONDS, hive_client)
+        import hive
+        hive_client = hive.client_from_config(conf, request_retries)
+        if hive_client is None:
+            raise ClickException("Hive must be configured to set tags on hdfs directories, "
+                                 "set hive_server or hive_backend in config.")
+    return atlas_client, hive_client
+
+
+def _close_hive_client(hive_client):
+    if hive_client is not None:
+        hive_client.close()
+
+
+def _hdfs_path_cache(conf):
+    import pathcache
+    return pathcache.HdfsPathCache(conf.get('hdfs_path_cache'))
+
+
+def _plan_tags_for_environment(conf, environment, src_data_table, src_data_column, hdfs, tag_definitions=None):
+    import tagsync
+    (atlas_client, hive_client) = _atlas_and_hive_clients(conf, hdfs)
+    sync_client = tagsync.Sync(atlas_client, hive_client=hive_client, hdfs_path_cache=_hdfs_path_cache(conf),
+                               fetch_whole_schemas=conf.get('atlas_fetch_whole_schemas', False),
+                               tag_definitions=tag_definitions)
+    try:
+        return sync_client.plan(tagsync.add_environment(src_data_table, environment),
+                                tagsync.add_environment(src_data_column, environment),
+                                storage=hdfs)
+    except (tagsync.SyncError, IOError) as e:
+        raise ClickException(e.message)
+    finally:
+        _close_hive_client(hive_client)
+
+
+def _tags_to_atlas_for_environment(conf, environment, src_data_table, src_data_column, hdfs, retry, verbose,
+                                   checkpoint_file, resume, echo, tag_definitions=None):
+    import tagsync
+    (atlas_client, hive_client) = _atlas_and_hive_clients(conf, hdfs)
+    journal = checkpoint.Journal(checkpoint_file, resume)
+    if resume and verbose > 0:
+        echo("Resuming from checkpoint {} with {} synced entities.".format(checkpoint_file, len(journal)))
+    sync_client = tagsync.Sync(atlas_client, retry*conf.get('retries', 1), RETRY_DELAY_SECONDS, hive_client,
+                               MAX_RETRY_DELAY_SECONDS, journal, hdfs_path_cache=_hdfs_path_cache(conf),
+                               fetch_whole_schemas=conf.get('atlas_fetch_whole_schemas', False),
+                               tag_definitions=tag_definitions)
 
     try:
         if verbose > 0:
-            print("Syncing tags for tables.")
-        src_data_table = tagsync.read_file(table_file)
+            echo("Syncing tags for tables.")
         log = sync_client.sync_table_tags(tagsync.add_environment(src_data_table, environment))
         if verbose > 0:
-            tagsync.print_sync_worklog(log)
-            print("Syncing tags for columns.")
-        src_data_column = tagsync.read_file(column_file)
+            tagsync.print_sync_worklog(log, echo)
+            echo("Syncing tags for columns.")
         log = sync_client.sync_column_tags(tagsync.add_environment(src_data_column, environment))
         if verbose > 0:
-            tagsync.print_sync_worklog(log)
+            tagsync.print_sync_worklog(log, echo)
         if hdfs:
             if verbose > 0:
-                print("Syncing tags for table storage.")
+                echo("Syncing tags for table storage.")
             log = sync_client.sync_table_storage_tags(src_data_table)
             if verbose > 0:
-                tagsync.print_sync_worklog(log)
+                tagsync.print_sync_worklog(log, echo)
     except (tagsync.SyncError, IOError) as e:
-        raise ClickException(e.message + "\nTag sync not complete, fix errors and re-run.")
+        if checkpoint_file is None:
+            raise ClickException(e.message + "\nTag sync not complete, fix errors and re-run. "
+                                             "Use --checkpoint to be able to resume an interrupted sync.")
+        raise ClickException(e.message + "\nTag sync not complete, fix errors and re-run. "
+                                         "Use --resume to continue from checkpoint {}.".format(checkpoint_file))
+    finally:
+        journal.close()
+        _close_hive_client(hive_client)
+    journal.remove()
 
 
 @cli.command("tags_to_atlas", help="sync tags from source files to Atlas.")
 @click.option('-s', '--srcdir', help='The schema for the generated table', default='src/main/tags')
-@click.option('-e', '--environment', help='Destination environment', required=True)
+@click.option('-e', '--environment', help='Destination environment, can be given many times.',
+              required=True, multiple=True)
 @click.option('--hdfs/--no-hdfs', help='Set tags on hive tables corresponding hdfs directory.', default=False)
 @click.option('-r', '--retry', help='Retry on fail. Number of retries is controlled by \'retries\' in config.', count=True)
 @click.option('-v', '--verbose', help='Provide verbose output', count=True)
 @click.option('-c', '--config', help='Config file', type=click.Path(exists=True))
 @click.option('--tabletagfile', help='The source file for table tags file', default='table_tags.csv')
 @click.option('--columntagfile', help='The source file for column tags file', default='column_tags.csv')
-def tags_to_atlas(srcdir, environment, hdfs, retry, verbose, config, tabletagfile, columntagfile):
-    _tags_to_atlas(srcdir, environment, hdfs, retry, verbose, config, tabletagfile, columntagfile)
-
-
-def _rules_to_ranger_cmd(srcdir, project_name, environment, config, verbose, dryrun, tabletagfile, columntagfile, policyfile):
-    conf = JSONPropertiesFile(config).get(environment)
+@click.option('--checkpoint', 'checkpoint_file',
+              help='Checkpoint file recording synced tables and columns, removed when sync is complete. '
+                   'With --resume it defaults to .cobra-policytool-<environment>.checkpoint.')
+@click.option('--resume', help='Resume an interrupted sync, skip tables and columns in the checkpoint file.',
+              is_flag=True)
+@click.option('--parallel', help='Max number of environments to sync at the same time.', default=4, type=int)
+@click.option('--plan-out', help='Do not change Atlas, save the changes to do in this plan file instead.',
+              type=click.Path())
+def tags_to_atlas(srcdir, environment, hdfs, retry, verbose, config, tabletagfile, columntagfile,
+                  checkpoint_file, resume, parallel, plan_out):
+    _tags_to_atlas(srcdir, environment, hdfs, retry, verbose, config, tabletagfile, columntagfile,
+                   checkpoint_file, resume, parallel, plan_out)
+
+
+def _read_project_sources(srcdir, tabletagfile, columntagfile, policyfile):
+    """
+    Read source files for a project.
+    :return: (tables, table_columns, policy_commands) or None if a file is missing.
+    """
+    import tagsync
     table_file = os.path.join(srcdir, tabletagfile)
     column_file = os.path.join(srcdir, columntagfile)
     policy_file = os.path.join(srcdir, policyfile)
     missing_files = _missing_files([table_file, column_file, policy_file])
     if len(missing_files) != 0:
-        print("Following files are missing: " ", ".join(missing_files))
-        print("Will not run, exiting!")
-        return 0
-
-    ranger_server = conf['ranger_api_url']
-
-    auth = HTTPKerberosAuth()
-    ranger_client = ranger.Client(ranger_server, auth=auth)
-    sync_client = rangersync.RangerSync(ranger_client, verbose, dryrun)
+        print("Following files are missing: " + ", ".join(missing_files))
+        return None
 
     tables = tagsync.read_file(table_file)
     columns = tagsync.read_file(column_file)
@@ -109,6 +319,49 @@ def _rules_to_ranger_cmd(srcdir, project_name, environment, config, verbose, dry
     for column in columns:
         table_columns["{}.{}".format(column['schema'], column['table'])].append(column)
 
+    with open(policy_file, 'rU') as f:
+        policy_commands = json.load(f)
+    return tables, table_columns, policy_commands
+
+
+def _rules_to_ranger_cmd(srcdir, project_name, environments, config, verbose, dryrun, tabletagfile, columntagfile,
+                         policyfile, parallel=4, plan_out=None):
+    if isinstance(environments, basestring):
+        environments = [environments]
+    properties = JSONPropertiesFile(config)
+    sources = _read_project_sources(srcdir, tabletagfile, columntagfile, policyfile)
+    if sources is None:
+        print("Will not run, exiting!")
+        return 0
+    (tables, table_columns, policy_commands) = sources
+
+    policy_plans = plan.new_plan()
+
+    def run_environment(environment, echo):
+        policy_plan = _rules_to_ranger_for_environment(
+            properties.get(environment), project_name, environment, verbose, dryrun or plan_out is not None,
+            tables, table_columns, policy_commands, echo)
+        plan.add_environment_plan(policy_plans, environment, 'ranger', policy_plan)
+
+    results = _run_for_environments(list(environments), run_environment, parallel)
+    _save_plan_if_complete(policy_plans, plan_out, results)
+    _print_environment_summary(results)
+
+
+def _ranger_client(conf):
+    import ranger
+    return ranger.Client(conf['ranger_api_url'], auth=configfile.kerberos_auth(),
+                         retries=conf.get('request_retries', REQUEST_RETRIES))
+
+
+def _ranger_and_hive_clients(conf):
+    import hive
+    return _ranger_client(conf), hive.client_from_config(conf, conf.get('request_retries', REQUEST_RETRIES))
+
+
+def _expand_project_policies(conf, project_name, environment, tables, table_columns, policy_commands, hive_client):
+    import rangersync
+    from template import Context
     context_dict = {
         "project_name": project_name,
         "environment": environment,
@@ -116,37 +369,297 @@ def _rules_to_ranger_cmd(srcdir, project_name, environment, config, verbose, dry
         "table_columns": table_columns,
     }
 
-    if conf.has_key('hive_server'):
-        context_dict['hive_client'] = hive.Client(conf['hive_server'], conf['hive_port'])
+    if hive_client is not None:
+        context_dict['hive_client'] = hive_client
 
     # Add variables from config to context_dict.
     for var in conf.get('variables', []):
         context_dict[var['name']] = var['value']
 
     context = Context(context_dict)
+    return rangersync.apply_commands(policy_commands, context)
 
-    with open(policy_file, 'rU') as f:
-        policy_commands = json.load(f)
 
-    policies = rangersync.apply_commands(policy_commands, context)
-    sync_client.sync_policies([project_name + '_' + environment, 'load_etl_'], policies)
+def _project_prefixes(project_name, environment):
+    return [project_name + '_' + environment, 'load_etl_']
+
+
+def _rules_to_ranger_for_environment(conf, project_name, environment, verbose, dryrun, tables, table_columns,
+                                     policy_commands, echo=print):
+    """
+    Plan changes of policies in Ranger for a project and apply them unless dryrun.
+    :return: The plan, see rangersync.RangerSync.plan_projects.
+    """
+    import rangersync
+    (ranger_client, hive_client) = _ranger_and_hive_clients(conf)
+    sync_client = rangersync.RangerSync(ranger_client, verbose, dryrun, echo)
+    try:
+        policies = _expand_project_policies(
+            conf, project_name, environment, tables, table_columns, policy_commands, hive_client)
+    finally:
+        _close_hive_client(hive_client)
+    policy_plan = sync_client.plan_policies(_project_prefixes(project_name, environment), policies)
+    if dryrun:
+        _print_policy_plan(policy_plan, echo)
+    else:
+        sync_client.apply_plan(policy_plan)
+    return policy_plan
+
+
+def _print_policy_plan(policy_plan, echo):
+    for policy in policy_plan['delete']:
+        echo("Delete {}.{}".format(policy['service'], policy['name']))
+    for policy in policy_plan['create']:
+        echo("Create {}.{}".format(policy['service'], policy['name']))
+    for update in policy_plan['update']:
+        echo("Update {}.{}".format(update['policy']['service'], update['policy']['name']))
 
 
 @cli.command("rules_to_ranger", help="Synchronize rules from a file to Ranger")
 @click.option('-s', '--srcdir', help='The schema for the generated table', default='src/main/tags')
 @click.option('-p', '--project-name', help='Project to create rules for', required=True)
-@click.option('-e', '--environment', help='Destination environment', default='dev')
+@click.option('-e', '--environment', help='Destination environment, can be given many times.',
+              default=['dev'], multiple=True)
 @click.option('-c', '--config', help='Config file', type=click.Path(exists=True))
 @click.option('-v', '--verbose', help='Provide verbose output', count=True)
 @click.option('--dryrun', help='Show commands, but do not update.', is_flag=True)
 @click.option('--tabletagfile', help='The source file for table tags file', default='table_tags.csv')
 @click.option('--columntagfile', help='The source file for column tags file', default='column_tags.csv')
 @click.option('--policyfile', help='The source file for policy file', default='ranger_policies.json')
-def rules_to_ranger_cmd(srcdir, project_name, environment, config, verbose, dryrun, tabletagfile, columntagfile, policyfile):
-    _rules_to_ranger_cmd(srcdir, project_name, environment, config, verbose, dryrun, tabletagfile, columntagfile, policyfile)
+@click.option('--parallel', help='Max number of environments to sync at the same time.', default=4, type=int)
+@click.option('--plan-out', help='Do not change Ranger, save the changes to do in this plan file instead.',
+              type=click.Path())
+def rules_to_ranger_cmd(srcdir, project_name, environment, config, verbose, dryrun, tabletagfile, columntagfile,
+                        policyfile, parallel, plan_out):
+    _rules_to_ranger_cmd(srcdir, project_name, environment, config, verbose, dryrun, tabletagfile, columntagfile,
+                         policyfile, parallel, plan_out)
+
+
+def _apply_plan(plan_file, config, verbose, parallel):
+    import rangersync
+    import tagsync
+    properties = JSONPropertiesFile(config)
+    try:
+        plans = plan.load(plan_file)
+    except plan.PlanError as e:
+        raise ClickException(e.message)
+    environments = sorted(plans['environments'])
+    if len(environments) == 0:
+        print("Plan {} has no environments, nothing to apply.".format(plan_file))
+        return 0
+    # Tags of environments sharing an Atlas are created together by the first of them.
+    tag_definitions = _shared_tag_definitions()
+    for environment in environments:
+        conf = properties.get(environment)
+        if plans['environments'][environment].has_key('tags') and conf.has_key('atlas_api_url'):
+            tag_definitions(conf).require(plans['environments'][environment]['tags']['tag_definitions'])
+
+    def run_environment(environment, echo):
+        conf = properties.get(environment)
+        environment_plan = plans['environments'][environment]
+        if environment_plan.has_key('tags'):
+            tag_plan = environment_plan['tags']
+            (atlas_client, hive_client) = _atlas_and_hive_clients(conf, False)
+            log = tagsync.Sync(atlas_client, hdfs_path_cache=_hdfs_path_cache(conf),
+                               tag_definitions=tag_definitions(conf)).apply_plan(tag_plan, parallel)
+            if verbose > 0:
+                tagsync.print_sync_worklog(log, echo)
+            echo("Applied {} tag changes to {}.".format(len(tag_plan['changes']), environment))
+        if environment_plan.has_key('ranger'):
+            policy_plan = environment_plan['ranger']
+            ranger_client = _ranger_client(conf)
+            rangersync.RangerSync(ranger_client, verbose, echo=echo).apply_plan(policy_plan, parallel)
+            echo("Applied {} deletes, {} creates and {} updates of policies to {}.".format(
+                len(policy_plan['delete']), len(policy_plan['create']), len(policy_plan['update']), environment))
+
+    _print_environment_summary(_run_for_environments(environments, run_environment, len(environments)))
+
+
+@cli.command("apply_plan", help="Apply a plan saved with --plan-out by tags_to_atlas or rules_to_ranger.")
+@click.option('--plan', 'plan_file', help='Plan file to apply.', type=click.Path(exists=True), required=True)
+@click.option('-c', '--config', help='Config file', type=click.Path(exists=True))
+@click.option('-v', '--verbose', help='Provide verbose output', count=True)
+@click.option('--parallel', help='Max number of changes to apply at the same time per environment.',
+              default=4, type=int)
+def apply_plan(plan_file, config, verbose, parallel):
+    _apply_plan(plan_file, config, verbose, parallel)
+
+
+def _serve(srcdir, environment, project_name, config, hdfs, interval, verbose, tabletagfile, columntagfile,
+           policyfile, reconcile_interval=3600):
+    import daemon
+    import rangersync
+    import tagsync
+    conf = JSONPropertiesFile(config).get(environment)
+    # Clients are created once, connections and known tags are reused between syncs.
+    (atlas_client, hive_client) = _atlas_and_hive_clients(conf, hdfs)
+    sync_client = tagsync.Sync(atlas_client, hive_client=hive_client, cache_known_tags=True,
+                               hdfs_path_cache=_hdfs_path_cache(conf),
+                               fetch_whole_schemas=conf.get('atlas_fetch_whole_schemas', False))
+    policy_file = None
+    sync_policies = None
+    ranger_hive_client = None
+    if project_name is not None:
+        policy_file = os.path.join(srcdir, policyfile)
+        (ranger_client, ranger_hive_client) = _ranger_and_hive_clients(conf)
+        ranger_sync = rangersync.RangerSync(ranger_client, verbose)
+
+        def sync_policies(tables, table_columns, policy_commands):
+            policies = _expand_project_policies(
+                conf, project_name, environment, tables, table_columns, policy_commands, ranger_hive_client)
+            policy_plan = ranger_sync.plan_policies(_project_prefixes(project_name, environment), policies)
+            ranger_sync.apply_plan(policy_plan)
+            return policy_plan
+
+    sync_daemon = daemon.Daemon(environment, os.path.join(srcdir, tabletagfile), os.path.join(srcdir, columntagfile),
+                                sync_client, hdfs, policy_file, sync_policies, verbose,
+                                reconcile_interval=reconcile_interval if reconcile_interval > 0 else None)
+    print("Watching {} for changes every {} seconds, syncing to {}.".format(srcdir, interval, environment))
+    try:
+        sync_daemon.serve(interval)
+    finally:
+        _close_hive_client(hive_client)
+        _close_hive_client(ranger_hive_client)
+
+
+@cli.command("serve", help="Keep running and sync tags, and policies if project name is given, each time the "
+                           "source files change. Only tables and columns with changed tags are synced.")
+@click.option('-s', '--srcdir', help='The schema for the generated table', default='src/main/tags')
+@click.option('-e', '--environment', help='Destination environment', required=True)
+@click.option('-p', '--project-name', help='Project to also sync Ranger policies for.')
+@click.option('-c', '--config', help='Config file', type=click.Path(exists=True))
+@click.option('--hdfs/--no-hdfs', help='Set tags on hive tables corresponding hdfs directory.', default=False)
+@click.option('--interval', help='Seconds between checks of source files for changes.', default=5.0, type=float)
+@click.option('--reconcile-interval', help='Seconds between syncs of everything, correcting changes made directly '
+                                           'in Atlas or Ranger. 0 to only sync everything at start.',
+              default=3600.0, type=float)
+@click.option('-v', '--verbose', help='Provide verbose output', count=True)
+@click.option('--tabletagfile', help='The source file for table tags file', default='table_tags.csv')
+@click.option('--columntagfile', help='The source file for column tags file', default='column_tags.csv')
+@click.option('--policyfile', help='The source file for policy file', default='ranger_policies.json')
+def serve(srcdir, environment, project_name, config, hdfs, interval, reconcile_interval, verbose, tabletagfile,
+          columntagfile, policyfile):
+    _serve(srcdir, environment, project_name, config, hdfs, interval, verbose, tabletagfile, columntagfile,
+           policyfile, reconcile_interval)
+
+
+def _read_manifest(manifest):
+    """
+    Read a manifest of projects for rules_to_ranger_batch. Manifest is a json file on the form
+    {"projects": [{"project_name": "my_project", "srcdir": "my_project/src/main/tags"}, ...]}
+    where srcdir is relative to the manifest. A project can also set tabletagfile, columntagfile and policyfile.
+    """
+    with open(manifest) as f:
+        projects = json.load(f)['projects']
+    base_dir = os.path.dirname(os.path.abspath(manifest))
+    for project in projects:
+        project['srcdir'] = os.path.join(base_dir, project['srcdir'])
+    return projects
+
+
+def _rules_to_ranger_batch(manifest, environments, config, verbose, dryrun, tabletagfile, columntagfile, policyfile,
+                           parallel=4):
+    import rangersync
+    properties = JSONPropertiesFile(config)
+    projects = []
+    for project in _read_manifest(manifest):
+        sources = _read_project_sources(project['srcdir'],
+                                        project.get('tabletagfile', tabletagfile),
+                                        project.get('columntagfile', columntagfile),
+                                        project.get('policyfile', policyfile))
+        if sources is None:
+            print("Will not run, exiting!")
+            return 0
+        projects.append((project['project_name'], sources))
+
+    def run_environment(environment, echo):
+        conf = properties.get(environment)
+        (ranger_client, hive_client) = _ranger_and_hive_clients(conf)
+        locations = None
+        if hive_client is not None:
+            # Share locations between projects, each table is looked up once.
+            from hive import LocationCache
+            locations = LocationCache(hive_client)
+        project_policies = []
+        try:
+            for (project_name, (tables, table_columns, policy_commands)) in projects:
+                policies = _expand_project_policies(
+                    conf, project_name, environment, tables, table_columns, policy_commands, locations)
+                project_policies.append((_project_prefixes(project_name, environment), policies))
+        finally:
+            _close_hive_client(hive_client)
+        rangersync.RangerSync(ranger_client, verbose, dryrun, echo).sync_projects(project_policies)
+        echo("Synced {} projects.".format(len(projects)))
+
+    _print_environment_summary(_run_for_environments(list(environments), run_environment, parallel))
+
+
+@cli.command("rules_to_ranger_batch", help="Synchronize rules for many projects listed in a manifest to Ranger. "
+                                           "Current policies are fetched once per service for all projects.")
+@click.option('-m', '--manifest', help='Json file listing projects and their source directories.',
+              type=click.Path(exists=True), required=True)
+@click.option('-e', '--environment', help='Destination environment, can be given many times.',
+              default=['dev'], multiple=True)
+@click.option('-c', '--config', help='Config file', type=click.Path(exists=True))
+@click.option('-v', '--verbose', help='Provide verbose output', count=True)
+@click.option('--dryrun', help='Show commands, but do not update.', is_flag=True)
+@click.option('--tabletagfile', help='Default source file for table tags file', default='table_tags.csv')
+@click.option('--columntagfile', help='Default source file for column tags file', default='column_tags.csv')
+@click.option('--policyfile', help='Default source file for policy file', default='ranger_policies.json')
+@click.option('--parallel', help='Max number of environments to sync at the same time.', default=4, type=int)
+def rules_to_ranger_batch(manifest, environment, config, verbose, dryrun, tabletagfile, columntagfile, policyfile,
+                          parallel):
+    _rules_to_ranger_batch(manifest, environment, config, verbose, dryrun, tabletagfile, columntagfile, policyfile,
+                           parallel)
+
+
+def _print_tag_audit(src_data_table, src_data_column, full_tables_atlas, full_columns_atlas):
+    """
+    Print differences between source files and tables and columns in Atlas.
+    :param full_tables_atlas: Tables in Atlas, see tagsync.Sync.get_tables_for_schema_from_atlas.
+    :param full_columns_atlas: Columns in Atlas, see tagsync.Sync.get_columns_for_tables_from_atlas.
+    """
+    import tagsync
+    # Tables only in Atlas
+    tables_atlas = set(full_tables_atlas.keys())
+    tables_src = set(tagsync.tables_from_src(src_data_table))
+    tables_only_atlas = tables_atlas-tables_src
+    if len(tables_only_atlas) != 0:
+        print("Tables only found in Atlas schema: %s" % (", ".join(tables_only_atlas).decode("utf-8")))
+    tables_only_src = tables_src-tables_atlas
+    # Tables only in Metadata
+    if len(tables_only_src) != 0:
+        print("Tables only found in metadata schema: %s" % (", ".join(tables_only_src).decode("utf-8")))
+
+    # Columns only in Metadata
+    # Note: columns only in Atlas can right know not be done since we not know all columns in source.
+    columns_atlas = set(full_columns_atlas.keys())
+    columns_src = set(tagsync.columns_from_src(src_data_column))
+    column_only_src = columns_src-columns_atlas
+    if len(column_only_src) != 0:
+        print("Columns only found in metadata: %s" % (", ".join(column_only_src).decode("utf-8")))
+
+    # Tag diffs on tables
+    diffs = tagsync.diff_table_tags(src_data_table, full_tables_atlas)
+    for d in diffs:
+        (only_src, only_atlas) = diffs[d]
+        if len(only_src) != 0:
+            print("Atlas missing following tags for table: %s tags: %s" % (d, ", ".join(only_src).decode("utf-8")))
+        if len(only_atlas) != 0:
+            print("Metadata missing following tags for table: %s tags: %s" % (d, ", ".join(only_atlas).decode("utf-8")))
+
+    # Tag diffs on columns
+    diffs = tagsync.diff_column_tags(src_data_column, full_columns_atlas)
+    for d in diffs:
+        (only_src, only_atlas) = diffs[d]
+        if len(only_src) != 0:
+            print("Atlas missing following tags for column: %s tags: %s" % (d, ", ".join(only_src).decode("utf-8")))
+        if len(only_atlas) != 0:
+            print("Metadata missing following tags for column: %s tags: %s" % (d, ", ".join(only_atlas).decode("utf-8")))
 
 
 def _audit(srcdir, environment, config, tabletagfile, columntagfile):
+    import tagsync
     conf = JSONPropertiesFile(config).get(environment)
     table_file = os.path.join(srcdir, tabletagfile)
     column_file = os.path.join(srcdir, columntagfile)
@@ -156,9 +669,8 @@ def _audit(srcdir, environment, config, tabletagfile, columntagfile):
         print("Will not run, exiting!")
         return 0
 
-    auth = HTTPKerberosAuth()
-    atlas_client = atlas.Client(conf['atlas_api_url'], auth=auth)
-    sync_client = tagsync.Sync(atlas_client)
+    atlas_client = _atlas_client(conf)
+    sync_client = tagsync.Sync(atlas_client, fetch_whole_schemas=conf.get('atlas_fetch_whole_schemas', False))
 
     try:
         src_data_table = tagsync.add_environment(tagsync.read_file(table_file), environment)
@@ -176,48 +688,92 @@ def _audit(srcdir, environment, config, tabletagfile, columntagfile):
         full_tables_atlas = sync_client.get_tables_for_schema_from_atlas(schemas)
         tables = tagsync.tables_from_src(src_data_column)
         full_columns_atlas = sync_client.get_columns_for_tables_from_atlas(tables)
-
-        # Tables only in Atlas
-        tables_atlas = set(full_tables_atlas.keys())
-        tables_src = set(tagsync.tables_from_src(src_data_table))
-        tables_only_atlas = tables_atlas-tables_src
-        if len(tables_only_atlas) != 0:
-            print("Tables only found in Atlas schema: %s" % (", ".join(tables_only_atlas).decode("utf-8")))
-        tables_only_src = tables_src-tables_atlas
-        # Tables only in Metadata
-        if len(tables_only_src) != 0:
-            print("Tables only found in metadata schema: %s" % (", ".join(tables_only_src).decode("utf-8")))
-
-        # Columns only in Metadata
-        # Note: columns only in Atlas can right know not be done since we not know all columns in source.
-        columns_atlas = set(full_columns_atlas.keys())
-        columns_src = set(tagsync.columns_from_src(src_data_column))
-        column_only_src = columns_src-columns_atlas
-        if len(column_only_src) != 0:
-            print("Columns only found in metadata: %s" % (", ".join(column_only_src).decode("utf-8")))
-
-        # Tag diffs on tables
-        diffs = tagsync.diff_table_tags(src_data_table, full_tables_atlas)
-        for d in diffs:
-            (only_src, only_atlas) = diffs[d]
-            if len(only_src) != 0:
-                print("Atlas missing following tags for table: %s tags: %s" % (d, ", ".join(only_src).decode("utf-8")))
-            if len(only_atlas) != 0:
-                print("Metadata missing following tags for table: %s tags: %s" % (d, ", ".join(only_atlas).decode("utf-8")))
-
-        # Tag diffs on columns
-        diffs = tagsync.diff_column_tags(src_data_column, full_columns_atlas)
-        for d in diffs:
-            (only_src, only_atlas) = diffs[d]
-            if len(only_src) != 0:
-                print("Atlas missing following tags for column: %s tags: %s" % (d, ", ".join(only_src).decode("utf-8")))
-            if len(only_atlas) != 0:
-                print("Metadata missing following tags for column: %s tags: %s" % (d, ", ".join(only_atlas).decode("utf-8")))
+        _print_tag_audit(src_data_table, src_data_column, full_tables_atlas, full_columns_atlas)
 
     except IOError as e:
         raise ClickException(e.message)
 
 
+def _audited_tags(src_data, name_of):
+    import tagsync
+    return dict((name_of(row), sorted(tagsync._tags_as_set(row))) for row in src_data)
+
+
+def _audit_incremental_once(view, view_file, source, sync_client, environment, table_file, column_file):
+    """
+    Apply new notifications to view and print differences for tables and columns changed in Atlas or in the
+    source files since last audit. If there is no view, it is created from Atlas and everything is audited.
+    :return: The updated view.
+    """
+    import notifications
+    import tagsync
+    src_data_table = tagsync.add_environment(tagsync.read_file(table_file), environment)
+    src_data_column = tagsync.add_environment(tagsync.read_file(column_file), environment)
+    schemas = tagsync.schemas_from_src(src_data_table) | tagsync.schemas_from_src(src_data_column)
+    if view is None:
+        # Skip notifications already published, changes made while fetching are applied next time.
+        for _ in source.messages():
+            pass
+        view = notifications.View(sync_client.get_tables_for_schema_from_atlas(schemas),
+                                  sync_client.get_columns_for_tables_from_atlas(
+                                      tagsync.tables_from_src(src_data_column)))
+        changed = set([('table', name) for name in view.tables] + [('column', name) for name in view.columns])
+    else:
+        source.position = view.position
+        changed = view.apply(source.messages(), schemas)
+    view.position = source.position
+
+    table_name = tagsync._table_name
+    column_name = tagsync._column_name
+    audited_tables = _audited_tags(src_data_table, table_name)
+    audited_columns = _audited_tags(src_data_column, column_name)
+    tables = [row for row in src_data_table if ('table', table_name(row)) in changed or
+              view.audited['table'].get(table_name(row)) != audited_tables[table_name(row)]]
+    columns = [row for row in src_data_column if ('column', column_name(row)) in changed or
+               view.audited['column'].get(column_name(row)) != audited_columns[column_name(row)]]
+    names = set([name for (kind, name) in changed] + map(table_name, tables) + map(column_name, columns))
+    _print_tag_audit(tables, columns,
+                     dict((name, t) for (name, t) in view.tables.items() if name in names),
+                     dict((name, c) for (name, c) in view.columns.items() if name in names))
+
+    view.audited = {'table': audited_tables, 'column': audited_columns}
+    view.save(view_file)
+    source.commit()
+    return view
+
+
+def _audit_incremental(srcdir, environment, config, tabletagfile, columntagfile, view_file, notifications_file,
+                       follow, interval):
+    import notifications
+    import tagsync
+    import time
+    conf = JSONPropertiesFile(config).get(environment)
+    table_file = os.path.join(srcdir, tabletagfile)
+    column_file = os.path.join(srcdir, columntagfile)
+    missing_files = _missing_files([table_file, column_file])
+    if len(missing_files) != 0:
+        print("Following files are missing: " + ", ".join(missing_files))
+        print("Will not run, exiting!")
+        return 0
+
+    atlas_client = _atlas_client(conf)
+    sync_client = tagsync.Sync(atlas_client, fetch_whole_schemas=conf.get('atlas_fetch_whole_schemas', False))
+    try:
+        view = notifications.View.load(view_file)
+        if notifications_file is not None:
+            source = notifications.FileSource(notifications_file)
+        else:
+            source = notifications.KafkaSource(conf)
+        while True:
+            view = _audit_incremental_once(view, view_file, source, sync_client, environment, table_file,
+                                           column_file)
+            if not follow:
+                break
+            time.sleep(interval)
+    except (IOError, notifications.NotificationError) as e:
+        raise ClickException(e.message)
+
+
 @cli.command("audit_tags", help="A dry run providing audit information about tags. \
 It includes differences between source files and Atlas.")
 @click.option('-s', '--srcdir', help='The schema for the generated table', default='src/main/tags')
@@ -225,8 +781,22 @@ It includes differences between source files and Atlas.")
 @click.option('-c', '--config', help='Config file', type=click.Path(exists=True))
 @click.option('--tabletagfile', help='The source file for table tags file', default='table_tags.csv')
 @click.option('--columntagfile', help='The source file for column tags file', default='column_tags.csv')
-def audit(srcdir, environment, config, tabletagfile, columntagfile):
-    _audit(srcdir, environment, config, tabletagfile, columntagfile)
+@click.option('--view', 'view_file', type=click.Path(),
+              help='Audit incrementally. Tags in Atlas are kept in this file, updated from Atlas entity '
+                   'notifications, and only tables and columns changed since last audit are audited.')
+@click.option('--notifications-file', type=click.Path(exists=True),
+              help='With --view, read notifications from this file with one json message per line instead of '
+                   'from Kafka.')
+@click.option('--follow', help='With --view, keep running and audit new changes every --interval seconds.',
+              is_flag=True)
+@click.option('--interval', help='Seconds between audits with --follow.', default=10.0, type=float)
+def audit(srcdir, environment, config, tabletagfile, columntagfile, view_file, notifications_file, follow,
+          interval):
+    if view_file is not None:
+        _audit_incremental(srcdir, environment, config, tabletagfile, columntagfile, view_file,
+                           notifications_file, follow, interval)
+    else:
+        _audit(srcdir, environment, config, tabletagfile, columntagfile)
 
 
 @cli.command("policy_cache_sync", help="Reads a policy cache file copied from hive sercer and"
@@ -242,8 +812,9 @@ def audit(srcdir, environment, config, tabletagfile, columntagfile):
               help='Set tags on hive tables corresponding hdfs directory. No effect if tagfiles are created',
               default=False)
 def policy_cache_sync(environment, config, policycachefile, tabletagfile, columntagfile, hdfs):
+    import policycache
     policycache.extract_policy_cache(
-        JSONPropertiesFile(config).get(environment), policycache, tabletagfile, columntagfile, hdfs)
+        JSONPropertiesFile(config).get(environment), policycachefile, tabletagfile, columntagfile, hdfs)
 
 
 if __name__ == '__main__':
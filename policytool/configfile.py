@@ -17,6 +17,15 @@ def _find_default_config():
             return user_config
 
 
+def kerberos_auth():
+    """
+    :return: Kerberos authentication for requests to Atlas and Ranger. Imported when needed, requests_kerberos
+    is slow to import.
+    """
+    from requests_kerberos import HTTPKerberosAuth
+    return HTTPKerberosAuth()
+
+
 class JSONPropertiesFile:
 
     def __init__(self, config_file_path, default_config={}):
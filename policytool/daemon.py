@@ -0,0 +1,201 @@
+"""
+Long running sync of source files to Atlas and Ranger, used by the serve command. Source files are polled
+for changes and only tables and columns with changed tags are synced, with clients and caches kept between syncs.
+"""
+from __future__ import print_function
+import copy
+import json
+import os
+import time
+from collections import defaultdict
+
+import tagsync
+
+
+def _row_key(row, key_fields):
+    return tuple(row[field] for field in key_fields)
+
+
+def changed_rows(previous, current, key_fields):
+    """
+    :param previous: Rows of a source file at the last sync, list of dicts with key_fields and tags.
+    :param current: Rows of the source file now.
+    :param key_fields: Fields identifying an entity, e.g. ('schema', 'table').
+    :return: Rows in current that are not in previous or have other tags than in previous.
+    Rows removed from the file are not returned, tags are never cleared on entities not listed.
+    """
+    previous_tags = dict((_row_key(row, key_fields), tagsync._tags_as_set(row)) for row in previous)
+    return [row for row in current if previous_tags.get(_row_key(row, key_fields)) != tagsync._tags_as_set(row)]
+
+
+class FileWatcher:
+    """
+    Polls files for changes of modification time or size.
+    """
+
+    def __init__(self, paths):
+        self.paths = paths
+        self._stats = {}
+
+    def _stat(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    def changed(self):
+        """
+        :return: List of paths changed, created or removed since the last call. All existing paths on first call.
+        """
+        result = []
+        for path in self.paths:
+            stat = self._stat(path)
+            if path not in self._stats or self._stats[path] != stat:
+                result.append(path)
+            self._stats[path] = stat
+        return result
+
+    def reset(self, paths):
+        """
+        Make paths count as changed on the next call to changed.
+        """
+        for path in paths:
+            self._stats.pop(path, None)
+
+
+class Daemon:
+    """
+    Syncs tags of an environment to Atlas, and optionally policies of a project to Ranger, each time source
+    files change. The first sync after start syncs everything, later syncs only tables and columns whose tags
+    changed. Policies depend on all tables and columns, so they are expanded again on any change, but only the
+    difference to Ranger is applied.
+    Changes made directly in Atlas or Ranger are not seen by comparing source files, so everything is synced
+    again every reconcile_interval seconds even if no source file changed.
+    """
+
+    def __init__(self, environment, table_file, column_file, sync_client, hdfs=False, policy_file=None,
+                 sync_policies=None, verbose=0, echo=print, reconcile_interval=None, clock=time.time):
+        """
+        :param environment: Environment synced, added to schema names.
+        :param table_file: Path to source file with table tags.
+        :param column_file: Path to source file with column tags.
+        :param sync_client: tagsync.Sync used for all syncs, preferably with cache_known_tags set.
+        :param hdfs: Set to true to also sync tags of the storage directories of changed tables.
+        :param policy_file: Path to source file with policy commands, or None to not sync policies.
+        :param sync_policies: Function taking (tables, table_columns, policy_commands) syncing policies to Ranger
+        and returning the plan applied, see rangersync.RangerSync.plan_projects. Needed if policy_file is given.
+        :param verbose: Verbosity of output.
+        :param echo: Function to print a line.
+        :param reconcile_interval: Seconds between syncs of everything, or None to only sync everything at start.
+        :param clock: Function returning current time in seconds.
+        """
+        self.environment = environment
+        self.table_file = table_file
+        self.column_file = column_file
+        self.policy_file = policy_file
+        self.sync_client = sync_client
+        self.hdfs = hdfs
+        self.sync_policies = sync_policies
+        self.verbose = verbose
+        self.echo = echo
+        paths = [table_file, column_file] + ([policy_file] if policy_file is not None else [])
+        self.watcher = FileWatcher(paths)
+        self.reconcile_interval = reconcile_interval
+        self.clock = clock
+        self._tables = []
+        self._columns = []
+        self._last_full_sync = None
+
+    def _full_sync_due(self):
+        if self._last_full_sync is None:
+            return True
+        return self.reconcile_interval is not None and \
+            self.clock() - self._last_full_sync >= self.reconcile_interval
+
+    def _sync_tags(self, tables, columns, full=False):
+        (previous_tables, previous_columns) = ([], []) if full else (self._tables, self._columns)
+        table_delta = tagsync.add_environment(
+            copy.deepcopy(changed_rows(previous_tables, tables, ('schema', 'table'))), self.environment)
+        column_delta = tagsync.add_environment(
+            copy.deepcopy(changed_rows(previous_columns, columns, ('schema', 'table', 'attribute'))),
+            self.environment)
+        # Schemas fetched in an earlier round are stale.
+        self.sync_client.forget_schemas()
+        if len(table_delta) != 0:
+            log = self.sync_client.sync_table_tags(table_delta)
+            if self.verbose > 0:
+                tagsync.print_sync_worklog(log, self.echo)
+        if len(column_delta) != 0:
+            log = self.sync_client.sync_column_tags(column_delta)
+            if self.verbose > 0:
+                tagsync.print_sync_worklog(log, self.echo)
+        if self.hdfs and len(table_delta) != 0:
+            log = self.sync_client.sync_table_storage_tags(table_delta)
+            if self.verbose > 0:
+                tagsync.print_sync_worklog(log, self.echo)
+        if len(table_delta) != 0 or len(column_delta) != 0:
+            self.echo("Synced tags of {} tables and {} columns in {}.".format(
+                len(table_delta), len(column_delta), self.environment))
+
+    def _sync_policies(self, tables, columns):
+        with open(self.policy_file, 'rU') as f:
+            policy_commands = json.load(f)
+        table_columns = defaultdict(list)
+        for column in columns:
+            table_columns["{}.{}".format(column['schema'], column['table'])].append(column)
+        policy_plan = self.sync_policies(copy.deepcopy(tables), table_columns, policy_commands)
+        changes = len(policy_plan['delete']) + len(policy_plan['create']) + len(policy_plan['update'])
+        if changes != 0:
+            self.echo("Applied {} deletes, {} creates and {} updates of policies to {}.".format(
+                len(policy_plan['delete']), len(policy_plan['create']), len(policy_plan['update']),
+                self.environment))
+
+    def run_once(self):
+        """
+        Sync if any source file changed since the last call, or everything if a full sync is due. If the sync
+        fails the files count as changed, so the sync is tried again on the next call.
+        :return: True if a sync was done.
+        """
+        changed = self.watcher.changed()
+        full = self._full_sync_due()
+        if len(changed) == 0 and not full:
+            return False
+        missing = [path for path in self.watcher.paths if not os.path.isfile(path)]
+        if len(missing) != 0:
+            self.echo("Following files are missing: " + ", ".join(missing))
+            return False
+        if full and self._last_full_sync is not None:
+            self.echo("Reconciling all tags{} in {}.".format(
+                " and policies" if self.policy_file is not None else "", self.environment))
+            # Tag definitions may have been changed directly in Atlas too.
+            self.sync_client.forget_known_tags()
+        start = self.clock()
+        try:
+            tables = tagsync.read_file(self.table_file)
+            columns = tagsync.read_file(self.column_file)
+            self._sync_tags(tables, columns, full)
+            self._tables = tables
+            self._columns = columns
+            if self.policy_file is not None:
+                self._sync_policies(tables, columns)
+        except Exception:
+            self.watcher.reset(changed)
+            # Tag definitions may have been removed in Atlas, fetch them again on next sync.
+            self.sync_client.forget_known_tags()
+            raise
+        if full:
+            self._last_full_sync = start
+        return True
+
+    def serve(self, interval, sleep=time.sleep):
+        """
+        Poll source files every interval seconds and sync changes, forever. Errors are printed and the
+        sync is retried on next poll.
+        """
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                self.echo("Sync of {} failed, retrying in {} seconds: {}".format(self.environment, interval, e))
+            sleep(interval)
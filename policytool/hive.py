@@ -1,31 +1,97 @@
+import csv
+import json
 import re
+import socket
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 
-from pyhive import hive
+import instrumentation
+from retry import call_with_retry
 
 
 class Client:
 
-    _conn = None
-
-    def __init__(self, host, port=10000, auth="KERBEROS", service_name="hive", version=1):
+    def __init__(self, host, port=10000, auth="KERBEROS", service_name="hive", version=1, retries=3, parallel=8):
         """
         :param host: Name of hive server.
         :param port: Thrift port of hiveserver
         :param auth: Authentication method, only kerberos supported for now.
         :param service_name: Kerberos service name. Defaults to hive.
         :param version: Version of hive.
+        :param retries: Number of retries of a single query, on a new connection, if the query fails.
+        :param parallel: Max number of concurrent queries in get_locations.
         """
         self.host = host
         self.port = int(port)
         self.auth = auth
         self.service_name = service_name
         self.version = version
+        self.retries = retries
+        self.parallel = parallel
+        # A connection can only run one query at a time, each thread gets its own connection.
+        # Connections are kept until close, like the threads of get_locations using them.
+        self._connections = {}
+        self._pool = None
+        self._lock = threading.Lock()
 
     def _connection(self):
-        if not self._conn:
-            self._conn = hive.Connection(
+        thread = threading.current_thread()
+        with self._lock:
+            conn = self._connections.get(thread)
+        if conn is None:
+            # pyhive and Thrift are slow to import, only import them when a connection is needed.
+            from pyhive import hive
+            conn = hive.Connection(
                 host=self.host, port=self.port, auth=self.auth, kerberos_service_name=self.service_name)
-        return self._conn
+            with self._lock:
+                self._connections[thread] = conn
+        return conn
+
+    def _drop_connection(self):
+        with self._lock:
+            conn = self._connections.pop(threading.current_thread(), None)
+        _close_quietly(conn)
+
+    def close(self):
+        """
+        Stop the threads of get_locations and close all connections.
+        """
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+            connections = self._connections.values()
+            self._connections = {}
+        if pool is not None:
+            pool.close()
+            pool.join()
+        for conn in connections:
+            _close_quietly(conn)
+
+    def _fetchall(self, query):
+        """
+        Execute query and fetch all rows. On transport failures the connection is dropped and the query
+        retried with backoff on a new connection.
+        """
+        attempts = [0]
+
+        def execute():
+            attempts[0] += 1
+            try:
+                cursor = self._connection().cursor()
+                cursor.execute(query)
+                return cursor.fetchall()
+            except Exception:
+                self._drop_connection()
+                raise
+        start = time.time()
+        rows = None
+        try:
+            rows = call_with_retry(execute, self.retries, 1, 30, _is_transport_error)
+            return rows
+        finally:
+            instrumentation.record('hive', _statement(query), time.time() - start, error=rows is None,
+                                   retries=attempts[0] - 1)
 
     @classmethod
     def _verify_entity_name(cls, entity):
@@ -40,20 +106,313 @@ class Client:
         Client._verify_entity_name(database)
         if table is not None and table != '*':
             Client._verify_entity_name(table)
-            cursor = self._connection().cursor()
-            cursor.execute("describe formatted {}.{}".format(database, table))
-            for key, value, _ in cursor.fetchall():
+            for key, value, _ in self._fetchall("describe formatted {}.{}".format(database, table)):
                 if key is not None and key.strip() == u'Location:':
                     return value.strip()
             # If we not find 'Location:', its probably a view.
             return None
         else:
-            cursor = self._connection().cursor()
-            cursor.execute("describe database {}".format(database))
-            for _, _, location, _ , _, _ in cursor.fetchall():
+            for _, _, location, _ , _, _ in self._fetchall("describe database {}".format(database)):
                 return location
         raise HiveError("Can not find location for {}.{}.".format(database, table))
 
+    def get_locations(self, database_tables):
+        """
+        Look up locations concurrently, one query per table. The threads and their connections are reused
+        by later calls until close.
+        :param database_tables: Iterable of (database, table), where table can be None or * for the database.
+        :return: Dict (database, table) -> location, location is None for views.
+        """
+        database_tables = list(database_tables)
+        if self.parallel > 1 and len(database_tables) > 1:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPool(self.parallel)
+                pool = self._pool
+            locations = pool.map(lambda key: self.get_location(*key), database_tables)
+        else:
+            locations = [self.get_location(*key) for key in database_tables]
+        return dict(zip(database_tables, locations))
+
+
+class MetastoreClient:
+    """
+    Looks up locations with the Thrift API of the Hive metastore, instead of running queries in HiveServer2.
+    Locations of many tables in a database are fetched in one call with get_locations. Needs module hmsclient.
+    """
+
+    def __init__(self, host, port=9083, auth="KERBEROS", service_name="hive", retries=3, batch_size=100):
+        """
+        :param host: Name of metastore server.
+        :param port: Thrift port of metastore.
+        :param auth: KERBEROS or NOSASL.
+        :param service_name: Kerberos service name. Defaults to hive.
+        :param retries: Number of retries of a single call, on a new connection, if the call fails.
+        :param batch_size: Max number of tables fetched in one call.
+        """
+        self.host = host
+        self.port = int(port)
+        self.auth = auth
+        self.service_name = service_name
+        self.retries = retries
+        self.batch_size = batch_size
+        # A connection can only run one call at a time, each thread gets its own connection.
+        self._local = threading.local()
+        self._transports = []
+        self._lock = threading.Lock()
+
+    def _open_connection(self):
+        """
+        :return: Tuple (transport, metastore client) of a new opened connection.
+        """
+        # Thrift is slow to import, only import it when a connection is needed.
+        try:
+            from hmsclient.genthrift.hive_metastore import ThriftHiveMetastore
+        except ImportError:
+            raise HiveError("Module hmsclient is needed to use hive_backend metastore.")
+        from thrift.protocol import TBinaryProtocol
+        from thrift.transport import TSocket, TTransport
+        tsocket = TSocket.TSocket(self.host, self.port)
+        if self.auth == "KERBEROS":
+            import sasl
+            import thrift_sasl
+
+            def sasl_factory():
+                sasl_client = sasl.Client()
+                sasl_client.setAttr('host', self.host)
+                sasl_client.setAttr('service', self.service_name)
+                sasl_client.init()
+                return sasl_client
+            transport = thrift_sasl.TSaslClientTransport(sasl_factory, 'GSSAPI', tsocket)
+        else:
+            transport = TTransport.TBufferedTransport(tsocket)
+        transport.open()
+        return transport, ThriftHiveMetastore.Client(TBinaryProtocol.TBinaryProtocol(transport))
+
+    def _connection(self):
+        transport = getattr(self._local, 'transport', None)
+        with self._lock:
+            # The connection of this thread is gone if close was called, from any thread.
+            if transport is not None and transport not in self._transports:
+                self._local.conn = None
+                self._local.transport = None
+        if not getattr(self._local, 'conn', None):
+            (transport, conn) = self._open_connection()
+            with self._lock:
+                self._transports.append(transport)
+            self._local.transport = transport
+            self._local.conn = conn
+        return self._local.conn
+
+    def _drop_connection(self):
+        transport = getattr(self._local, 'transport', None)
+        self._local.conn = None
+        self._local.transport = None
+        if transport is not None:
+            with self._lock:
+                if transport in self._transports:
+                    self._transports.remove(transport)
+            _close_quietly(transport)
+
+    def close(self):
+        """
+        Close the connections of all threads.
+        """
+        with self._lock:
+            transports = self._transports
+            self._transports = []
+        for transport in transports:
+            _close_quietly(transport)
+
+    def _call(self, name, *args):
+        """
+        Call a metastore function. On transport failures the connection is dropped and the call
+        retried with backoff on a new connection.
+        """
+        attempts = [0]
+
+        def call():
+            attempts[0] += 1
+            try:
+                return getattr(self._connection(), name)(*args)
+            except Exception:
+                self._drop_connection()
+                raise
+        start = time.time()
+        done = False
+        try:
+            result = call_with_retry(call, self.retries, 1, 30, _is_transport_error)
+            done = True
+            return result
+        finally:
+            instrumentation.record('hive', name, time.time() - start, error=not done, retries=attempts[0] - 1)
+
+    def get_location(self, database, table=None):
+        return self.get_locations([(database, table)])[(database, table)]
+
+    def get_locations(self, database_tables):
+        """
+        :param database_tables: Iterable of (database, table), where table can be None or * for the database.
+        :return: Dict (database, table) -> location, location is None for views.
+        """
+        result = {}
+        tables_in_database = {}
+        for (database, table) in database_tables:
+            if table is None or table == '*':
+                result[(database, table)] = self._call('get_database', database).locationUri
+            else:
+                tables_in_database.setdefault(database, set()).add(table)
+        for (database, tables) in tables_in_database.items():
+            tables = sorted(tables)
+            for i in range(0, len(tables), self.batch_size):
+                batch = tables[i:i + self.batch_size]
+                found = dict((t.tableName.lower(), t) for t in
+                             self._call('get_table_objects_by_name', database, batch))
+                for table in batch:
+                    table_object = found.get(table.lower())
+                    if table_object is None:
+                        raise HiveError("Can not find location for {}.{}.".format(database, table))
+                    if table_object.tableType == 'VIRTUAL_VIEW':
+                        result[(database, table)] = None
+                    else:
+                        result[(database, table)] = table_object.sd.location
+        return result
+
+
+class DumpClient:
+    """
+    Looks up locations in a dump of the Hive metastore instead of asking Hive, e.g. for CI or large backfills.
+    The dump is read once into memory. It is a json list of objects, or a csv file with a header, with the
+    fields db, table, location and table_type. Rows with empty table give locations of databases.
+    Example csv:
+    db,table,location,table_type
+    my_db,,hdfs://cluster/apps/hive/warehouse/my_db.db,
+    my_db,my_table,hdfs://cluster/apps/hive/warehouse/my_db.db/my_table,MANAGED_TABLE
+    my_db,my_view,,VIRTUAL_VIEW
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Dump file, json if the name ends with .json, otherwise csv separated by comma, semicolon or tab.
+        """
+        self.path = path
+        self._locations = {}
+        for row in DumpClient._read(path):
+            table = row.get('table') or None
+            location = row.get('location') or None
+            if row.get('table_type') == 'VIRTUAL_VIEW':
+                location = None
+            self._locations[DumpClient._key(row['db'], table)] = location
+
+    @staticmethod
+    def _read(path):
+        with open(path, 'rU') as f:
+            if path.endswith('.json'):
+                return json.load(f)
+            dialect = csv.Sniffer().sniff(f.readline(), delimiters=',;\t')
+            f.seek(0)
+            return list(csv.DictReader(f, dialect=dialect))
+
+    @staticmethod
+    def _key(database, table):
+        # Hive names are case insensitive.
+        return database.lower(), table.lower() if table is not None and table != '*' else None
+
+    def get_location(self, database, table=None):
+        key = DumpClient._key(database, table)
+        if key not in self._locations:
+            raise HiveError("Can not find location for {}.{} in {}.".format(database, table, self.path))
+        return self._locations[key]
+
+    def get_locations(self, database_tables):
+        """
+        :param database_tables: Iterable of (database, table), where table can be None or * for the database.
+        :return: Dict (database, table) -> location, location is None for views.
+        """
+        return dict(((database, table), self.get_location(database, table)) for (database, table) in database_tables)
+
+    def close(self):
+        pass
+
+
+def client_from_config(conf, retries=3):
+    """
+    :param conf: Environment config. With hive_backend metastore, hive_metastore_host and optionally
+    hive_metastore_port are used, with hive_backend dump, hive_metastore_dump is used, otherwise
+    hive_server and hive_port.
+    :return: Client to look up locations with, or None if Hive is not configured.
+    """
+    backend = conf.get('hive_backend', 'hiveserver2')
+    if backend == 'dump':
+        return DumpClient(conf['hive_metastore_dump'])
+    if backend == 'metastore':
+        return MetastoreClient(conf['hive_metastore_host'], conf.get('hive_metastore_port', 9083), retries=retries)
+    if not conf.has_key('hive_server'):
+        return None
+    return Client(conf['hive_server'], conf['hive_port'], retries=retries)
+
+
+class LocationCache:
+    """
+    Wraps a client and remembers locations looked up. Locations of many tables are looked up at once with
+    prefetch, using get_locations of the client if it has one.
+    """
+
+    def __init__(self, hive_client):
+        """
+        :param hive_client: Client to look up locations with.
+        """
+        self.hive_client = hive_client
+        self._locations = {}
+
+    @staticmethod
+    def _key(database, table):
+        return database, table if table != '*' else None
+
+    def prefetch(self, database_tables):
+        """
+        Look up locations of tables not already known.
+        :param database_tables: Iterable of (database, table), where table can be None or * for the database.
+        """
+        keys = set(LocationCache._key(database, table) for (database, table) in database_tables)
+        missing = [key for key in keys if key not in self._locations]
+        if len(missing) == 0:
+            return
+        if hasattr(self.hive_client, 'get_locations'):
+            locations = self.hive_client.get_locations(missing)
+            locations = [locations[key] for key in missing]
+        else:
+            locations = [self.hive_client.get_location(*key) for key in missing]
+        self._locations.update(zip(missing, locations))
+
+    def get_location(self, database, table=None):
+        key = LocationCache._key(database, table)
+        if key not in self._locations:
+            self._locations[key] = self.hive_client.get_location(*key)
+        return self._locations[key]
+
+
+def _close_quietly(conn):
+    if conn is None:
+        return
+    try:
+        conn.close()
+    except Exception:
+        # The connection is already broken, nothing more to release.
+        pass
+
+
+def _statement(query):
+    """
+    :return: Query without names of databases and tables, e.g. 'describe formatted'.
+    """
+    return " ".join(query.split()[:-1]).lower()
+
+
+def _is_transport_error(result, exception):
+    from thrift.transport.TTransport import TTransportException
+    return isinstance(exception, (TTransportException, socket.error, EOFError))
+
 
 class HiveError(Exception):
     def __init__(self, message, source_exception=None):
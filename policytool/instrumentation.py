@@ -0,0 +1,186 @@
+import json
+import re
+import threading
+import time
+import urlparse
+
+"""
+Instrumentation of requests to Atlas, Ranger and Hive. When a Recorder is installed with set_recorder, the
+clients record count, latency, bytes transferred and retries per endpoint. Without a recorder nothing is recorded.
+"""
+
+# Upper bounds in seconds of the latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Path segments that are ids, replaced to get one endpoint for all entities.
+_ID_SEGMENT = re.compile(r'^([0-9]+|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})$')
+# Path segments followed by a name of a tag or policy, replaced by {name}.
+_NAME_PARENTS = frozenset(['classification', 'policy'])
+
+_recorder = None
+
+
+def set_recorder(recorder):
+    """
+    :param recorder: Recorder to use for all clients, or None to stop recording.
+    """
+    global _recorder
+    _recorder = recorder
+
+
+def get_recorder():
+    return _recorder
+
+
+def record(client, endpoint, seconds, error=False, retries=0, bytes_sent=0, bytes_received=0):
+    """
+    Record one request, retries included, if a recorder is installed. See Recorder.record.
+    """
+    recorder = _recorder
+    if recorder is not None:
+        recorder.record(client, endpoint, seconds, error, retries, bytes_sent, bytes_received)
+
+
+def http_endpoint(method, url):
+    """
+    :return: Endpoint for a request, method and path without query string and with ids replaced by {id}.
+    Example: 'GET /api/atlas/entities/{id}'
+    """
+    segments = []
+    for segment in urlparse.urlparse(url).path.split('/'):
+        if _ID_SEGMENT.match(segment):
+            segment = '{id}'
+        elif len(segments) != 0 and segments[-1] in _NAME_PARENTS:
+            segment = '{name}'
+        segments.append(segment)
+    return "{} {}".format(method.upper(), '/'.join(segments))
+
+
+class _EndpointStats:
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.seconds = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def add(self, seconds, error, retries, bytes_sent, bytes_received):
+        self.count += 1
+        self.errors += 1 if error else 0
+        self.retries += retries
+        self.seconds += seconds
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def as_dict(self):
+        cumulative = 0
+        buckets = []
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            cumulative += count
+            buckets.append([bound, cumulative])
+        return {'count': self.count,
+                'errors': self.errors,
+                'retries': self.retries,
+                'seconds': self.seconds,
+                'bytes_sent': self.bytes_sent,
+                'bytes_received': self.bytes_received,
+                'latency_buckets': buckets}
+
+
+class Recorder:
+    """
+    Collects statistics per client and endpoint. Safe to use from many threads.
+    """
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._started = clock()
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, client, endpoint, seconds, error=False, retries=0, bytes_sent=0, bytes_received=0):
+        """
+        :param client: Name of client, atlas, ranger or hive.
+        :param endpoint: Endpoint of the request, e.g. 'GET /api/atlas/entities/{id}'.
+        :param seconds: Time spent on the request, retries included.
+        :param error: True if request failed.
+        :param retries: Number of retries done.
+        :param bytes_sent: Size of request body.
+        :param bytes_received: Size of response body.
+        """
+        with self._lock:
+            stats = self._stats.get((client, endpoint))
+            if stats is None:
+                stats = _EndpointStats()
+                self._stats[(client, endpoint)] = stats
+            stats.add(seconds, error, retries, bytes_sent, bytes_received)
+
+    def summary(self):
+        """
+        :return: {'duration_seconds': seconds since created, 'endpoints': [{'client': c, 'endpoint': e, 'count': n, ...}]}
+        with latency_buckets as a list of cumulative [upper bound, count].
+        """
+        with self._lock:
+            endpoints = []
+            for (client, endpoint) in sorted(self._stats):
+                stats = self._stats[(client, endpoint)].as_dict()
+                stats.update({'client': client, 'endpoint': endpoint})
+                endpoints.append(stats)
+        return {'duration_seconds': self._clock() - self._started, 'endpoints': endpoints}
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=2, sort_keys=True, separators=(',', ': '))
+
+    def to_prometheus(self):
+        """
+        :return: Summary in Prometheus text exposition format.
+        """
+        summary = self.summary()
+        lines = ['# TYPE policytool_run_duration_seconds gauge',
+                 'policytool_run_duration_seconds {}'.format(_prometheus_number(summary['duration_seconds']))]
+        counters = [('policytool_requests_total', 'count'),
+                    ('policytool_request_errors_total', 'errors'),
+                    ('policytool_request_retries_total', 'retries'),
+                    ('policytool_request_bytes_sent_total', 'bytes_sent'),
+                    ('policytool_request_bytes_received_total', 'bytes_received')]
+        for (name, key) in counters:
+            lines.append('# TYPE {} counter'.format(name))
+            for stats in summary['endpoints']:
+                lines.append('{}{{{}}} {}'.format(name, _prometheus_labels(stats), stats[key]))
+        name = 'policytool_request_duration_seconds'
+        lines.append('# TYPE {} histogram'.format(name))
+        for stats in summary['endpoints']:
+            labels = _prometheus_labels(stats)
+            for (bound, count) in stats['latency_buckets']:
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, count))
+            lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, stats['count']))
+            lines.append('{}_sum{{{}}} {}'.format(name, labels, _prometheus_number(stats['seconds'])))
+            lines.append('{}_count{{{}}} {}'.format(name, labels, stats['count']))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path, output_format='json'):
+        """
+        :param path: File to write summary to.
+        :param output_format: json or prometheus.
+        """
+        if output_format == 'prometheus':
+            content = self.to_prometheus()
+        else:
+            content = self.to_json()
+        with open(path, 'w') as f:
+            f.write(content)
+
+
+def _prometheus_labels(stats):
+    return 'client="{}",endpoint="{}"'.format(stats['client'], stats['endpoint'].replace('"', '\\"'))
+
+
+def _prometheus_number(value):
+    return repr(float(value))
@@ -0,0 +1,183 @@
+import json
+import re
+
+"""
+Incremental parsing of large JSON documents, like Ranger policy cache files, without loading the whole
+document into memory. Only the top level object is parsed incrementally, selected values of it are
+parsed element by element.
+"""
+
+_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+_structural = re.compile(r'[\[\]{}"]')
+_string_special = re.compile(r'["\\]')
+_scalar_end = re.compile(r'[ \t\n\r,:\]}]')
+
+
+class _Buffer:
+
+    def __init__(self, fileobj, chunk_size):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.data = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.fileobj.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.data = self.data[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        :return: Next non whitespace character without consuming it, or None at end of file.
+        """
+        while True:
+            while self.pos < len(self.data) and self.data[self.pos] in _whitespace:
+                self.pos += 1
+            if self.pos < len(self.data):
+                return self.data[self.pos]
+            if not self._fill():
+                return None
+
+    def expect(self, chars):
+        """
+        Consume next non whitespace character, which must be one of chars.
+        :return: The consumed character.
+        """
+        c = self.peek()
+        if c is None or c not in chars:
+            raise JSONStreamError("Expected one of '{}' but found {} at offset {}.".format(chars, repr(c), self.pos))
+        self.pos += 1
+        return c
+
+    def _value_end(self):
+        """
+        Find where next JSON value ends, reading more chunks until all of it is in the buffer.
+        Only the part read since last chunk is scanned after each fill.
+        :return: Offset in data after the value, or None if the file ends before the value.
+        """
+        first = self.peek()
+        if first is None:
+            return None
+        scalar = first not in '"[{'
+        in_string = False
+        depth = 0
+        i = self.pos
+        while True:
+            if scalar:
+                m = _scalar_end.search(self.data, i)
+                if m:
+                    return m.start()
+                i = len(self.data)
+            else:
+                while True:
+                    m = (_string_special if in_string else _structural).search(self.data, i)
+                    if m is None:
+                        i = len(self.data)
+                        break
+                    c = m.group()
+                    if c == '\\':
+                        if m.end() == len(self.data):
+                            # Escaped character is in next chunk, scan the escape again after fill.
+                            i = m.start()
+                            break
+                        i = m.end() + 1
+                        continue
+                    i = m.end()
+                    if c == '"':
+                        in_string = not in_string
+                    elif c in '[{':
+                        depth += 1
+                    else:
+                        depth -= 1
+                    if depth == 0 and not in_string:
+                        return i
+            consumed = self.pos
+            if not self._fill():
+                return len(self.data) if scalar else None
+            i -= consumed
+
+    def value(self):
+        """
+        Decode and consume next complete JSON value.
+        """
+        self.peek()
+        try:
+            value, end = _decoder.raw_decode(self.data, self.pos)
+            # A number at the end of the buffer may continue in next chunk.
+            if end < len(self.data):
+                self.pos = end
+                return value
+        except ValueError:
+            pass
+        # Value continues in next chunks, read until it is complete before decoding it again.
+        if self._value_end() is None:
+            raise JSONStreamError("Invalid JSON at offset {}: Document ends before value.".format(self.pos))
+        try:
+            value, self.pos = _decoder.raw_decode(self.data, self.pos)
+        except ValueError as e:
+            raise JSONStreamError("Invalid JSON at offset {}: {}".format(self.pos, e))
+        return value
+
+
+def _iter_container(buf):
+    if buf.expect('[{') == '[':
+        if buf.peek() == ']':
+            buf.expect(']')
+            return
+        index = 0
+        while True:
+            yield index, buf.value()
+            index += 1
+            if buf.expect(',]') == ']':
+                return
+    else:
+        if buf.peek() == '}':
+            buf.expect('}')
+            return
+        while True:
+            key = buf.value()
+            buf.expect(':')
+            yield key, buf.value()
+            if buf.expect(',}') == '}':
+                return
+
+
+def iter_object(fileobj, streamed_keys=(), chunk_size=1024*1024):
+    """
+    Iterate over the top level JSON object in a file without reading all of it into memory.
+    :param fileobj: File like object to read the JSON document from.
+    :param streamed_keys: Keys in the top level object where the value, an array or an object, is not
+    decoded as a whole. Instead each element in it is decoded and returned one by one.
+    :param chunk_size: Number of bytes to read from fileobj at a time.
+    :return: Generator of tuples (key, element_key, value). For keys in streamed_keys one tuple is returned per
+    element with element_key as the index in the array or the key in the object. For other keys one tuple is
+    returned with element_key None and the decoded value.
+    """
+    buf = _Buffer(fileobj, chunk_size)
+    buf.expect('{')
+    if buf.peek() == '}':
+        return
+    while True:
+        key = buf.value()
+        buf.expect(':')
+        if key in streamed_keys and buf.peek() in ('[', '{'):
+            for element_key, value in _iter_container(buf):
+                yield key, element_key, value
+        else:
+            yield key, None, buf.value()
+        if buf.expect(',}') == '}':
+            return
+
+
+class JSONStreamError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return repr(self.message)
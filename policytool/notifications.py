@@ -0,0 +1,232 @@
+"""
+Incremental audit of tags using Atlas entity notifications. Atlas publishes a notification on the ATLAS_ENTITIES
+Kafka topic each time an entity or its classifications change. The notifications are applied to a local view of
+the tags of tables and columns, so the view follows Atlas at a cost proportional to the number of changes.
+"""
+import base64
+import json
+import os
+import zlib
+
+from tagsync import strip_qualified_name
+
+VIEW_VERSION = 1
+DEFAULT_TOPIC = 'ATLAS_ENTITIES'
+_KINDS = {'hive_table': 'table', 'hive_column': 'column'}
+
+
+def _classification_names(entity):
+    """
+    Tags set directly on the entity, propagated classifications are not returned by Atlas searches either.
+    """
+    if entity.has_key('classifications'):
+        return set([c['typeName'] for c in entity['classifications'] or []
+                    if c.get('entityGuid', entity.get('guid')) == entity.get('guid')])
+    return set(entity.get('classificationNames') or [])
+
+
+def parse_notification(notification):
+    """
+    Parse a version 2 entity notification. The entity in the notification has all classifications of the entity
+    after the change, also for CLASSIFICATION_ADD and CLASSIFICATION_DELETE.
+    :param notification: The message of a notification, on the form
+    {'type': 'ENTITY_NOTIFICATION_V2', 'operationType': 'CLASSIFICATION_ADD', 'entity': {...}}
+    :return: (kind, name, guid, tags) where kind is table or column, name is on the form schema.table or
+    schema.table.column and tags is None if the entity is deleted. None for other entities and notifications.
+    """
+    if notification.get('type') != 'ENTITY_NOTIFICATION_V2':
+        return None
+    entity = notification['entity']
+    kind = _KINDS.get(entity.get('typeName'))
+    if kind is None:
+        return None
+    name = strip_qualified_name(entity['attributes']['qualifiedName'])
+    if notification.get('operationType') == 'ENTITY_DELETE' or entity.get('status') == 'DELETED':
+        return kind, name, entity.get('guid'), None
+    return kind, name, entity.get('guid'), _classification_names(entity)
+
+
+class _Unsplitter:
+    """
+    Unwraps messages from the envelope Atlas puts them in. Large messages are compressed and split
+    into several Kafka messages.
+    """
+
+    def __init__(self):
+        self._parts = {}
+
+    def unwrap(self, envelope):
+        """
+        :return: The message, or None if the envelope is a part of a message not yet complete.
+        """
+        if not envelope.has_key('message'):
+            return envelope
+        message = envelope['message']
+        split_count = envelope.get('msgSplitCount', 1)
+        if split_count > 1:
+            parts = self._parts.setdefault(envelope['msgId'], {})
+            parts[envelope['msgSplitIdx']] = message
+            if len(parts) < split_count:
+                return None
+            message = ''.join(parts[i] for i in sorted(parts))
+            del self._parts[envelope['msgId']]
+        if envelope.get('msgCompressionKind') == 'GZIP':
+            message = zlib.decompress(base64.b64decode(message), 16 + zlib.MAX_WBITS)
+        if isinstance(message, basestring):
+            message = json.loads(message)
+        return message
+
+
+class FileSource:
+    """
+    Replays notifications from a file with one notification envelope as json per line, as read from the
+    ATLAS_ENTITIES topic. Position is the number of lines read, but never past the first part of a split
+    message not yet complete. Such a message is read from its first part again next time, together with the
+    messages after it, which gives the same view when applied again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.position = 0
+
+    def messages(self):
+        unsplitter = _Unsplitter()
+        # Line of the first part read of each split message not yet complete.
+        first_lines = {}
+        with open(self.path) as f:
+            for (n, line) in enumerate(f):
+                if n < self.position or len(line.strip()) == 0:
+                    continue
+                if not line.endswith('\n'):
+                    # Line still being written.
+                    break
+                envelope = json.loads(line)
+                message = unsplitter.unwrap(envelope)
+                if message is None:
+                    first_lines.setdefault(envelope['msgId'], n)
+                else:
+                    first_lines.pop(envelope.get('msgId'), None)
+                self.position = min(first_lines.values()) if len(first_lines) != 0 else n + 1
+                if message is not None:
+                    yield message
+
+    def commit(self):
+        pass
+
+
+class KafkaSource:
+    """
+    Reads notifications from the ATLAS_ENTITIES Kafka topic with kafka-python. Position is kept as committed
+    offsets of the consumer group in Kafka, commit after the view is saved.
+    """
+
+    def __init__(self, conf):
+        """
+        :param conf: Environment config with atlas_kafka_bootstrap_servers and optionally atlas_kafka_topic,
+        atlas_kafka_group_id and atlas_kafka_options, extra arguments to KafkaConsumer.
+        """
+        try:
+            from kafka import KafkaConsumer
+        except ImportError:
+            raise NotificationError("Module kafka-python is needed to read notifications from Kafka.")
+        self.position = None
+        self._consumer = KafkaConsumer(
+            conf.get('atlas_kafka_topic', DEFAULT_TOPIC),
+            bootstrap_servers=conf['atlas_kafka_bootstrap_servers'],
+            group_id=conf.get('atlas_kafka_group_id', 'cobra-policytool-audit'),
+            enable_auto_commit=False,
+            auto_offset_reset='latest',
+            consumer_timeout_ms=5000,
+            value_deserializer=json.loads,
+            **conf.get('atlas_kafka_options', {}))
+
+    def messages(self):
+        unsplitter = _Unsplitter()
+        for record in self._consumer:
+            message = unsplitter.unwrap(record.value)
+            if message is not None:
+                yield message
+
+    def commit(self):
+        self._consumer.commit()
+
+
+class View:
+    """
+    Tags of tables and columns in Atlas, kept up to date by applying notifications. Only tables and columns in
+    the given schemas are kept. Tables and columns are dicts with name as key and {'guid':, 'tags': set()} as value,
+    same as returned by tagsync.Sync.get_tables_for_schema_from_atlas.
+    """
+
+    def __init__(self, tables=None, columns=None, position=None, audited=None):
+        """
+        :param position: Position in notification source of last applied notification.
+        :param audited: Tags in source files at last audit, {'table': {name: [tags]}, 'column': {name: [tags]}}.
+        """
+        self.tables = tables if tables is not None else {}
+        self.columns = columns if columns is not None else {}
+        self.position = position
+        self.audited = audited if audited is not None else {'table': {}, 'column': {}}
+
+    def apply(self, messages, schemas):
+        """
+        Apply notifications to the view.
+        :param messages: Iterable of notifications.
+        :param schemas: Set of schemas to keep tables and columns for.
+        :return: Set of (kind, name) of tables and columns changed.
+        """
+        changed = set()
+        for message in messages:
+            parsed = parse_notification(message)
+            if parsed is None:
+                continue
+            (kind, name, guid, tags) = parsed
+            if name.split('.')[0] not in schemas:
+                continue
+            entities = self.tables if kind == 'table' else self.columns
+            if tags is None:
+                entities.pop(name, None)
+            else:
+                entities[name] = {'guid': guid, 'tags': tags}
+            changed.add((kind, name))
+        return changed
+
+    @staticmethod
+    def load(path):
+        """
+        :return: The view saved in path or None if there is no such file.
+        """
+        if not os.path.isfile(path):
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != VIEW_VERSION:
+            raise NotificationError("View {} has version {}, expected {}. Remove it to rebuild it.".format(
+                path, data.get('version'), VIEW_VERSION))
+
+        def entities(saved):
+            return dict((name, {'guid': e['guid'], 'tags': set(e['tags'])}) for (name, e) in saved.items())
+
+        def utf8(tags):
+            # Source files are read as utf-8 encoded strings.
+            return dict((name.encode('utf-8'), [tag.encode('utf-8') for tag in tags[name]]) for name in tags)
+        audited = dict((kind, utf8(data['audited'][kind])) for kind in data['audited'])
+        return View(entities(data['tables']), entities(data['columns']), data['position'], audited)
+
+    def save(self, path):
+        def entities(view_entities):
+            return dict((name, {'guid': e['guid'], 'tags': sorted(e['tags'])}) for (name, e) in view_entities.items())
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': VIEW_VERSION, 'position': self.position, 'tables': entities(self.tables),
+                       'columns': entities(self.columns), 'audited': self.audited}, f, sort_keys=True)
+        os.rename(tmp_path, path)
+
+
+class NotificationError(Exception):
+
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return repr(self.message)
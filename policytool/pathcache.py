@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+
+
+class HdfsPathCache:
+    """
+    Cache of guids of hdfs_path entities in Atlas, with the qualifiedName of the entity, the full hdfs url, as key.
+    Used to only create hdfs_path entities for paths not seen before, instead of updating the entity of every
+    table location on every sync. The cache can be saved to a json file shared by runs against the same Atlas:
+        {"version": 1, "paths": {"hdfs://cluster/apps/hive/warehouse/db.db/table": "guid"}}
+    A guid is stale if the entity has been deleted in Atlas, callers must then forget the path.
+    Without a path the cache is only kept in memory.
+    """
+    VERSION = 1
+
+    def __init__(self, path=None):
+        """
+        :param path: Json file to read the cache from and save it to, or None to not persist it.
+        """
+        self.path = path
+        self._guids = {}
+        # Changes since the file was read, merged into paths saved by other runs on save.
+        self._updated = {}
+        self._forgotten = set()
+        self._lock = threading.Lock()
+        if path is not None:
+            self._guids.update(self._read())
+
+    def _read(self):
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except ValueError:
+            # A broken cache file is ignored and replaced at next save.
+            return {}
+        if data.get('version') != HdfsPathCache.VERSION:
+            return {}
+        return data['paths']
+
+    def get(self, hdfs_path):
+        """
+        :return: Guid of hdfs_path entity for hdfs_path, or None if not known.
+        """
+        return self._guids.get(hdfs_path)
+
+    def update(self, guids):
+        """
+        :param guids: Dict hdfs path -> guid of its hdfs_path entity.
+        """
+        with self._lock:
+            for (hdfs_path, guid) in guids.items():
+                if self._guids.get(hdfs_path) != guid:
+                    self._guids[hdfs_path] = guid
+                    self._updated[hdfs_path] = guid
+                    self._forgotten.discard(hdfs_path)
+
+    def forget(self, hdfs_path):
+        """
+        Remove hdfs_path, e.g. when its guid is no longer found in Atlas.
+        """
+        with self._lock:
+            if self._guids.pop(hdfs_path, None) is not None:
+                self._updated.pop(hdfs_path, None)
+                self._forgotten.add(hdfs_path)
+
+    def __len__(self):
+        return len(self._guids)
+
+    def save(self):
+        """
+        Save the cache to file if changed, merged with paths saved by other runs since the file was read.
+        """
+        with self._lock:
+            if self.path is None or (len(self._updated) == 0 and len(self._forgotten) == 0):
+                return
+            guids = self._read()
+            for hdfs_path in self._forgotten:
+                guids.pop(hdfs_path, None)
+            guids.update(self._updated)
+            tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': HdfsPathCache.VERSION, 'paths': guids}, f, sort_keys=True)
+            os.rename(tmp_path, self.path)
+            self._guids = guids
+            self._updated = {}
+            self._forgotten = set()
@@ -0,0 +1,49 @@
+import json
+import threading
+
+"""
+Execution plans, the changes tags_to_atlas and rules_to_ranger would do, saved as a json file so they
+can be reviewed and then applied with apply_plan without computing the diffs again. A plan file is on the form
+    {"version": 1, "environments": {"prod": {"tags": tag plan, "ranger": policy plan}}}
+where a tag plan is created by tagsync.Sync.plan and a policy plan by rangersync.RangerSync.plan_projects.
+"""
+
+PLAN_VERSION = 1
+
+_lock = threading.Lock()
+
+
+def new_plan():
+    return {'version': PLAN_VERSION, 'environments': {}}
+
+
+def add_environment_plan(plan, environment, kind, environment_plan):
+    """
+    :param plan: Plan created with new_plan.
+    :param environment: Name of environment.
+    :param kind: 'tags' or 'ranger'.
+    :param environment_plan: Plan for environment of given kind.
+    """
+    with _lock:
+        plan['environments'].setdefault(environment, {})[kind] = environment_plan
+
+
+def save(plan, path):
+    with open(path, 'w') as f:
+        json.dump(plan, f, indent=2, sort_keys=True, separators=(',', ': '))
+
+
+def load(path):
+    with open(path) as f:
+        plan = json.load(f)
+    if plan.get('version') != PLAN_VERSION:
+        raise PlanError("Plan {} has version {}, expected {}.".format(path, plan.get('version'), PLAN_VERSION))
+    return plan
+
+
+class PlanError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return repr(self.message)
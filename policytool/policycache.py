@@ -1,7 +1,6 @@
 import csv
-import json
+import itertools
 import os
-from collections import Counter
 
 
 # TODO:
@@ -9,60 +8,132 @@ from collections import Counter
 # * HDFS, handle resources not known.
 # Add CLI.
 
-from requests_kerberos import HTTPKerberosAuth
+import configfile
+import jsonstream
 
-import atlas
-import hive
-import tagsync
 
+# Resource elements of a service resource, mapped to the PolicyCache attribute holding that kind of resource
+# and order of elements in its key.
+_RESOURCE_KINDS = {
+    frozenset([u'database']): ('dbResources', (u'database',)),
+    frozenset([u'database', u'table']): ('tableResources', (u'database', u'table')),
+    frozenset([u'database', u'table', u'column']): ('columnResources', (u'database', u'table', u'column')),
+}
 
-class PolicyCache:
 
-    def __init__(self, cache_json_dict):
-        self.tags = cache_json_dict['tags']
-        self.dbResources = PolicyCache._extract_resources(cache_json_dict, 'db')
-        self.tableResources = PolicyCache._extract_resources(cache_json_dict, 'table')
-        self.columnResources = PolicyCache._extract_resources(cache_json_dict, 'column')
-        self.resourceTagMapping = cache_json_dict['resourceToTagIds']
+class PolicyCache:
+    """
+    Index of the tags on databases, tables and columns in a Ranger policy cache for tags.
+    Tag ids and resource ids are stored as integers. The comma separated string of tag names is
+    resolved once per distinct combination of tag ids, since many resources share the same tags.
+    """
 
     @classmethod
-    def _extract_resources(cls, policy_cache_dict, resource):
-        expected_resource_elements = {'db': [u'database'],
-                                      'table': [u'database', u'table'],
-                                      'column': [u'database', u'table', u'column']}[resource]
-        expected_counter = Counter(expected_resource_elements)
-        result = {}
-        for res in policy_cache_dict['serviceResources']:
-            if Counter(res['resourceElements'].keys()) == expected_counter:
-                qualified_key = []
-                for k in expected_resource_elements:
-                    qualified_key.append(res['resourceElements'][k]['values'][0])
-                result[tuple(qualified_key)] = res['id']
-        return result
+    def from_file(cls, policy_cache_file):
+        """
+        Read a policy cache file incrementally, keeping only what is needed to find the tags of the resources.
+        Policy caches are big, this needs only a fraction of the memory of loading the full json document.
+        :param policy_cache_file: Policy cache file with tags copied from Hive.
+        :return: PolicyCache
+        """
+        policy_cache = cls()
+        with open(policy_cache_file, 'rb') as f:
+            streamed_keys = ['serviceResources', 'tags', 'resourceToTagIds']
+            for key, element_key, value in jsonstream.iter_object(f, streamed_keys):
+                if key == 'serviceResources':
+                    policy_cache._add_resource(value)
+                elif key == 'tags':
+                    policy_cache._add_tag(element_key, value)
+                elif key == 'resourceToTagIds':
+                    policy_cache._add_resource_tag_ids(element_key, value)
+        return policy_cache
+
+    def __init__(self, cache_json_dict=None):
+        """
+        :param cache_json_dict: Policy cache as loaded from json, or None for an empty cache.
+        """
+        self.tags = {}
+        self.dbResources = {}
+        self.tableResources = {}
+        self.columnResources = {}
+        self.resourceTagMapping = {}
+        self._tag_strings = {}
+        if cache_json_dict is not None:
+            for res in cache_json_dict['serviceResources']:
+                self._add_resource(res)
+            for tag_id, tag in cache_json_dict['tags'].items():
+                self._add_tag(tag_id, tag)
+            for resource_id, tag_ids in cache_json_dict['resourceToTagIds'].items():
+                self._add_resource_tag_ids(resource_id, tag_ids)
+
+    def _add_tag(self, tag_id, tag):
+        self.tags[int(tag_id)] = str(tag['type'])
+
+    def _add_resource_tag_ids(self, resource_id, tag_ids):
+        self.resourceTagMapping[int(resource_id)] = tuple(tag_ids)
+
+    def _add_resource(self, res):
+        """
+        Add service resource res to the db, table or column resources it belongs to. A resource with
+        many values, e.g. many tables, is added once per combination of values. A resource excluding its
+        values, i.e. tagging everything but them, can not be expanded to keys and is skipped.
+        """
+        elements = res['resourceElements']
+        kind = _RESOURCE_KINDS.get(frozenset(elements))
+        if kind is None or any(element.get('isExcludes', False) for element in elements.values()):
+            return
+        (attribute, element_names) = kind
+        resource_id = res['id']
+        kind_resources = getattr(self, attribute)
+        for qualified_key in itertools.product(*[elements[k]['values'] for k in element_names]):
+            kind_resources[qualified_key] = resource_id
 
     def _tags_for_resource(self, resource_id):
-        tag_ids = self.resourceTagMapping[str(resource_id)]
-        tag_names = [str(self.tags[str(tag_id)]['type']) for tag_id in tag_ids]
-        return tag_names
+        return [self.tags[tag_id] for tag_id in self.resourceTagMapping.get(int(resource_id), ())]
+
+    def _tag_string(self, resource_id):
+        """
+        :return: Tags of the resource as a comma separated string, empty for resources without tags.
+        """
+        tag_ids = self.resourceTagMapping.get(resource_id, ())
+        tag_string = self._tag_strings.get(tag_ids)
+        if tag_string is None:
+            tag_string = ','.join([self.tags[tag_id] for tag_id in tag_ids])
+            self._tag_strings[tag_ids] = tag_string
+        return tag_string
+
+    def iter_tags_for_all_tables(self):
+        """
+        :return: Generator of {'schema': schema, 'table': table, 'tags': tags}, with tags as
+        comma separated string to make structure useful for csv.
+        """
+        for (schema, table), resource_id in self.tableResources.iteritems():
+            yield {'schema': schema, 'table': table, 'tags': self._tag_string(resource_id)}
+
+    def iter_tags_for_all_columns(self):
+        """
+        :return: Generator of {'schema': schema, 'table': table, 'attribute': column, 'tags': tags}, with
+        tags as comma separated string to make structure useful for csv.
+        """
+        for (schema, table, column), resource_id in self.columnResources.iteritems():
+            yield {'schema': schema, 'table': table, 'attribute': column, 'tags': self._tag_string(resource_id)}
+
+    def iter_tags_for_all_databases(self):
+        """
+        :return: Generator of {'schema': schema, 'tags': tags}, with tags as comma separated string
+        to make structure useful for csv.
+        """
+        for (schema,), resource_id in self.dbResources.iteritems():
+            yield {'schema': schema, 'tags': self._tag_string(resource_id)}
 
     def get_tags_for_all_tables(self):
-        # Build structure of tableResources to tags:
-        # Return structure of [{'schema': schema, 'table':table, 'attribute': col, 'tags': tags}, ...]
-        # tags as comma separated string to make structure useful for csv.
-        return [{'schema': resource[0], 'table': resource[1], 'tags': ','.join(self._tags_for_resource(self.tableResources[resource]))} for resource in self.tableResources]
+        return list(self.iter_tags_for_all_tables())
 
     def get_tags_for_all_columns(self):
-        # Build structure of tableResources to tags:
-        # Return structure of {'FQRN': {'schema': schema, 'table':table, 'attribute': col, 'tags': tags}
-        # tags as comma separated string to make structure useful for csv.
-        return [{'schema': resource[0], 'table': resource[1], 'attribute': resource[2], 'tags': ','.join(self._tags_for_resource(self.columnResources[resource]))} for resource in self.columnResources]
+        return list(self.iter_tags_for_all_columns())
 
     def get_tags_for_all_databases(self):
-        # Build structure of tableResources to tags:
-        # Return structure of {'FQRN': {'schema': schema, 'table':table, 'attribute': col, 'tags': tags}
-        # tags as comma separated string to make structure useful for csv.
-        return [{'schema': resource[0], 'tags': ','.join(self._tags_for_resource(self.dbResources[resource]))}
-                for resource in self.dbResources]
+        return list(self.iter_tags_for_all_databases())
 
 
 def extract_policy_cache(config, policy_cache_file=None, table_tag_file=None, column_tag_file=None, hdfs=False, ignore_list=[]):
@@ -79,34 +150,43 @@ def extract_policy_cache(config, policy_cache_file=None, table_tag_file=None, co
     :param ignore_list: List of 'schema.table' to ignore.
     :return: None
     """
-    policy_cache_data = json.load(open(policy_cache_file))
-    policy_cache = PolicyCache(policy_cache_data)
-    tables_dict = _remove_ignores(policy_cache.get_tags_for_all_tables(), ignore_list)
-    columns_dict = _remove_ignores(policy_cache.get_tags_for_all_columns(), ignore_list)
+    policy_cache = PolicyCache.from_file(policy_cache_file)
     if table_tag_file is None and column_tag_file is None:
-        atlas_client = atlas.Client(config['atlas_api_url'], auth=HTTPKerberosAuth())
+        import atlas
+        import tagsync
+        tables_dict = list(_remove_ignores(policy_cache.iter_tags_for_all_tables(), ignore_list))
+        columns_dict = list(_remove_ignores(policy_cache.iter_tags_for_all_columns(), ignore_list))
+        atlas_client = atlas.Client(config['atlas_api_url'], auth=configfile.kerberos_auth())
+        import pathcache
         hive_client = None
         if hdfs:
-            hive_client = hive.Client(config['hive_server'], config['hive_port'])
-        sync_client = tagsync.Sync(atlas_client, hive_client=hive_client)
-        sync_client.sync_table_tags(tables_dict, clear_not_listed=True)
-        sync_client.sync_column_tags(columns_dict, clear_not_listed=True)
-        if hdfs:
-            sync_client.sync_table_storage_tags(tables_dict, clear_not_listed=True)
+            import hive
+            hive_client = hive.client_from_config(config)
+        sync_client = tagsync.Sync(atlas_client, hive_client=hive_client,
+                                   hdfs_path_cache=pathcache.HdfsPathCache(config.get('hdfs_path_cache')),
+                                   fetch_whole_schemas=config.get('atlas_fetch_whole_schemas', False))
+        try:
+            sync_client.sync_table_tags(tables_dict, clear_not_listed=True)
+            sync_client.sync_column_tags(columns_dict, clear_not_listed=True)
+            if hdfs:
+                sync_client.sync_table_storage_tags(tables_dict, clear_not_listed=True)
+        finally:
+            if hive_client is not None:
+                hive_client.close()
     elif table_tag_file and column_tag_file:
-        _write_table_tag_file(table_tag_file, tables_dict)
-        _write_column_tag_file(column_tag_file, columns_dict)
+        _write_table_tag_file(table_tag_file, _remove_ignores(policy_cache.iter_tags_for_all_tables(), ignore_list))
+        _write_column_tag_file(
+            column_tag_file, _remove_ignores(policy_cache.iter_tags_for_all_columns(), ignore_list))
     else:
         raise AttributeError("Either both table tag and column tag files must be set or neither.")
 
 
 def _remove_ignores(table_dict, ignore_list):
-    result=[]
+    ignore = set(ignore_list)
     for t in table_dict:
         fq_table = t['schema'] + '.' + t['table']
-        if fq_table not in ignore_list:
-            result.append(t)
-    return result
+        if fq_table not in ignore:
+            yield t
 
 
 def _write_table_tag_file(table_tag_file, tables_dict):
@@ -0,0 +1,125 @@
+from __future__ import print_function
+import cProfile
+import os
+import pstats
+import sys
+import threading
+from collections import defaultdict
+
+"""
+Profiling of CLI commands. Time is split into local CPU, e.g. template expansion, CSV parsing and diffing,
+and I/O, time blocked in the libraries talking to Atlas, Ranger and Hive.
+"""
+
+# Packages and modules doing network I/O.
+IO_MODULES = ('requests', 'urllib3', 'requests_kerberos', 'kerberos', 'pyhive', 'thrift', 'thrift_sasl', 'sasl',
+              'socket', 'ssl', 'httplib', 'select')
+# Builtin functions doing network I/O, recognised by these words in their names.
+_IO_BUILTIN_WORDS = ('socket', 'ssl', 'select', 'poll', 'getaddrinfo')
+
+
+def is_io(filename, function_name):
+    """
+    :return: True if function in filename is part of network I/O.
+    """
+    if filename == '~':
+        return any(word in function_name for word in _IO_BUILTIN_WORDS)
+    parts = os.path.normpath(filename).split(os.sep)
+    module = os.path.splitext(parts[-1])[0]
+    return module in IO_MODULES or any(part in IO_MODULES for part in parts[:-1])
+
+
+class Profiler:
+    """
+    Deterministic profile, using cProfile, of the thread starting the profiler. Optionally all threads are also
+    sampled, which covers work done in thread pools, e.g. when syncing many environments.
+    """
+
+    def __init__(self, sample_interval=None):
+        """
+        :param sample_interval: Seconds between samples of all threads, or None to not sample.
+        """
+        self.sample_interval = sample_interval
+        self.profile = cProfile.Profile()
+        self.samples = defaultdict(int)
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        if self.sample_interval:
+            self._sampler = threading.Thread(target=self._sample, name='profiler')
+            self._sampler.daemon = True
+            self._sampler.start()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+
+    def _sample(self):
+        own_id = threading.current_thread().ident
+        while not self._stop.wait(self.sample_interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{}:{}".format(_short_path(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        """
+        Write profile in pstats format to path, and samples, if any, as collapsed stacks to path.samples.
+        Collapsed stacks can be rendered with flamegraph.pl.
+        """
+        self.profile.dump_stats(path)
+        if len(self.samples) != 0:
+            with open(path + '.samples', 'w') as f:
+                for stack in sorted(self.samples):
+                    f.write("{} {}\n".format(stack, self.samples[stack]))
+
+    def hotspots(self, limit=10):
+        """
+        :param limit: Number of functions to return per category.
+        :return: Dict with keys 'cpu' and 'io', each {'seconds': total own time, 'functions': [(seconds, calls,
+        'file:line(function)')]} sorted with the function with most own time first.
+        """
+        result = {'cpu': {'seconds': 0.0, 'functions': []}, 'io': {'seconds': 0.0, 'functions': []}}
+        for (filename, line, function_name), (_, calls, own_time, _, _) in pstats.Stats(self.profile).stats.items():
+            category = result['io' if is_io(filename, function_name) else 'cpu']
+            category['seconds'] += own_time
+            category['functions'].append((own_time, calls, "{}:{}({})".format(filename, line, function_name)))
+        for category in result.values():
+            category['functions'] = sorted(category['functions'], reverse=True)[:limit]
+        return result
+
+    def print_hotspots(self, limit=10, echo=print):
+        hotspots = self.hotspots(limit)
+        total = hotspots['cpu']['seconds'] + hotspots['io']['seconds']
+        for (name, title) in [('cpu', 'Local CPU'), ('io', 'Atlas/Ranger/Hive I/O')]:
+            seconds = hotspots[name]['seconds']
+            echo("{}: {:.2f}s ({:.0f}%)".format(title, seconds, 100 * seconds / total if total else 0))
+            for (own_time, calls, function) in hotspots[name]['functions']:
+                echo("  {:8.3f}s {:8d}  {}".format(own_time, calls, function))
+        if len(self.samples) != 0:
+            io_samples = sum(count for stack, count in self.samples.items() if _is_io_stack(stack))
+            echo("Samples: {}, in I/O: {}".format(sum(self.samples.values()), io_samples))
+
+
+def _short_path(filename):
+    """
+    :return: File name with its directory, enough for is_io to recognise the package.
+    """
+    return os.sep.join(os.path.normpath(filename).split(os.sep)[-3:])
+
+
+def _is_io_stack(stack):
+    for frame in stack.split(';'):
+        (filename, function_name) = frame.rsplit(':', 1)
+        if is_io(filename, function_name):
+            return True
+    return False
@@ -1,27 +1,34 @@
 import requests
 
+from retry import HttpRetry
+
 class Client:
 
-    def __init__(self, url_prefix, auth=None):
+    def __init__(self, url_prefix, auth=None, retries=3):
         """
         :param url_prefix: Prefix of the URL to the Ranger API. Example: 'http://ranger.my.org:6080'
         :param auth: If authentication is used. For Kerberos HTTPKerberosAuth(principal="user@MY.REALM")
+        :param retries: Number of retries of a single request on connection errors or transient server errors.
         """
         self.url_prefix = url_prefix
         self.auth=auth
+        # One session per client to reuse connections between requests.
+        self.http = HttpRetry(retries, session=requests.Session(), client='ranger')
 
     def get_service_by_name(self, service_name):
-        return requests.get("{}/service/public/v2/api/service/name/{}".format(self.url_prefix, service_name), auth=self.auth)
+        return self.http.request('GET', "{}/service/public/v2/api/service/name/{}".format(self.url_prefix, service_name), auth=self.auth)
 
     def get_policy_by_name(self, service_name, policy_name):
-        response = requests.get(
+        response = self.http.request(
+            'GET',
             "{}/service/public/v2/api/service/{}/policy/{}".format(self.url_prefix, service_name, policy_name),
             auth=self.auth
         )
         return response
 
     def delete_policy_by_name(self, service_name, policy_name):
-        response = requests.delete(
+        response = self.http.request(
+            'DELETE',
             "{}/service/public/v2/api/policy".format(self.url_prefix),
             params={"servicename": service_name, "policyname": policy_name},
             auth=self.auth
@@ -31,24 +38,35 @@ class Client:
         return response
 
     def get_policies_by_name_part(self, service_name, policy_name_part, page_size=50):
-        response = requests.get(
-            "{}/service/public/v2/api/policy".format(self.url_prefix),
-            params={"serviceName": service_name, "policyNamePartial": policy_name_part, "pageSize": page_size},
-            auth=self.auth
-        )
-        if response.status_code != 200:
-            raise RangerError(response.text, response.status_code)
-        return response.json()
+        """
+        Get all policies in a service with policy_name_part in the name, page_size policies per request.
+        :return: List of policies.
+        """
+        policies = []
+        while True:
+            response = self.http.request(
+                'GET',
+                "{}/service/public/v2/api/policy".format(self.url_prefix),
+                params={"serviceName": service_name, "policyNamePartial": policy_name_part,
+                        "startIndex": len(policies), "pageSize": page_size},
+                auth=self.auth
+            )
+            if response.status_code != 200:
+                raise RangerError(response.text, response.status_code)
+            page = response.json()
+            policies.extend(page)
+            if len(page) < page_size:
+                return policies
 
     def create_policy(self, policy):
         # Here is would be preferable to use the V2 API: service/public/v2/api/policy/apply.
         # But currently it ignores the policyType and store row level policies as access policies.
         # So instead I use an undocumented API that is used in the Ranger web app.
-        return requests.post("{}/service/plugins/policies".format(self.url_prefix), json=policy, auth=self.auth)
+        return self.http.request('POST', "{}/service/plugins/policies".format(self.url_prefix), json=policy, auth=self.auth)
 
     def update_policy(self, policy_id, policy):
         url = "{}/service/plugins/policies/{}".format(self.url_prefix, policy_id)
-        return requests.put(url, json=policy, auth=self.auth)
+        return self.http.request('PUT', url, json=policy, auth=self.auth)
 
     def apply_policy(self, policy, verbose=0, dryrun=False):
         service_name = policy["service"]
@@ -1,12 +1,15 @@
 import copy
 
 import urlutil
+from hive import LocationCache
+from ranger import RangerError
 from policyutil import validate_policy, get_resource_type, extend_tag_policy_with_hdfs
 from template import apply_context
 from collections import namedtuple
 import click
 import sys
 from collections import defaultdict
+from multiprocessing.pool import ThreadPool
 
 
 def apply_commands(policy_commands, context):
@@ -16,11 +19,33 @@ def apply_commands(policy_commands, context):
     :param context: Context describing tables and tags
     :return: policies for tables
     """
+    if context.has_key("hive_client"):
+        hive_client = context["hive_client"]
+        if not isinstance(hive_client, LocationCache):
+            hive_client = LocationCache(hive_client)
+            context = context.extend({"hive_client": hive_client})
+        hive_client.prefetch(_hive_tables_to_expand(policy_commands, context))
     policy_lists = [apply_command(policy_command, context) for policy_command in policy_commands]
     policies = [policy for policies in policy_lists for policy in policies]
     return policies
 
 
+def _hive_tables_to_expand(policy_commands, context):
+    """
+    :return: Set of (database, table) in database resources of policies expanded to hdfs paths.
+    """
+    database_tables = set()
+    for policy_command in policy_commands:
+        if policy_command['command'] != 'apply_rule' or \
+                not policy_command.get('options', {}).get("expandHiveResourceToHdfs", False):
+            continue
+        resources = apply_context(policy_command['policy'].get('resources', {}), context)
+        if resources.has_key("database") and resources.has_key("table"):
+            database_tables.update((db, table) for db in resources["database"]["values"]
+                                   for table in resources["table"]["values"])
+    return database_tables
+
+
 def apply_command(policy_command, context):
     """
     Expand one tag policy to policies for tables with that tag
@@ -192,11 +217,22 @@ def _tags_to_columns(columns):
 RuleIdentifier = namedtuple('RuleIdentifier', 'service,name')
 
 
+def _echo_to_stderr(line):
+    click.echo(line, file=sys.stderr)
+
+
 class RangerSync:
-    def __init__(self, ranger_client, verbose=0, dryrun=False):
+    def __init__(self, ranger_client, verbose=0, dryrun=False, echo=_echo_to_stderr):
+        """
+        :param ranger_client: Client to talk to Ranger.
+        :param verbose: Verbosity of output.
+        :param dryrun: Set to true to not change anything in Ranger.
+        :param echo: Function printing a line of verbose output, e.g. buffering output per environment.
+        """
         self.ranger_client = ranger_client
         self.verbose = verbose
         self.dryrun = dryrun
+        self.echo = echo
 
     def sync_policies(self, prefixes, policies):
         service_names = set(policy['service'] for policy in policies)
@@ -207,6 +243,110 @@ class RangerSync:
         self._delete_policies(delete_policies)
         self._apply_policies(policies)
 
+    def sync_projects(self, projects):
+        """
+        Sync policies for many projects at once. Current policies are fetched once per service and
+        a single plan of deletes, creates and updates is computed for all projects.
+        :param projects: List of (prefixes, policies) per project. Policies in Ranger with a name containing
+        one of the prefixes, and not among the wanted policies of any project, are deleted.
+        """
+        self.apply_plan(self.plan_projects(projects))
+
+    def plan_policies(self, prefixes, policies):
+        """
+        :param prefixes: Policies in Ranger with a name starting with one of the prefixes, and not among
+        policies, are deleted.
+        :param policies: Wanted policies.
+        :return: Plan, see plan_projects.
+        """
+        return self.plan_projects([(prefixes, policies)])
+
+    def plan_projects(self, projects):
+        """
+        Compute what to change in Ranger, without changing anything.
+        :param projects: See sync_projects.
+        :return: Plan that can be serialised as json and applied with apply_plan. On form
+        {'delete': [{'service': s, 'name': n}], 'create': [policy], 'update': [{'id': id, 'policy': policy}]}
+        Wanted policies equal to the policy in Ranger are neither created nor updated.
+        """
+        wanted_policies = {}
+        prefixes = set()
+        for (project_prefixes, policies) in projects:
+            prefixes.update(project_prefixes)
+            for policy in policies:
+                identifier = RuleIdentifier(policy.get("service"), policy.get("name"))
+                if identifier in wanted_policies and wanted_policies[identifier] != policy:
+                    raise RangerSyncError(
+                        "Policy {}.{} defined differently in many projects.".format(identifier.service, identifier.name))
+                wanted_policies[identifier] = policy
+        service_names = set(identifier.service for identifier in wanted_policies)
+        current_policies = {}
+        for policy in self._current_policies(prefixes, service_names):
+            current_policies[RuleIdentifier(policy.get("service"), policy.get("name"))] = policy
+        delete_policies = set(current_policies.keys()) - set(wanted_policies.keys())
+        create_policies = []
+        update_policies = []
+        for identifier, policy in wanted_policies.items():
+            if identifier not in current_policies and not any(prefix in identifier.name for prefix in prefixes):
+                # Wanted policies without any of the prefixes in the name are looked up one by one.
+                response = self.ranger_client.get_policy_by_name(identifier.service, identifier.name)
+                if response.status_code == 200:
+                    current_policies[identifier] = response.json()
+                elif response.status_code != 404:
+                    raise RangerError(response.text, response.status_code)
+            if identifier not in current_policies:
+                create_policies.append(policy)
+            else:
+                current_policy = current_policies[identifier]
+                updated_policy = copy.deepcopy(current_policy)
+                updated_policy.update(policy)
+                if updated_policy != current_policy:
+                    update_policies.append({'id': current_policy["id"], 'policy': updated_policy})
+        return {'delete': [identifier._asdict() for identifier in sorted(delete_policies)],
+                'create': create_policies,
+                'update': update_policies}
+
+    def apply_plan(self, policy_plan, parallel=1):
+        """
+        Apply a plan created with plan_projects or plan_policies. Policies in Ranger are not read again.
+        :param policy_plan: The plan.
+        :param parallel: Number of creates and updates to do at the same time. Deletes are done first. Each thread
+        talks to Ranger over its own connections, see retry.HttpRetry.
+        """
+        self._delete_policies(RuleIdentifier(p['service'], p['name']) for p in policy_plan['delete'])
+        changes = [(self._create_policy, (policy,)) for policy in policy_plan['create']]
+        changes.extend((self._update_policy, (u['id'], u['policy'])) for u in policy_plan['update'])
+        if parallel > 1:
+            pool = ThreadPool(parallel)
+            try:
+                pool.map(lambda change: change[0](*change[1]), changes)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for (func, args) in changes:
+                func(*args)
+
+    def _create_policy(self, policy):
+        if self.verbose > 0:
+            self.echo(click.style("Create {}.{}".format(policy['service'], policy['name']), fg='green'))
+            self.echo(str(policy))
+        if not self.dryrun:
+            response = self.ranger_client.create_policy(policy)
+            if response.status_code != 200:
+                raise RangerError("Couldn't create policy {}.{}: {}".format(
+                    policy['service'], policy['name'], response.text), response.status_code)
+
+    def _update_policy(self, policy_id, policy):
+        if self.verbose > 0:
+            self.echo(click.style("Update {}.{}".format(policy['service'], policy['name']), fg='green'))
+            self.echo(str(policy))
+        if not self.dryrun:
+            response = self.ranger_client.update_policy(policy_id, policy)
+            if response.status_code != 200:
+                raise RangerError("Couldn't update policy {}.{}: {}".format(
+                    policy['service'], policy['name'], response.text), response.status_code)
+
     def _current_policies(self, prefixes, service_names):
         current_policies = []
         for prefix in prefixes:
@@ -218,22 +358,22 @@ class RangerSync:
     def _delete_policies(self, policies):
         for policy_id in policies:
             if self.verbose  > 0:
-                click.secho("Delete {}.{}".format(policy_id.service, policy_id.name), file=sys.stderr, fg='red')
+                self.echo(click.style("Delete {}.{}".format(policy_id.service, policy_id.name), fg='red'))
             if not self.dryrun:
                 response = self.ranger_client.delete_policy_by_name(policy_id.service, policy_id.name)
                 if self.verbose > 0:
-                    print(response.status_code)
-                    print(response.reason)
-                    print(response.text)
+                    self.echo(str(response.status_code))
+                    self.echo(response.reason)
+                    self.echo(response.text)
 
     def _apply_policies(self, policies):
         for policy in policies:
             if self.verbose  > 0:
-                click.secho("Update {}.{}".format(policy['service'], policy['name']), file=sys.stderr, fg='green')
-                print(policy)
+                self.echo(click.style("Update {}.{}".format(policy['service'], policy['name']), fg='green'))
+                self.echo(str(policy))
             response = self.ranger_client.apply_policy(policy, self.verbose, self.dryrun)
             if self.verbose > 1:
-                print(response)
+                self.echo(str(response))
 
 
 class RangerSyncError(Exception):
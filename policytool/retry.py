@@ -0,0 +1,169 @@
+import random
+import threading
+import time
+
+import requests
+import urllib3
+
+import instrumentation
+
+"""
+Retry of single requests against Atlas, Ranger and Hive with jittered exponential backoff.
+"""
+
+# Status codes that indicate a transient problem on the server side, worth retrying.
+RETRY_STATUS_CODES = frozenset([429, 502, 503, 504])
+# Status codes telling that the server did not handle the request, safe to retry for any method.
+NOT_HANDLED_STATUS_CODES = frozenset([429, 503])
+# Methods that may have changed something on the server even if the response is lost or is 502 or 504.
+NON_IDEMPOTENT_METHODS = frozenset(['POST', 'PUT', 'PATCH'])
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """
+    Delay before the next attempt using "full jitter" exponential backoff.
+    :param attempt: Number of attempts done so far, starting on 1.
+    :param base_delay: Delay in seconds for the first retry, before jitter.
+    :param max_delay: Upper bound of the delay in seconds.
+    :return: Seconds to sleep.
+    """
+    return random.uniform(0, min(max_delay, base_delay * (2 ** (attempt - 1))))
+
+
+def call_with_retry(func, retries, base_delay, max_delay, should_retry, sleep=time.sleep):
+    """
+    Call func until it succeeds or retries are exhausted.
+    :param func: Function without arguments to call.
+    :param retries: Max number of retries, 0 means only one call.
+    :param base_delay: See backoff_delay.
+    :param max_delay: See backoff_delay.
+    :param should_retry: Function taking (result, exception) returning True if another attempt shall be made.
+    :param sleep: Function used to sleep, replaceable in tests.
+    :return: Result of the last call to func.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            result = func()
+        except Exception as e:
+            if attempt > retries or not should_retry(None, e):
+                raise
+        else:
+            if attempt > retries or not should_retry(result, None):
+                return result
+        sleep(backoff_delay(attempt, base_delay, max_delay))
+
+
+def _is_connect_error(exception):
+    """
+    True if exception tells that no connection was made, so the request never reached the server.
+    """
+    if isinstance(exception, requests.ConnectTimeout):
+        return True
+    return isinstance(exception, requests.ConnectionError) and len(exception.args) != 0 and \
+        isinstance(getattr(exception.args[0], 'reason', None), urllib3.exceptions.NewConnectionError)
+
+
+def _should_retry_http(response, exception, idempotent=True):
+    """
+    :param idempotent: Set to false if the request must not be sent again if the server may have handled it,
+    then it is only retried on connect errors and status codes in NOT_HANDLED_STATUS_CODES.
+    """
+    if exception is not None:
+        if not idempotent:
+            return _is_connect_error(exception)
+        return isinstance(exception, (requests.ConnectionError, requests.Timeout))
+    if not idempotent:
+        return response.status_code in NOT_HANDLED_STATUS_CODES
+    return response.status_code in RETRY_STATUS_CODES
+
+
+class HttpRetry:
+    """
+    Policy for retrying HTTP requests, shared by the Atlas and Ranger clients.
+    A requests.Session is not thread safe, the session given is only used by the thread creating the HttpRetry.
+    Other threads, e.g. applying plans in parallel, get a session of their own kept for the life of the thread.
+    """
+
+    def __init__(self, retries=3, base_delay=0.5, max_delay=30, session=None, client='http'):
+        """
+        :param retries: Max number of retries for one request.
+        :param base_delay: Delay in seconds before the first retry, before jitter.
+        :param max_delay: Upper bound of delay in seconds between two attempts.
+        :param session: requests.Session to reuse connections with, or None to use a new connection per request.
+        :param client: Name of client requests are recorded for, see instrumentation.
+        """
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.session = session
+        self.client = client
+        self._thread = threading.current_thread()
+        self._thread_sessions = threading.local()
+
+    def _requester(self):
+        if self.session is None:
+            return requests
+        if threading.current_thread() is self._thread:
+            return self.session
+        session = getattr(self._thread_sessions, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self._thread_sessions.session = session
+        return session
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        """
+        Do a HTTP request, retried on connection errors and on status codes in RETRY_STATUS_CODES.
+        Requests with a method in NON_IDEMPOTENT_METHODS are only retried if the server did not handle them,
+        see _should_retry_http. Other arguments are the same as for requests.request.
+        :param idempotent: Set to true for requests safe to repeat whatever method, e.g. searches sent with POST.
+        Defaults to false for methods in NON_IDEMPOTENT_METHODS.
+        :return: requests.Response of the last attempt.
+        """
+        requester = self._requester()
+        if idempotent is None:
+            idempotent = method not in NON_IDEMPOTENT_METHODS
+
+        def should_retry(response, exception):
+            return _should_retry_http(response, exception, idempotent)
+
+        if instrumentation.get_recorder() is None:
+            return call_with_retry(
+                lambda: requester.request(method, url, **kwargs),
+                self.retries, self.base_delay, self.max_delay, should_retry)
+
+        attempts = [0]
+
+        def attempt():
+            attempts[0] += 1
+            return requester.request(method, url, **kwargs)
+
+        start = time.time()
+        response = None
+        try:
+            response = call_with_retry(attempt, self.retries, self.base_delay, self.max_delay, should_retry)
+            return response
+        finally:
+            instrumentation.record(
+                self.client, instrumentation.http_endpoint(method, url), time.time() - start,
+                error=response is None or response.status_code >= 400,
+                retries=attempts[0] - 1,
+                bytes_sent=_request_size(response),
+                bytes_received=_response_size(response, kwargs.get('stream', False)))
+
+
+def _request_size(response):
+    if response is None or response.request is None or response.request.body is None:
+        return 0
+    return len(response.request.body)
+
+
+def _response_size(response, stream):
+    if response is None:
+        return 0
+    if stream:
+        # Reading content here would consume the stream.
+        return int(response.headers.get('Content-Length', 0))
+    return len(response.content)
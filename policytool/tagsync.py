@@ -1,8 +1,12 @@
 from __future__ import print_function
 import csv
+import threading
 import time
+from multiprocessing.pool import ThreadPool
 from atlas import AtlasError
-from hive import HiveError
+from hive import HiveError, LocationCache
+from pathcache import HdfsPathCache
+from retry import backoff_delay
 
 
 def strip_qualified_name(qualified_name):
@@ -21,9 +25,9 @@ def add_environment(data, environment):
     return data
 
 
-def print_sync_worklog(log):
+def print_sync_worklog(log, echo=print):
     for k in log:
-        print(k+": "+"\n\t".join(log[k]))
+        echo(k+": "+"\n\t".join(log[k]))
 
 
 def tags_from_src(src_data):
@@ -102,18 +106,213 @@ def _tags_as_set(csv_line):
     return set(csv_line['tags'].split(',')) - {''}
 
 
+def _table_name(csv_line):
+    return csv_line['schema']+"."+csv_line['table']
+
+
+def _column_name(csv_line):
+    return csv_line['schema']+"."+csv_line['table']+"."+csv_line['attribute']
+
+
+def _entities_by_name(entities):
+    """
+    :param entities: Tables or columns as returned by searches in Atlas.
+    :return: {'schema.table': {'guid':, 'tags': set()}, ...
+    """
+    return dict((strip_qualified_name(e['attributes']['qualifiedName']),
+                 {'guid': e['guid'], 'tags': set(e['classificationNames'])}) for e in entities)
+
+
+def _tag_change(phase, entity, guid, expected_tags, current_tags, **extra):
+    """
+    :param phase: Kind of entity, table, column or storage.
+    :param entity: Name of entity, e.g. schema.table.
+    :param guid: Guid of entity in Atlas.
+    :param expected_tags: Set of tags entity shall have.
+    :param current_tags: Set of tags entity has in Atlas.
+    :param extra: Other keys to add to the change, e.g. hdfs_path for storage.
+    :return: A change that can be serialised as json on the form
+    {'phase': 'table', 'entity': 'schema.table', 'guid': guid, 'tags': [expected], 'add': [..], 'delete': [..]}
+    """
+    change = {'phase': phase,
+              'entity': entity,
+              'guid': guid,
+              'tags': sorted(expected_tags),
+              'add': sorted(expected_tags-current_tags),
+              'delete': sorted(current_tags-expected_tags)}
+    change.update(extra)
+    return change
+
+
+def _merge_storage_changes(changes):
+    """
+    Merge storage changes of tables sharing a location into one change per hdfs path, expecting the tags of all
+    those tables. The entity of the path is then created, and each tag added, only once when applying a plan.
+    :param changes: Storage changes, see _tag_change.
+    :return: List of changes. A merged change has the names of its tables in key tables.
+    """
+    paths = []
+    changes_by_path = {}
+    for change in changes:
+        if not changes_by_path.has_key(change['hdfs_path']):
+            paths.append(change['hdfs_path'])
+        changes_by_path.setdefault(change['hdfs_path'], []).append(change)
+    result = []
+    for hdfs_path in paths:
+        path_changes = changes_by_path[hdfs_path]
+        if len(path_changes) == 1:
+            result.append(path_changes[0])
+            continue
+        first = path_changes[0]
+        expected_tags = set()
+        for change in path_changes:
+            expected_tags.update(change['tags'])
+        current_tags = (set(first['tags']) - set(first['add'])) | set(first['delete'])
+        result.append(_tag_change('storage', first['entity'], first['guid'], expected_tags, current_tags,
+                                  hdfs_path=hdfs_path, tables=[change['entity'] for change in path_changes]))
+    return result
+
+
+class TagDefinitions:
+    """
+    Tag definitions in one Atlas, shared by the syncs of all environments using that Atlas. Tags required by
+    any of them are created together in one request, the first time a sync ensures its tags, instead of each
+    sync creating its own tags and concurrent syncs conflicting. Thread safe.
+    """
+
+    def __init__(self, atlas_client, cache_known_tags=True, required_tags=()):
+        """
+        :param atlas_client: Client to talk to Atlas.
+        :param cache_known_tags: Set to true to fetch tags known by Atlas only once, call forget if tag definitions
+        may have been removed in Atlas.
+        :param required_tags: Tags to create with the tags of the first call to ensure, e.g. all tags in the
+        source files.
+        """
+        self.atlas_client = atlas_client
+        self.cache_known_tags = cache_known_tags
+        self._required_tags = set(required_tags)
+        self._known_tags = None
+        self._lock = threading.Lock()
+
+    def require(self, tags):
+        """
+        Add tags to create with the tags of the next call to ensure.
+        """
+        with self._lock:
+            self._required_tags.update(tags)
+
+    def known(self):
+        """
+        :return: Set of tags known by Atlas.
+        """
+        with self._lock:
+            return set(self._known())
+
+    def _known(self):
+        if self._known_tags is not None:
+            return self._known_tags
+        tags = set([t['name'] for t in self.atlas_client.known_tags()])
+        if self.cache_known_tags:
+            self._known_tags = tags
+        return tags
+
+    def forget(self):
+        with self._lock:
+            self._known_tags = None
+
+    def ensure(self, tags):
+        """
+        Create tags, and the required tags, not known by Atlas. Tags created by someone else at the same
+        time are not an error.
+        :param tags: Tags that must exist in Atlas.
+        :return: Set of tags created.
+        """
+        with self._lock:
+            missing_tags = (set(tags) | self._required_tags) - self._known()
+            created_tags = set()
+            if len(missing_tags) != 0:
+                created_tags = self.atlas_client.add_tag_definitions(missing_tags)
+                if self._known_tags is not None:
+                    self._known_tags.update(missing_tags)
+            self._required_tags = set()
+            return created_tags
+
+
 class Sync:
     """
-    This class is not thread safe.
+    This class is not thread safe, except apply_plan which applies changes in many threads.
+
+    Transient errors on single requests are retried by the clients. If a sync still fails it is rerun
+    after a backoff delay, but entities already synced in an earlier run are not synced again.
+    Synced entities are also recorded in a checkpoint journal, so an interrupted sync can be resumed
+    by a new process.
     """
 
     worklog = {}
 
-    def __init__(self, atlas_client, retries=0, retry_delay=60, hive_client=None):
+    def __init__(self, atlas_client, retries=0, retry_delay=10, hive_client=None, max_retry_delay=120,
+                 journal=None, cache_known_tags=False, hdfs_path_cache=None, fetch_whole_schemas=False,
+                 tag_definitions=None):
+        """
+        :param atlas_client: Client to talk to Atlas.
+        :param retries: Number of times a failed sync is rerun.
+        :param retry_delay: Base delay in seconds before rerun, doubled for each rerun and jittered.
+        :param hive_client: Client to talk to Hive, only needed to sync table storage tags.
+        :param max_retry_delay: Upper bound of the delay in seconds before a rerun.
+        :param journal: checkpoint.Journal to record synced entities in and skip entities already synced
+        by an earlier process, or None to not use a checkpoint journal.
+        :param cache_known_tags: Set to true to fetch tags known by Atlas only once and keep them between syncs,
+        for long running processes. Call forget_known_tags if tag definitions may have changed in Atlas.
+        :param hdfs_path_cache: pathcache.HdfsPathCache with guids of hdfs_path entities, or None to only
+        remember them in memory. Only hdfs_path entities not in the cache are created or updated in Atlas.
+        :param fetch_whole_schemas: Set to true to fetch tables and columns of whole schemas at once by following
+        relationships in Atlas, see atlas.Client.get_schema, instead of searching for the tables of each schema and
+        the columns of each table. A schema fetched by a table sync is reused by the following column sync.
+        :param tag_definitions: TagDefinitions shared with syncs of other environments using the same Atlas, or None
+        for one of its own. cache_known_tags is not used with a shared TagDefinitions.
+        """
         self.atlas_client = atlas_client
         self.hive_client = hive_client
         self.retries = retries
         self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.journal = journal
+        if tag_definitions is None:
+            tag_definitions = TagDefinitions(atlas_client, cache_known_tags)
+        self.tag_definitions = tag_definitions
+        self.hdfs_path_cache = hdfs_path_cache if hdfs_path_cache is not None else HdfsPathCache()
+        self.fetch_whole_schemas = fetch_whole_schemas
+        self._schemas = {}
+        self._completed = set()
+        # Phases where entities only in Atlas are added to the entities to sync, done once per sync.
+        self._cleared = set()
+        # Guards worklog and _completed while apply_plan applies changes in parallel.
+        self._lock = threading.Lock()
+
+    def _sleep_before_rerun(self, run):
+        time.sleep(backoff_delay(run, self.retry_delay, self.max_retry_delay))
+
+    def _start_sync(self):
+        self.worklog = {}
+        self._completed = set()
+        self._cleared = set()
+
+    def _is_done(self, phase, name, expected_tags):
+        """
+        True if name is synced in an earlier run of this sync, or in an earlier process according to the journal.
+        """
+        if name in self._completed:
+            return True
+        if self.journal is not None and self.journal.is_done(phase, name, expected_tags):
+            self._completed.add(name)
+            self.worklog.setdefault('%s already synced according to checkpoint' % phase, set()).add(name)
+            return True
+        return False
+
+    def _mark_done(self, phase, name, expected_tags, tags_added=(), tags_deleted=()):
+        self._completed.add(name)
+        if self.journal is not None:
+            self.journal.record(phase, name, expected_tags, tags_added, tags_deleted)
 
     def sync_table_tags(self, src_table_tags, clear_not_listed=False):
         """
@@ -122,50 +321,62 @@ class Sync:
          have it tags removed.
         :return: Dictionary with actions as keys and metadata as value, used for logging.
         """
-        self.worklog = {}
+        self._start_sync()
+        self.forget_schemas()
         run = 0
         while True:
             try:
                 run += 1
                 return self._sync_table_tags(src_table_tags, run, clear_not_listed)
             except (SyncError, IOError, AtlasError) as e:
+                self.forget_schemas()
                 if run > self.retries:
                     raise e
-                time.sleep(self.retry_delay)
+                self._sleep_before_rerun(run)
 
     def _sync_table_tags(self, src_table_tags, run, clear_not_listed=False):
         # Verify Atlas knows about all tags used.
 
         self.ensure_tags_in_atlas(src_table_tags)
+        for change in self._table_tag_changes(src_table_tags, run, clear_not_listed):
+            self._apply_change(change, run)
+        return self.worklog
 
+    def _table_tag_changes(self, src_table_tags, run, clear_not_listed=False):
+        """
+        :return: Generator of tag changes, see _tag_change, for each table not already synced.
+        """
         # Get all tables for schemas from atlas. Verify all exists. (both directions)
-        schemas = schemas_from_src(src_table_tags)
+        # Schemas where all tables are synced in an earlier run are not fetched again, unless tables only in Atlas
+        # are still to be looked for in them.
+        pending_tables = [s for s in src_table_tags if not self._is_done('table', _table_name(s), _tags_as_set(s))]
+        clear = clear_not_listed and 'table' not in self._cleared
+        schemas = schemas_from_src(src_table_tags if clear else pending_tables)
         src_tables = tables_from_src(src_table_tags)
         atlas_tables = self.get_tables_for_schema_from_atlas(schemas)
-        if len(src_tables-set(atlas_tables.keys())) != 0:
-            raise SyncError("run:%s The table(s) %s does not exist in Atlas." % (run, ", ".join(src_tables-set(atlas_tables.keys()))))
+        missing_tables = tables_from_src(pending_tables)-set(atlas_tables.keys())
+        if len(missing_tables) != 0:
+            raise SyncError("run:%s The table(s) %s does not exist in Atlas." % (run, ", ".join(missing_tables)))
         tables_only_known_by_atlas = set(atlas_tables.keys())-src_tables
         if len(tables_only_known_by_atlas) != 0:
             self.worklog['run:%s tables not existing in tags file' % run] = tables_only_known_by_atlas
-            if clear_not_listed:
+            if clear:
                 for t in tables_only_known_by_atlas:
+                    if self._is_done('table', t, set()):
+                        continue
                     (schema, table) = t.split(".")
                     src_table_tags.append({'schema': schema, 'table': table, 'tags': ''})
-            
-        # For each table, sync tags
+        if clear:
+            self._cleared.add('table')
+
+        # For each table, diff tags
         for s in src_table_tags:
+            table_name = _table_name(s)
             expected_tags = _tags_as_set(s)
-            table_name = s['schema']+"."+s['table']
+            if self._is_done('table', table_name, expected_tags):
+                continue
             atlas_table = atlas_tables[table_name]
-            tags_to_add = expected_tags-atlas_table['tags']
-            tags_to_delete = atlas_table['tags']-expected_tags
-            if len(tags_to_add) != 0:
-                self.atlas_client.add_tags_on_guid(atlas_table['guid'], list(tags_to_add))
-                self.worklog['run:%s %s added tag' % (run, table_name)] = tags_to_add
-            if len(tags_to_delete) != 0:
-                self.atlas_client.delete_tags_on_guid(atlas_table['guid'], list(tags_to_delete))
-                self.worklog['run:%s %s deleted tag' % (run, table_name)] = tags_to_delete
-        return self.worklog
+            yield _tag_change('table', table_name, atlas_table['guid'], expected_tags, atlas_table['tags'])
 
     def sync_column_tags(self, src_column_tags, clear_not_listed=False):
         """
@@ -174,16 +385,20 @@ class Sync:
         shall have it tags removed.
         :return: Dictionary with actions as keys and metadata as value.
         """
-        self.worklog = {}
+        self._start_sync()
         run = 0
-        while True:
-            try:
-                run += 1
-                return self._sync_column_tags(src_column_tags, run, clear_not_listed)
-            except (SyncError, IOError, AtlasError) as e:
-                if run > self.retries:
-                    raise e
-                time.sleep(self.retry_delay)
+        try:
+            while True:
+                try:
+                    run += 1
+                    return self._sync_column_tags(src_column_tags, run, clear_not_listed)
+                except (SyncError, IOError, AtlasError) as e:
+                    self.forget_schemas()
+                    if run > self.retries:
+                        raise e
+                    self._sleep_before_rerun(run)
+        finally:
+            self.forget_schemas()
 
     def _sync_column_tags(self, src_column_tags, run, clear_not_listed=False):
         """
@@ -194,53 +409,117 @@ class Sync:
         """
 
         self.ensure_tags_in_atlas(src_column_tags)
+        for change in self._column_tag_changes(src_column_tags, run, clear_not_listed):
+            self._apply_change(change, run)
+        return self.worklog
 
+    def _column_tag_changes(self, src_column_tags, run, clear_not_listed=False):
+        """
+        :return: Generator of tag changes, see _tag_change, for each column not already synced.
+        """
         # Get all columns for tables from atlas. Verify all exists. (both directions)
-        src_tables = tables_from_src(src_column_tags)
+        # Tables where all columns are synced in an earlier run are not fetched again, unless columns only in
+        # Atlas are still to be looked for in them.
+        pending_columns = [s for s in src_column_tags
+                           if not self._is_done('column', _column_name(s), _tags_as_set(s))]
+        clear = clear_not_listed and 'column' not in self._cleared
+        src_tables = tables_from_src(src_column_tags if clear else pending_columns)
         src_columns = columns_from_src(src_column_tags)
         atlas_columns = self.get_columns_for_tables_from_atlas(src_tables)
-        if len(src_columns-set(atlas_columns.keys())) != 0:
-            raise SyncError("run:%s The column(s) %s does not exist in Atlas." % (run, ", ".join(src_columns-set(atlas_columns.keys()))))
+        missing_columns = columns_from_src(pending_columns)-set(atlas_columns.keys())
+        if len(missing_columns) != 0:
+            raise SyncError("run:%s The column(s) %s does not exist in Atlas." % (run, ", ".join(missing_columns)))
         columns_only_known_by_atlas = set(atlas_columns.keys())-src_columns
         if len(columns_only_known_by_atlas) != 0:
             self.worklog['run:%s columns not existing in tags file' % run] = columns_only_known_by_atlas
-            if clear_not_listed:
+            if clear:
                 for t in columns_only_known_by_atlas:
+                    if self._is_done('column', t, set()):
+                        continue
                     (schema, table, attribute) = t.split(".")
                     src_column_tags.append({'schema': schema, 'table': table, 'attribute': attribute, 'tags': ''})
-            
-        # Remove columns that does not exists in Atlas
-        # For each column, sync tags
+        if clear:
+            self._cleared.add('column')
+
+        # For each column, diff tags
         for s in src_column_tags:
+            column_name = _column_name(s)
             expected_tags = _tags_as_set(s)
-            column_name = s['schema']+"."+s['table']+"."+s['attribute']
+            if self._is_done('column', column_name, expected_tags):
+                continue
             atlas_column = atlas_columns[column_name]
-            tags_to_add = expected_tags-atlas_column['tags']
-            tags_to_delete = atlas_column['tags']-expected_tags
+            yield _tag_change('column', column_name, atlas_column['guid'], expected_tags, atlas_column['tags'])
+
+    def _apply_change(self, change, run=None):
+        """
+        Apply a tag change, see _tag_change, to Atlas.
+        :param change: The change.
+        :param run: Number of run, used in worklog.
+        """
+        guid = change['guid']
+        if change['phase'] == 'storage':
+            log_name = change['hdfs_path']
+            if guid is None:
+                guid = self.atlas_client.add_hdfs_path(change['hdfs_path'])
+                self.hdfs_path_cache.update({change['hdfs_path']: guid})
+        elif run is not None:
+            log_name = 'run:%s %s' % (run, change['entity'])
+        else:
+            log_name = change['entity']
+        tags_to_add = set(change['add'])
+        tags_to_delete = set(change['delete'])
+        if len(tags_to_add) != 0:
+            self.atlas_client.add_tags_on_guid(guid, list(tags_to_add))
+        if len(tags_to_delete) != 0:
+            self.atlas_client.delete_tags_on_guid(guid, list(tags_to_delete))
+        with self._lock:
             if len(tags_to_add) != 0:
-                self.atlas_client.add_tags_on_guid(atlas_column['guid'], list(tags_to_add))
-                self.worklog['run:%s %s added tag' % (run, column_name)] = tags_to_add
+                self.worklog['%s added tag' % log_name] = tags_to_add
             if len(tags_to_delete) != 0:
-                self.atlas_client.delete_tags_on_guid(atlas_column['guid'], list(tags_to_delete))
-                self.worklog['run:%s %s deleted tag' % (run, column_name)] = tags_to_delete
-        return self.worklog
+                self.worklog['%s deleted tag' % log_name] = tags_to_delete
+            for name in change.get('tables', [change['entity']]):
+                self._mark_done(change['phase'], name, set(change['tags']), tags_to_add, tags_to_delete)
 
     def tags_from_atlas(self):
-        return set([t['name'] for t in self.atlas_client.known_tags()])
+        return self.tag_definitions.known()
+
+    def forget_known_tags(self):
+        self.tag_definitions.forget()
 
     def ensure_tags_in_atlas(self, csv_dict):
-        src_tags = tags_from_src(csv_dict)
-        atlas_tags = self.tags_from_atlas()
-        missing_atlas_tags = src_tags - atlas_tags
-        if len(missing_atlas_tags) != 0:
-            self.atlas_client.add_tag_definitions(missing_atlas_tags)
-            self.worklog['New tags added to Atlas'] = missing_atlas_tags
+        self._ensure_tags(tags_from_src(csv_dict))
+
+    def _ensure_tags(self, tags):
+        created_tags = self.tag_definitions.ensure(tags)
+        if len(created_tags) != 0:
+            self.worklog['New tags added to Atlas'] = created_tags
+
+    def _schema_from_atlas(self, schema):
+        """
+        :return: (tables, columns) of schema, on the form returned by get_tables_for_schema_from_atlas and
+        get_columns_for_tables_from_atlas. Kept until forget_schemas is called.
+        """
+        if not self._schemas.has_key(schema):
+            (tables, columns) = self.atlas_client.get_schema(schema)
+            self._schemas[schema] = (_entities_by_name(tables), _entities_by_name(columns))
+        return self._schemas[schema]
+
+    def forget_schemas(self):
+        """
+        Forget schemas fetched with fetch_whole_schemas, call when tags may have changed in Atlas.
+        """
+        self._schemas = {}
 
     def get_tables_for_schema_from_atlas(self, schemas):
         """
         :param schemas:
         :return: {'schema.table': {'guid':, 'tags': []}, ...
         """
+        if self.fetch_whole_schemas:
+            result = {}
+            for schema in schemas:
+                result.update(self._schema_from_atlas(schema)[0])
+            return result
         result={}
         for schema in schemas:
             for table in self.atlas_client.get_tables(schema):
@@ -254,6 +533,14 @@ class Sync:
         :param src_tables: ['schema.table1', 'schema.table2' ...]:
         :return: {'schema.table.column': {'guid':, 'tags': []}, ...
         """
+        if self.fetch_whole_schemas:
+            result = {}
+            wanted_tables = set(src_tables)
+            for schema in set([schema_table.split(".")[0] for schema_table in wanted_tables]):
+                for (name, column) in self._schema_from_atlas(schema)[1].items():
+                    if name.rsplit(".", 1)[0] in wanted_tables:
+                        result[name] = column
+            return result
         result={}
         for schema_table in src_tables:
             (schema, table)=schema_table.split(".")
@@ -263,64 +550,193 @@ class Sync:
                     'tags': set(table['classificationNames'])}
         return result
 
-    def _sync_tags_for_one_tables_storage(self, schema, table, expected_tags):
+    def _hdfs_path_tags(self, hdfs_paths, create=True):
         """
-        Ensure the storage directory for table in schema has the same tags as the table.
-        Location for storage is looked up in hive server.
-        :param schema: Name of schema.
-        :param table: Name of table.
-        :param expected_tags: List of strings with expected tags.
-        :return: Dictionary with actions as keys and metadata as value, used for logging.
+        Look up guids and tags of hdfs_path entities. Tags of entities with guids in the hdfs path cache are read
+        in one request. Entities of other paths, or with a guid no longer in Atlas, are created or updated in one
+        request and their tags read in one more request.
+        :param hdfs_paths: List of full urls.
+        :param create: Set to false to not change anything in Atlas. Entities of paths not in the cache are then
+        looked up one by one, and paths without an entity in Atlas are left out of the guids returned.
+        :return: (dict hdfs path -> guid, dict guid -> set of tags)
         """
-        storage_url = self.hive_client.get_location(schema, table)
-        if storage_url is not None:
-            guid = self.atlas_client.add_hdfs_path(storage_url)
-
-            tags_on_storage = self.atlas_client.get_tags_on_guid(guid)
-            tags_to_add = expected_tags-tags_on_storage
-            tags_to_delete = tags_on_storage-expected_tags
+        guids = dict((hdfs_path, self.hdfs_path_cache.get(hdfs_path)) for hdfs_path in hdfs_paths
+                     if self.hdfs_path_cache.get(hdfs_path) is not None)
+        tags = self.atlas_client.get_classifications(sorted(set(guids.values())))
+        for (hdfs_path, guid) in guids.items():
+            if not tags.has_key(guid):
+                self.hdfs_path_cache.forget(hdfs_path)
+                del guids[hdfs_path]
+        new_paths = [hdfs_path for hdfs_path in hdfs_paths if not guids.has_key(hdfs_path)]
+        if len(new_paths) != 0 and create:
+            new_guids = self.atlas_client.add_hdfs_paths(new_paths)
+            tags.update(self.atlas_client.get_classifications(sorted(set(new_guids.values()))))
+            guids.update(new_guids)
+            self.hdfs_path_cache.update(new_guids)
+        elif len(new_paths) != 0:
+            new_guids = {}
+            for hdfs_path in new_paths:
+                entity = self.atlas_client.get_hdfs_path(hdfs_path)
+                if entity is not None:
+                    new_guids[hdfs_path] = entity[0]
+                    tags[entity[0]] = entity[1]
+            guids.update(new_guids)
+            self.hdfs_path_cache.update(new_guids)
+        self.hdfs_path_cache.save()
+        return guids, tags
+
+    def _storage_tag_changes(self, src_table_tags, create=True):
+        """
+        Diff tags on the storage directories of many tables with the tags of the tables, see _hdfs_path_tags.
+        Locations for storage are looked up in hive server.
+        :param src_table_tags: Array of dicts with keys (schema, table, tags (comma separated in string))
+        :param create: Set to false to not create hdfs_path entities, changes of paths without an entity then
+        have guid None and the entity is created when the change is applied.
+        :return: (list of tag changes, see _tag_change, list of rows in src_table_tags that are views)
+        """
+        locations = LocationCache(self.hive_client)
+        locations.prefetch([(s['schema'], s['table']) for s in src_table_tags])
+        tables = []
+        views = []
+        for s in src_table_tags:
+            storage_url = locations.get_location(s['schema'], s['table'])
+            if storage_url is None:
+                views.append(s)
+            else:
+                tables.append((s, storage_url))
+        (guids, tags_on_storage) = self._hdfs_path_tags(sorted(set([location for (_, location) in tables])), create)
+        changes = [_tag_change('storage', _table_name(s), guids.get(location), _tags_as_set(s),
+                               tags_on_storage.get(guids.get(location), set()), hdfs_path=location)
+                   for (s, location) in tables]
+        return changes, views
+
+    def _sync_storage_tags_for_tables(self, src_table_tags):
+        """
+        Ensure the storage directories of tables have the same tags as the tables. Each tag added is added
+        to all directories missing it in one request.
+        :param src_table_tags: Array of dicts with keys (schema, table, tags (comma separated in string))
+        """
+        (changes, views) = self._storage_tag_changes(src_table_tags)
+        for s in views:
+            self.worklog['{}.{} is a view, not doing any hdfs tagging for it.'.format(s['schema'], s['table'])] = ''
+            self._mark_done('storage', _table_name(s), _tags_as_set(s))
+        guids_by_tag = {}
+        tags_to_delete_by_guid = {}
+        for change in changes:
+            for tag in change['add']:
+                guids_by_tag.setdefault(tag, set()).add(change['guid'])
+            tags_to_delete_by_guid.setdefault(change['guid'], set()).update(change['delete'])
+        for tag in sorted(guids_by_tag):
+            self.atlas_client.add_tag_on_guids(tag, sorted(guids_by_tag[tag]))
+        for guid in sorted(tags_to_delete_by_guid):
+            if len(tags_to_delete_by_guid[guid]) != 0:
+                self.atlas_client.delete_tags_on_guid(guid, sorted(tags_to_delete_by_guid[guid]))
+        for change in changes:
+            tags_to_add = set(change['add'])
+            tags_to_delete = set(change['delete'])
             if len(tags_to_add) != 0:
-                self.atlas_client.add_tags_on_guid(guid, list(tags_to_add))
-                self.worklog['{} added tag'.format(storage_url)] = tags_to_add
+                self.worklog['%s added tag' % change['hdfs_path']] = tags_to_add
             if len(tags_to_delete) != 0:
-                self.atlas_client.delete_tags_on_guid(guid, list(tags_to_delete))
-                self.worklog['{} deleted tag'.format(storage_url)] = tags_to_delete
-        else:
-            self.worklog['{}.{} is a view, not doing any hdfs tagging for it.'.format(schema, table)] = ''
-        return self.worklog
+                self.worklog['%s deleted tag' % change['hdfs_path']] = tags_to_delete
+            self._mark_done('storage', change['entity'], set(change['tags']), tags_to_add, tags_to_delete)
 
     def sync_table_storage_tags(self, src_table_tags, clear_not_listed=False):
         """
         Ensure the storage directories has the same tags as specified for the table in src_table_tags.
-        Location for storage is looked up in hive server.
+        Location for storage is looked up in hive server. Tables are synced one schema at a time, with
+        a few requests to Atlas per schema.
         :param src_table_tags: Array of dicts with keys (schema, table, tags (comma separated in string))
         :param clear_not_listed: Set to true, then we will look up tables in Atlas and also clear tags on
         those tables listed there. Only clear tags on schemas listed at least once in src_table_tags.
         :return: Dictionary with actions as keys and metadata as value, used for logging.
         """
-        self.worklog = {}
+        self._start_sync()
         run = 0
         while True:
             try:
                 run += 1
                 self.ensure_tags_in_atlas(src_table_tags)
-                if clear_not_listed:
-                    schemas = schemas_from_src(src_table_tags)
-                    src_tables = tables_from_src(src_table_tags)
-                    atlas_tables = self.get_tables_for_schema_from_atlas(schemas)
-                    tables_only_known_by_atlas = set(atlas_tables.keys())-src_tables
-                    if len(tables_only_known_by_atlas) != 0:
-                        for t in tables_only_known_by_atlas:
-                            (schema, table) = t.split(".")
-                            src_table_tags.append({'schema': schema, 'table': table, 'tags': ''})
+                # Tables only in Atlas are added once, by the first run getting that far.
+                if clear_not_listed and 'storage' not in self._cleared:
+                    self._add_tables_only_in_atlas(src_table_tags)
+                    self._cleared.add('storage')
+                pending_by_schema = {}
+                schemas = []
                 for s in src_table_tags:
-                    self.worklog.update(
-                        self._sync_tags_for_one_tables_storage(s['schema'], s['table'], _tags_as_set(s)))
+                    if self._is_done('storage', _table_name(s), _tags_as_set(s)):
+                        continue
+                    if not pending_by_schema.has_key(s['schema']):
+                        schemas.append(s['schema'])
+                    pending_by_schema.setdefault(s['schema'], []).append(s)
+                for schema in schemas:
+                    self._sync_storage_tags_for_tables(pending_by_schema[schema])
                 return self.worklog
             except (SyncError, IOError, AtlasError, HiveError) as e:
                 if run > self.retries:
                     raise e
-                time.sleep(self.retry_delay)
+                self._sleep_before_rerun(run)
+
+
+    def _add_tables_only_in_atlas(self, src_table_tags):
+        """
+        Add tables in Atlas, in schemas listed in src_table_tags, that are not in src_table_tags
+        to src_table_tags with no tags.
+        """
+        schemas = schemas_from_src(src_table_tags)
+        src_tables = tables_from_src(src_table_tags)
+        atlas_tables = self.get_tables_for_schema_from_atlas(schemas)
+        tables_only_known_by_atlas = set(atlas_tables.keys())-src_tables
+        if len(tables_only_known_by_atlas) != 0:
+            for t in tables_only_known_by_atlas:
+                (schema, table) = t.split(".")
+                src_table_tags.append({'schema': schema, 'table': table, 'tags': ''})
+
+    def plan(self, src_table_tags, src_column_tags, storage=False, clear_not_listed=False):
+        """
+        Compute the changes needed to sync tags to Atlas, without changing anything in Atlas.
+        :param src_table_tags: Array of dicts with keys (schema, table, tags (comma separated in string))
+        :param src_column_tags: Array of dicts with keys (schema, table, attribute, tags (comma separated in string))
+        :param storage: Set to true to also plan tags on the storage directories of the tables.
+        :param clear_not_listed: See sync_table_tags and sync_column_tags.
+        :return: Plan that can be serialised as json and applied with apply_plan. On form
+        {'tag_definitions': ['TAG1'], 'changes': [change, ...]}, where change is on the form returned by _tag_change.
+        """
+        self._start_sync()
+        self.forget_schemas()
+        missing_atlas_tags = (tags_from_src(src_table_tags) | tags_from_src(src_column_tags)) - self.tags_from_atlas()
+        changes = list(self._table_tag_changes(src_table_tags, 1, clear_not_listed))
+        changes.extend(self._column_tag_changes(src_column_tags, 1, clear_not_listed))
+        self.forget_schemas()
+        if storage:
+            (storage_changes, _) = self._storage_tag_changes(src_table_tags, create=False)
+            changes.extend(_merge_storage_changes(storage_changes))
+        return {'tag_definitions': sorted(missing_atlas_tags),
+                'changes': [c for c in changes if len(c['add']) != 0 or len(c['delete']) != 0]}
+
+    def apply_plan(self, tag_plan, parallel=1):
+        """
+        Apply a plan created with plan(). Diffs are not recomputed, tags are added and deleted as in the plan.
+        :param tag_plan: The plan.
+        :param parallel: Number of changes to apply at the same time. Each thread talks to Atlas over its own
+        connections, see retry.HttpRetry.
+        :return: Dictionary with actions as keys and metadata as value, used for logging.
+        """
+        self._start_sync()
+        self._ensure_tags(tag_plan['tag_definitions'])
+        try:
+            if parallel > 1:
+                pool = ThreadPool(parallel)
+                try:
+                    pool.map(self._apply_change, tag_plan['changes'])
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                for change in tag_plan['changes']:
+                    self._apply_change(change)
+        finally:
+            self.hdfs_path_cache.save()
+        return self.worklog
 
 
 class SyncError(Exception):
@@ -43,7 +43,7 @@ setup(
         cobra-policy=policytool.cli:cli
     ''',
     data_files=[],
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
     install_requires=[
         'requests>=2.20',
         'requests-kerberos',
@@ -52,6 +52,9 @@ setup(
         'thrift',
         'thrift-sasl',
         'sasl'],
+    extras_require={
+        'kafka': ['kafka-python'],
+        'metastore': ['hmsclient']},
     tests_require=['pytest',
                    'nose',
                    'mock'],
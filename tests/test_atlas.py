@@ -0,0 +1,213 @@
+import json
+import unittest
+from StringIO import StringIO
+
+import urllib3
+from mock import MagicMock
+
+from policytool import atlas
+
+
+class _Response:
+
+    def __init__(self, status_code, json_data=None):
+        self.status_code = status_code
+        self.content = ''
+        self._json_data = json_data
+        self.raw = StringIO(json.dumps(json_data))
+
+    def json(self):
+        return self._json_data
+
+    def close(self):
+        pass
+
+
+class TestClient(unittest.TestCase):
+
+    def setUp(self):
+        self.client = atlas.Client('http://atlas/api/atlas', bulk_chunk_size=2)
+        self.known = {'g1': ['PII'], 'g2': [], 'g3': ['end_date']}
+
+        def request(method, url, params=None, **kwargs):
+            if any(guid not in self.known for guid in params['guid']):
+                return _Response(404)
+            return _Response(200, {'entities': [
+                {'guid': guid, 'classifications': [{'typeName': tag, 'entityGuid': guid} for tag in self.known[guid]] +
+                    [{'typeName': 'PROPAGATED', 'entityGuid': 'other'}]}
+                for guid in params['guid']]})
+        self.client.http = MagicMock()
+        self.client.http.request.side_effect = request
+
+    def test_get_classifications_in_chunks(self):
+        self.assertEqual({'g1': {'PII'}, 'g2': set(), 'g3': {'end_date'}},
+                         self.client.get_classifications(['g1', 'g2', 'g3']))
+        self.assertEqual([['g1', 'g2'], ['g3']],
+                         [c[1]['params']['guid'] for c in self.client.http.request.call_args_list])
+
+    def test_get_classifications_leaves_out_missing_guids(self):
+        self.assertEqual({'g1': {'PII'}, 'g3': {'end_date'}},
+                         self.client.get_classifications(['g1', 'missing', 'g3'], chunk_size=3))
+        with self.assertRaises(atlas.AtlasError):
+            self.client.get_tags_on_guid('missing')
+
+    def test_get_hdfs_path_leaves_out_propagated_tags(self):
+        self.client.http.request.side_effect = None
+        self.client.http.request.return_value = _Response(200, {'entity': {'guid': 'p1', 'classifications': [
+            {'typeName': 'PII', 'entityGuid': 'p1'}, {'typeName': 'PROPAGATED', 'entityGuid': 'g1'}]}})
+        self.assertEqual(('p1', {'PII'}), self.client.get_hdfs_path('hdfs://sys/db/table'))
+
+    def test_get_hdfs_path_missing(self):
+        self.client.http.request.side_effect = None
+        self.client.http.request.return_value = _Response(404)
+        self.assertIsNone(self.client.get_hdfs_path('hdfs://sys/db/table'))
+
+
+class TestQueryStrategy(unittest.TestCase):
+
+    def _header(self, qualified_name):
+        return {'guid': qualified_name, 'attributes': {'qualifiedName': qualified_name}, 'classificationNames': []}
+
+    def test_dsl_search_on_start_of_qualified_name(self):
+        client = atlas.Client('http://atlas/api/atlas', query_strategy=atlas.DSL_SEARCH)
+        client.http = MagicMock()
+        client.http.request.return_value = _Response(200, {'entities': [self._header('dw_out.t1@c'),
+                                                                         self._header('dw_outXt2@c')]})
+
+        self.assertEqual(['dw_out.t1@c'], [t['guid'] for t in client.get_tables('dw_out')])
+        client.http.request.assert_called_once_with(
+            'GET', 'http://atlas/api/atlas/v2/search/dsl', auth=None, stream=True,
+            params={'query': 'hive_table where qualifiedName like "dw_out.*" and temporary = false', 'limit': 10000})
+
+    def test_search_keeps_only_used_fields(self):
+        client = atlas.Client('http://atlas/api/atlas')
+        client.http = MagicMock()
+        table = {'guid': 'g1', 'typeName': 'hive_table', 'status': 'ACTIVE', 'displayText': 't1',
+                 'attributes': {'qualifiedName': 'dw.t1@c', 'name': 't1', 'owner': 'etl', 'description': 'x' * 1000},
+                 'classificationNames': ['PII_table'], 'meanings': [], 'labels': []}
+        client.http.request.return_value = _Response(200, {'queryType': 'BASIC', 'entities': [table]})
+
+        self.assertEqual([{'guid': 'g1', 'typeName': 'hive_table', 'status': 'ACTIVE',
+                           'attributes': {'qualifiedName': 'dw.t1@c', 'name': 't1'},
+                           'classificationNames': ['PII_table']}], client.get_tables('dw'))
+        self.assertTrue(client.http.request.call_args[1]['stream'])
+
+    def test_search_is_redone_when_response_is_interrupted(self):
+        client = atlas.Client('http://atlas/api/atlas')
+        client.http = MagicMock(retries=1, base_delay=0, max_delay=0)
+        interrupted = _Response(200)
+        interrupted.raw = MagicMock()
+        interrupted.raw.read.side_effect = urllib3.exceptions.ProtocolError('Connection broken')
+        client.http.request.side_effect = [interrupted, _Response(200, {'entities': [self._header('dw.t1@c')]})]
+
+        self.assertEqual(['dw.t1@c'], [t['guid'] for t in client.get_tables('dw')])
+
+        client.http.request.side_effect = [interrupted, interrupted]
+        with self.assertRaises(atlas.AtlasError):
+            client.get_tables('dw')
+
+    def test_fall_back_to_basic_search(self):
+        client = atlas.Client('http://atlas/api/atlas', query_strategy=atlas.DSL_SEARCH)
+        client.http = MagicMock()
+        client.http.request.side_effect = lambda method, url, **kwargs: \
+            _Response(400) if url.endswith('/dsl') else \
+            _Response(200, {'entities': [self._header('dw.t.c1@c'), self._header('dw.t_2.c1@c')]})
+
+        self.assertEqual(['dw.t.c1@c'], [c['guid'] for c in client.get_columns('dw', 't')])
+        self.assertEqual(['dw.t.c1@c'], [c['guid'] for c in client.get_columns('dw', 't')])
+        self.assertEqual(atlas.BASIC_SEARCH, client.query_strategy)
+        self.assertEqual(['dsl', 'dsl', 'basic', 'basic'],
+                         [c[0][1].split('/')[-1] for c in client.http.request.call_args_list])
+
+    def test_basic_search_for_one_query_dsl_cannot_run(self):
+        client = atlas.Client('http://atlas/api/atlas', query_strategy=atlas.DSL_SEARCH)
+        client.http = MagicMock()
+        client.http.request.side_effect = lambda method, url, params=None, **kwargs: \
+            _Response(200, {'entities': []}) if url.endswith('/dsl') and params['query'] == 'hive_column' else \
+            _Response(400) if url.endswith('/dsl') else \
+            _Response(200, {'entities': [self._header('dw.t.c1@c')]})
+
+        self.assertEqual(['dw.t.c1@c'], [c['guid'] for c in client.get_columns('dw', 't')])
+        self.assertEqual(atlas.DSL_SEARCH, client.query_strategy)
+        self.assertEqual(['dsl', 'dsl', 'basic'], [c[0][1].split('/')[-1] for c in client.http.request.call_args_list])
+
+    def test_no_fall_back_on_other_errors(self):
+        class ClosingResponse(_Response):
+            def close(self):
+                self.content = ''
+        client = atlas.Client('http://atlas/api/atlas', query_strategy=atlas.DSL_SEARCH)
+        client.http = MagicMock()
+        response = ClosingResponse(503)
+        response.content = 'Service Unavailable'
+        client.http.request.return_value = response
+
+        with self.assertRaises(atlas.AtlasError) as context:
+            client.get_tables('dw')
+        self.assertEqual('Service Unavailable', context.exception.message)
+        self.assertEqual(atlas.DSL_SEARCH, client.query_strategy)
+
+    def test_unknown_query_strategy(self):
+        with self.assertRaises(atlas.AtlasError):
+            atlas.Client('http://atlas/api/atlas', query_strategy='sql')
+
+
+class TestGetSchema(unittest.TestCase):
+
+    def test_tables_and_columns_from_relationships(self):
+        def entity(guid, qualified_name, tags=(), **attributes):
+            attributes['qualifiedName'] = qualified_name
+            return {'guid': guid, 'typeName': 'hive_table', 'status': 'ACTIVE', 'attributes': attributes,
+                    'classifications': [{'typeName': tag, 'entityGuid': guid} for tag in tags]}
+
+        responses = {
+            '/v2/search/basic': {'entities': [{'guid': 'db', 'attributes': {'qualifiedName': 'dw@c'}},
+                                              {'guid': 'db2', 'attributes': {'qualifiedName': 'dw_2@c'}}]},
+            '/v2/entity/guid/db': {'entity': {'guid': 'db', 'relationshipAttributes': {'tables': [
+                {'guid': 't1', 'entityStatus': 'ACTIVE', 'relationshipStatus': 'ACTIVE'},
+                {'guid': 'tmp', 'entityStatus': 'ACTIVE', 'relationshipStatus': 'ACTIVE'},
+                {'guid': 'old', 'entityStatus': 'DELETED', 'relationshipStatus': 'DELETED'}]}}},
+            '/v2/entity/bulk': {
+                'entities': [entity('t1', 'dw.t1@c', ['PII_table'], columns=[{'guid': 'c1'}]),
+                             entity('tmp', 'dw.tmp@c', temporary=True, columns=[])],
+                'referredEntities': {'c1': entity('c1', 'dw.t1.c1@c', ['PII'])}}}
+        client = atlas.Client('http://atlas/api/atlas')
+        client.http = MagicMock()
+        client.http.request.side_effect = lambda method, url, **kwargs: \
+            _Response(200, responses[url[len('http://atlas/api/atlas'):]])
+
+        (tables, columns) = client.get_schema('dw')
+
+        self.assertEqual([('t1', 'dw.t1@c', ['PII_table'])],
+                         [(t['guid'], t['attributes']['qualifiedName'], t['classificationNames']) for t in tables])
+        self.assertEqual([('c1', 'dw.t1.c1@c', ['PII'])],
+                         [(c['guid'], c['attributes']['qualifiedName'], c['classificationNames']) for c in columns])
+        self.assertEqual(['t1', 'tmp'], client.http.request.call_args_list[2][1]['params']['guid'])
+
+
+class TestAddTagDefinitions(unittest.TestCase):
+
+    def setUp(self):
+        self.client = atlas.Client('http://atlas/api/atlas')
+        self.tags = {'PII'}
+
+        def request(method, url, json=None, **kwargs):
+            if method == 'GET':
+                return _Response(200, [{'category': 'CLASSIFICATION', 'name': tag} for tag in self.tags])
+            names = set(d['name'] for d in json['classificationDefs'])
+            if len(names & self.tags) != 0:
+                return _Response(409, {'errorCode': 'ATLAS-409-00-001'})
+            self.tags.update(names)
+            return _Response(200, json)
+        self.client.http = MagicMock()
+        self.client.http.request.side_effect = request
+
+    def test_tags_created_concurrently_are_not_an_error(self):
+        self.assertEqual({'end_date'}, self.client.add_tag_definitions(['PII', 'end_date']))
+        self.assertEqual({'PII', 'end_date'}, self.tags)
+        self.assertEqual(set(), self.client.add_tag_definitions(['end_date']))
+
+    def test_other_conflicts_are_errors(self):
+        self.client.http.request.side_effect = lambda method, url, **kwargs: \
+            _Response(200, []) if method == 'GET' else _Response(400, {'errorCode': 'ATLAS-409-00-001'})
+        with self.assertRaises(atlas.AtlasError):
+            self.client.add_tag_definitions(['PII'])
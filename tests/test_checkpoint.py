@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from policytool import checkpoint
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'sync.checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_resume_knows_recorded_entities(self):
+        journal = checkpoint.Journal(self.path)
+        journal.record('table', 'schema.table1', {'tag1', 'tag2'}, added={'tag2'})
+
+        resumed = checkpoint.Journal(self.path, resume=True)
+        self.assertTrue(resumed.is_done('table', 'schema.table1', {'tag2', 'tag1'}))
+        self.assertFalse(resumed.is_done('table', 'schema.table1', {'tag1'}))
+        self.assertFalse(resumed.is_done('column', 'schema.table1', {'tag1', 'tag2'}))
+        self.assertEqual(1, len(resumed))
+
+    def test_without_resume_journal_is_truncated(self):
+        checkpoint.Journal(self.path).record('table', 'schema.table1', set())
+        journal = checkpoint.Journal(self.path)
+        self.assertFalse(journal.is_done('table', 'schema.table1', set()))
+        self.assertEqual('', open(self.path).read())
+
+    def test_half_written_line_is_ignored(self):
+        checkpoint.Journal(self.path).record('table', 'schema.table1', set())
+        with open(self.path, 'a') as f:
+            f.write('{"phase": "table", "ent')
+        resumed = checkpoint.Journal(self.path, resume=True)
+        self.assertTrue(resumed.is_done('table', 'schema.table1', set()))
+
+    def test_record_is_written_before_journal_is_closed(self):
+        journal = checkpoint.Journal(self.path, fsync=True)
+        journal.record('table', 'schema.table1', set())
+        journal.record('table', 'schema.table2', set())
+        resumed = checkpoint.Journal(self.path, resume=True)
+        self.assertEqual(2, len(resumed))
+        journal.close()
+        resumed.close()
+
+    def test_remove(self):
+        journal = checkpoint.Journal(self.path)
+        journal.remove()
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import MagicMock
+
+from policytool import daemon
+
+
+class TestChangedRows(unittest.TestCase):
+
+    def test_new_and_retagged_rows_are_changed(self):
+        previous = [{'schema': 's', 'table': 't1', 'tags': 'a,b'},
+                    {'schema': 's', 'table': 't2', 'tags': 'a'},
+                    {'schema': 's', 'table': 't3', 'tags': 'a'}]
+        current = [{'schema': 's', 'table': 't1', 'tags': 'b,a'},
+                   {'schema': 's', 'table': 't2', 'tags': ''},
+                   {'schema': 's', 'table': 't4', 'tags': 'a'}]
+        self.assertEqual([current[1], current[2]], daemon.changed_rows(previous, current, ('schema', 'table')))
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.table_file = os.path.join(self.tmpdir, 'table_tags.csv')
+        self.column_file = os.path.join(self.tmpdir, 'column_tags.csv')
+        self._write(self.table_file, 'schema;table;tags\ns;t1;PII\ns;t2;\n', 1000)
+        self._write(self.column_file, 'schema;table;attribute;tags\ns;t1;c1;PII\n', 1000)
+        self.sync_client = MagicMock()
+        self.to_test = daemon.Daemon('dev', self.table_file, self.column_file, self.sync_client,
+                                     echo=lambda line: None)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, path, content, mtime):
+        with open(path, 'w') as f:
+            f.write(content)
+        os.utime(path, (mtime, mtime))
+
+    def test_only_changed_tables_are_synced(self):
+        self.assertTrue(self.to_test.run_once())
+        self.sync_client.sync_table_tags.assert_called_once_with(
+            [{'schema': 's_dev', 'table': 't1', 'tags': 'PII'}, {'schema': 's_dev', 'table': 't2', 'tags': ''}])
+        self.sync_client.sync_column_tags.assert_called_once_with(
+            [{'schema': 's_dev', 'table': 't1', 'attribute': 'c1', 'tags': 'PII'}])
+
+        self.sync_client.reset_mock()
+        self.assertFalse(self.to_test.run_once())
+        self._write(self.table_file, 'schema;table;tags\ns;t1;PII\ns;t2;PII\n', 2000)
+        self.assertTrue(self.to_test.run_once())
+        self.sync_client.sync_table_tags.assert_called_once_with([{'schema': 's_dev', 'table': 't2', 'tags': 'PII'}])
+        self.sync_client.sync_column_tags.assert_not_called()
+
+    def test_failed_sync_is_retried(self):
+        self.sync_client.sync_column_tags.side_effect = [IOError('Atlas down'), {}]
+        self.assertRaises(IOError, self.to_test.run_once)
+        self.sync_client.forget_known_tags.assert_called_once_with()
+        self.assertTrue(self.to_test.run_once())
+        self.assertEqual(2, self.sync_client.sync_table_tags.call_count)
+        self.assertEqual(2, self.sync_client.sync_column_tags.call_count)
+
+    def test_everything_is_synced_again_after_reconcile_interval(self):
+        now = [0]
+        to_test = daemon.Daemon('dev', self.table_file, self.column_file, self.sync_client,
+                                echo=lambda line: None, reconcile_interval=60, clock=lambda: now[0])
+        self.assertTrue(to_test.run_once())
+        now[0] = 59
+        self.assertFalse(to_test.run_once())
+        now[0] = 60
+        self.sync_client.reset_mock()
+        self.assertTrue(to_test.run_once())
+        self.sync_client.sync_table_tags.assert_called_once_with(
+            [{'schema': 's_dev', 'table': 't1', 'tags': 'PII'}, {'schema': 's_dev', 'table': 't2', 'tags': ''}])
+        self.sync_client.sync_column_tags.assert_called_once_with(
+            [{'schema': 's_dev', 'table': 't1', 'attribute': 'c1', 'tags': 'PII'}])
+        self.sync_client.forget_known_tags.assert_called_once_with()
+        self.assertFalse(to_test.run_once())
@@ -1,5 +1,12 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
 import unittest
 from mock import MagicMock
+import mock
+from thrift.transport.TTransport import TTransportException
 
 from policytool import hive
 
@@ -62,3 +69,159 @@ class TestHiveClient(unittest.TestCase):
 
         result = to_test.get_location("db", "table")
         self.assertEqual(result, None)
+
+    def test_get_location_retries_on_new_connection_after_transport_error(self):
+        result_from_db=[("Location:      ", "hdfs://sys/path", None)]
+        attempts = []
+
+        def execute(query):
+            attempts.append(query)
+            if len(attempts) == 1:
+                raise TTransportException(message="Connection reset")
+
+        to_test = hive.Client("dummyhost", retries=1)
+        connection_dummy = type('', (), {})()
+        connection_dummy.cursor = lambda: _CursorMock(execute=execute, fetchall=lambda: result_from_db)
+        to_test._connection = MagicMock(return_value=connection_dummy)
+
+        with mock.patch('policytool.retry.time.sleep'):
+            result = to_test.get_location("db", "table")
+        self.assertEqual(result, "hdfs://sys/path")
+        self.assertEqual(2, len(attempts))
+
+
+    def test_get_locations_reuses_threads_and_connections_until_close(self):
+        result_from_db=[("Location:      ", "hdfs://sys/path", None)]
+        connections = []
+
+        def connect(**kwargs):
+            connection = MagicMock()
+            connection.cursor.return_value = _CursorMock(fetchall=lambda: result_from_db)
+            connections.append(connection)
+            return connection
+
+        to_test = hive.Client("dummyhost", parallel=2)
+        with mock.patch('pyhive.hive.Connection', side_effect=connect):
+            for _ in range(3):
+                locations = to_test.get_locations([("db", "t{}".format(i)) for i in range(10)])
+                self.assertEqual("hdfs://sys/path", locations[("db", "t9")])
+            to_test.get_location("db", "t1")
+        # One per thread of the pool and one for the calling thread.
+        self.assertLessEqual(len(connections), 3)
+        to_test.close()
+        for connection in connections:
+            connection.close.assert_called_once_with()
+
+
+class TestLocationCache(unittest.TestCase):
+
+    def test_prefetch_looks_up_each_table_once(self):
+        hive_client = type('hive_client', (), {})()
+        hive_client.get_location = MagicMock(side_effect=lambda db, table: "hdfs://sys/{}/{}".format(db, table))
+        to_test = hive.LocationCache(hive_client)
+
+        to_test.prefetch([("db", "t1"), ("db", "t2"), ("db", "t1"), ("db", "*")])
+        self.assertEqual(3, hive_client.get_location.call_count)
+        self.assertEqual("hdfs://sys/db/t2", to_test.get_location("db", "t2"))
+        self.assertEqual("hdfs://sys/db/None", to_test.get_location("db"))
+        self.assertEqual("hdfs://sys/db/t3", to_test.get_location("db", "t3"))
+        self.assertEqual(4, hive_client.get_location.call_count)
+
+
+class TestMetastoreClient(unittest.TestCase):
+
+    @staticmethod
+    def _table(name, location, table_type='MANAGED_TABLE'):
+        table = type('Table', (), {})()
+        table.tableName = name
+        table.tableType = table_type
+        table.sd = type('StorageDescriptor', (), {})()
+        table.sd.location = location
+        return table
+
+    def test_get_locations_in_batches(self):
+        metastore = type('metastore', (), {})()
+        metastore.get_table_objects_by_name = MagicMock(side_effect=lambda db, tables: [
+            self._table(t, None, 'VIRTUAL_VIEW') if t == 'v' else self._table(t, "hdfs://sys/{}/{}".format(db, t))
+            for t in tables])
+        database = type('Database', (), {})()
+        database.locationUri = "hdfs://sys/db"
+        metastore.get_database = MagicMock(return_value=database)
+        to_test = hive.MetastoreClient("dummyhost", batch_size=2)
+        to_test._connection = MagicMock(return_value=metastore)
+
+        result = to_test.get_locations([("db", "t1"), ("db", "t2"), ("db", "v"), ("db", "*")])
+        self.assertEqual({("db", "t1"): "hdfs://sys/db/t1", ("db", "t2"): "hdfs://sys/db/t2", ("db", "v"): None,
+                          ("db", "*"): "hdfs://sys/db"}, result)
+        metastore.get_table_objects_by_name.assert_has_calls([mock.call("db", ["t1", "t2"]), mock.call("db", ["v"])])
+
+    def test_get_location_of_missing_table(self):
+        metastore = type('metastore', (), {})()
+        metastore.get_table_objects_by_name = MagicMock(return_value=[])
+        to_test = hive.MetastoreClient("dummyhost")
+        to_test._connection = MagicMock(return_value=metastore)
+
+        with self.assertRaises(hive.HiveError) as e:
+            to_test.get_location("db", "table")
+        self.assertEqual("Can not find location for db.table.", e.exception.message)
+
+    def test_close_closes_connections_of_all_threads(self):
+        to_test = hive.MetastoreClient("dummyhost")
+        transports = []
+
+        def open_connection():
+            transports.append(MagicMock())
+            return transports[-1], MagicMock()
+        to_test._open_connection = open_connection
+        to_test._connection()
+        thread = threading.Thread(target=to_test._connection)
+        thread.start()
+        thread.join()
+        self.assertEqual(2, len(transports))
+
+        to_test.close()
+        for transport in transports:
+            transport.close.assert_called_once_with()
+        to_test._connection()
+        self.assertEqual(3, len(transports))
+
+    def test_client_from_config(self):
+        self.assertIsInstance(hive.client_from_config({'hive_backend': 'metastore', 'hive_metastore_host': 'h'}),
+                              hive.MetastoreClient)
+        self.assertIsInstance(hive.client_from_config({'hive_server': 'h', 'hive_port': '10000'}), hive.Client)
+        self.assertIsNone(hive.client_from_config({}))
+
+
+class TestDumpClient(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _dump(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_get_location_from_csv(self):
+        path = self._dump('dump.csv', "db;table;location;table_type\n"
+                                      "My_Db;;hdfs://sys/my_db.db;\n"
+                                      "my_db;t1;hdfs://sys/my_db.db/t1;MANAGED_TABLE\n"
+                                      "my_db;v1;;VIRTUAL_VIEW\n")
+        to_test = hive.DumpClient(path)
+        self.assertEqual("hdfs://sys/my_db.db/t1", to_test.get_location("my_db", "T1"))
+        self.assertEqual("hdfs://sys/my_db.db", to_test.get_location("my_db", "*"))
+        self.assertEqual({("my_db", "v1"): None, ("my_db", None): "hdfs://sys/my_db.db"},
+                         to_test.get_locations([("my_db", "v1"), ("my_db", None)]))
+        with self.assertRaises(hive.HiveError):
+            to_test.get_location("my_db", "t2")
+
+    def test_get_location_from_json(self):
+        path = self._dump('dump.json', json.dumps([
+            {"db": "my_db", "table": "t1", "location": "hdfs://sys/my_db.db/t1", "table_type": "EXTERNAL_TABLE"}]))
+        self.assertEqual("hdfs://sys/my_db.db/t1", hive.DumpClient(path).get_location("my_db", "t1"))
+        self.assertIsInstance(hive.client_from_config({'hive_backend': 'dump', 'hive_metastore_dump': path}),
+                              hive.DumpClient)
@@ -0,0 +1,69 @@
+import unittest
+
+from mock import MagicMock
+
+from policytool import instrumentation
+from policytool import retry
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def tearDown(self):
+        instrumentation.set_recorder(None)
+
+    def test_http_endpoint_replaces_ids_and_names(self):
+        self.assertEqual(
+            'DELETE /api/atlas/v2/entity/guid/{id}/classification/{name}',
+            instrumentation.http_endpoint(
+                'delete', 'http://atlas:21000/api/atlas/v2/entity/guid/1bbe630c-927e-43f5-846b-94513db1d625'
+                          '/classification/PII?x=1'))
+        self.assertEqual('PUT /service/plugins/policies/{id}',
+                         instrumentation.http_endpoint('PUT', 'http://ranger/service/plugins/policies/17'))
+
+    def test_recorder_summary(self):
+        recorder = instrumentation.Recorder(clock=lambda: 0)
+        recorder.record('atlas', 'GET /a', 0.02, bytes_received=100)
+        recorder.record('atlas', 'GET /a', 2, error=True, retries=2)
+
+        (stats,) = recorder.summary()['endpoints']
+
+        self.assertEqual(2, stats['count'])
+        self.assertEqual(1, stats['errors'])
+        self.assertEqual(2, stats['retries'])
+        self.assertEqual(100, stats['bytes_received'])
+        self.assertIn([0.025, 1], stats['latency_buckets'])
+        self.assertIn([2.5, 2], stats['latency_buckets'])
+
+    def test_to_prometheus(self):
+        recorder = instrumentation.Recorder(clock=lambda: 0)
+        recorder.record('hive', 'describe formatted', 0.3)
+
+        lines = recorder.to_prometheus().splitlines()
+
+        self.assertIn('policytool_requests_total{client="hive",endpoint="describe formatted"} 1', lines)
+        self.assertIn('policytool_request_duration_seconds_bucket{client="hive",endpoint="describe formatted",le="0.25"} 0',
+                      lines)
+        self.assertIn('policytool_request_duration_seconds_bucket{client="hive",endpoint="describe formatted",le="0.5"} 1',
+                      lines)
+
+    def test_http_retry_records_retries(self):
+        recorder = instrumentation.Recorder()
+        instrumentation.set_recorder(recorder)
+        responses = [MagicMock(status_code=503, content='', request=None),
+                     MagicMock(status_code=200, content='{}', request=None)]
+        session = MagicMock()
+        session.request = MagicMock(side_effect=lambda *args, **kwargs: responses.pop(0))
+
+        retry.HttpRetry(retries=2, base_delay=0, session=session, client='ranger').request(
+            'GET', 'http://ranger/service/public/v2/api/service/hive/policy')
+
+        (stats,) = recorder.summary()['endpoints']
+        self.assertEqual('ranger', stats['client'])
+        self.assertEqual('GET /service/public/v2/api/service/hive/policy', stats['endpoint'])
+        self.assertEqual(1, stats['count'])
+        self.assertEqual(1, stats['retries'])
+        self.assertEqual(2, stats['bytes_received'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import json
+import unittest
+from StringIO import StringIO
+
+from mock import MagicMock, patch
+
+from policytool import jsonstream
+
+
+class TestIterObject(unittest.TestCase):
+
+    document = {
+        "serviceName": "hive",
+        "tagVersion": 123456,
+        "serviceResources": [{"id": 1, "resourceElements": {}}, {"id": 2, "resourceElements": {}}],
+        "tags": {"10": {"type": "PII"}, "11": {"type": u"caf\u00e9"}},
+        "empty": [],
+        "nothing": None
+    }
+
+    def _iter(self, chunk_size):
+        streamed_keys = ['serviceResources', 'tags', 'empty', 'nothing']
+        return list(jsonstream.iter_object(StringIO(json.dumps(self.document)), streamed_keys, chunk_size))
+
+    def test_iter_object_streams_selected_keys(self):
+        result = self._iter(1024)
+        self.assertIn(('serviceName', None, 'hive'), result)
+        self.assertIn(('serviceResources', 0, {"id": 1, "resourceElements": {}}), result)
+        self.assertIn(('serviceResources', 1, {"id": 2, "resourceElements": {}}), result)
+        self.assertIn(('tags', '10', {"type": "PII"}), result)
+        self.assertIn(('nothing', None, None), result)
+        self.assertEqual(7, len(result))
+
+    def test_iter_object_with_tiny_chunks(self):
+        self.assertEqual(self._iter(1024), self._iter(1))
+
+    def test_number_split_between_chunks(self):
+        result = list(jsonstream.iter_object(StringIO('{"a": 123456}'), chunk_size=9))
+        self.assertEqual([('a', None, 123456)], result)
+
+    def test_strings_with_escapes_split_between_chunks(self):
+        document = {"a": [u'quote " and backslash \\', u'brackets ]}[{ in "string"', u'caf\u00e9'], "b": True}
+        for chunk_size in range(1, 10):
+            result = list(jsonstream.iter_object(StringIO(json.dumps(document)), ['a'], chunk_size))
+            self.assertEqual([('a', 0, document['a'][0]), ('a', 1, document['a'][1]), ('a', 2, document['a'][2]),
+                              ('b', None, True)], result)
+
+    def test_large_value_is_not_decoded_for_each_chunk(self):
+        document = {"a": {"b": ["x" * 10] * 1000}}
+        decoder = MagicMock(wraps=jsonstream._decoder)
+        with patch.object(jsonstream, '_decoder', decoder):
+            result = list(jsonstream.iter_object(StringIO(json.dumps(document)), chunk_size=16))
+        self.assertEqual([('a', None, document['a'])], result)
+        # One decode of the key, and the value is tried once before it is complete and decoded once after.
+        self.assertEqual(3, decoder.raw_decode.call_count)
+
+    def test_truncated_document(self):
+        with self.assertRaises(jsonstream.JSONStreamError):
+            list(jsonstream.iter_object(StringIO('{"a": [1, 2'), ['a'], 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import base64
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from policytool import notifications
+
+
+def _notification(operation, type_name, qualified_name, guid, tags):
+    return {'type': 'ENTITY_NOTIFICATION_V2',
+            'operationType': operation,
+            'entity': {'typeName': type_name, 'guid': guid, 'status': 'ACTIVE',
+                       'attributes': {'qualifiedName': qualified_name},
+                       'classifications': [{'typeName': tag, 'entityGuid': guid} for tag in tags]}}
+
+
+def _envelope(message):
+    return {'version': {'version': '1.0.0'}, 'msgCompressionKind': 'NONE', 'msgSplitIdx': 1, 'msgSplitCount': 1,
+            'message': message}
+
+
+class TestParseNotification(unittest.TestCase):
+
+    def test_classification_add_gives_all_direct_tags(self):
+        message = _notification('CLASSIFICATION_ADD', 'hive_column', 's.t.c@cluster', 'g1', ['PII'])
+        message['entity']['classifications'].append({'typeName': 'PROPAGATED', 'entityGuid': 'other'})
+        self.assertEqual(('column', 's.t.c', 'g1', {'PII'}), notifications.parse_notification(message))
+
+    def test_delete_and_other_types(self):
+        self.assertEqual(('table', 's.t', 'g1', None), notifications.parse_notification(
+            _notification('ENTITY_DELETE', 'hive_table', 's.t@cluster', 'g1', [])))
+        self.assertIsNone(notifications.parse_notification(
+            _notification('ENTITY_CREATE', 'hdfs_path', '/apps/t@cluster', 'g2', [])))
+
+    def test_compressed_split_message(self):
+        message = _notification('CLASSIFICATION_ADD', 'hive_table', 's.t@cluster', 'g1', ['PII'])
+        compressed = StringIO()
+        with gzip.GzipFile(fileobj=compressed, mode='w') as f:
+            f.write(json.dumps(message))
+        encoded = base64.b64encode(compressed.getvalue())
+        unsplitter = notifications._Unsplitter()
+        self.assertIsNone(unsplitter.unwrap({'msgId': 'm', 'msgCompressionKind': 'GZIP', 'msgSplitCount': 2,
+                                             'msgSplitIdx': 2, 'message': encoded[10:]}))
+        self.assertEqual(message, unsplitter.unwrap({'msgId': 'm', 'msgCompressionKind': 'GZIP', 'msgSplitCount': 2,
+                                                     'msgSplitIdx': 1, 'message': encoded[:10]}))
+
+
+class TestView(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.notification_file = os.path.join(self.tmpdir, 'notifications.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _publish(self, *messages):
+        with open(self.notification_file, 'a') as f:
+            for message in messages:
+                f.write(json.dumps(_envelope(message)) + '\n')
+
+    def test_replay_only_new_notifications(self):
+        view = notifications.View({'s.t1': {'guid': 'g1', 'tags': set()}, 's.t2': {'guid': 'g2', 'tags': {'PII'}}})
+        self._publish(_notification('CLASSIFICATION_ADD', 'hive_table', 's.t1@cluster', 'g1', ['PII']),
+                      _notification('CLASSIFICATION_ADD', 'hive_table', 'other.t@cluster', 'g3', ['PII']))
+        source = notifications.FileSource(self.notification_file)
+        self.assertEqual({('table', 's.t1')}, view.apply(source.messages(), {'s'}))
+        self.assertEqual({'PII'}, view.tables['s.t1']['tags'])
+        self.assertEqual(2, source.position)
+
+        self._publish(_notification('ENTITY_DELETE', 'hive_table', 's.t2@cluster', 'g2', []))
+        self.assertEqual({('table', 's.t2')}, view.apply(source.messages(), {'s'}))
+        self.assertEqual(['s.t1'], view.tables.keys())
+
+    def test_split_message_straddling_reads(self):
+        view = notifications.View()
+        split = _notification('CLASSIFICATION_ADD', 'hive_table', 's.t1@cluster', 'g1', ['PII'])
+        encoded = json.dumps(split)
+        with open(self.notification_file, 'a') as f:
+            f.write(json.dumps({'msgId': 'm', 'msgSplitCount': 2, 'msgSplitIdx': 1, 'message': encoded[:10]}) + '\n')
+        self._publish(_notification('CLASSIFICATION_ADD', 'hive_table', 's.t2@cluster', 'g2', ['GDPR']))
+        source = notifications.FileSource(self.notification_file)
+        self.assertEqual({('table', 's.t2')}, view.apply(source.messages(), {'s'}))
+        self.assertEqual(0, source.position)
+
+        with open(self.notification_file, 'a') as f:
+            f.write(json.dumps({'msgId': 'm', 'msgSplitCount': 2, 'msgSplitIdx': 2, 'message': encoded[10:]}) + '\n')
+        self.assertEqual({('table', 's.t1'), ('table', 's.t2')}, view.apply(source.messages(), {'s'}))
+        self.assertEqual({'PII'}, view.tables['s.t1']['tags'])
+        self.assertEqual(3, source.position)
+
+    def test_save_and_load(self):
+        path = os.path.join(self.tmpdir, 'view.json')
+        self.assertIsNone(notifications.View.load(path))
+        notifications.View({'s.t1': {'guid': 'g1', 'tags': {'PII'}}}, {}, 3,
+                           {'table': {'s.t1': ['PII']}, 'column': {}}).save(path)
+        view = notifications.View.load(path)
+        self.assertEqual({'s.t1': {'guid': 'g1', 'tags': {'PII'}}}, view.tables)
+        self.assertEqual(3, view.position)
+        self.assertEqual({'table': {'s.t1': ['PII']}, 'column': {}}, view.audited)
@@ -0,0 +1,41 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from policytool.pathcache import HdfsPathCache
+
+
+class TestHdfsPathCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'hdfs-paths.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_in_memory(self):
+        cache = HdfsPathCache()
+        cache.update({'hdfs://c/a': 'g1'})
+        cache.save()
+        self.assertEqual('g1', cache.get('hdfs://c/a'))
+        self.assertIsNone(cache.get('hdfs://c/b'))
+
+    def test_save_merges_with_other_runs(self):
+        cache = HdfsPathCache(self.path)
+        cache.update({'hdfs://c/a': 'g1', 'hdfs://c/b': 'g2'})
+        cache.save()
+        other = HdfsPathCache(self.path)
+        other.update({'hdfs://c/c': 'g3'})
+        cache.forget('hdfs://c/a')
+        cache.save()
+        other.save()
+        self.assertEqual({'hdfs://c/b': 'g2', 'hdfs://c/c': 'g3'},
+                         json.load(open(self.path))['paths'])
+
+    def test_broken_file_is_ignored(self):
+        with open(self.path, 'w') as f:
+            f.write('{"version": 1, "pa')
+        self.assertEqual(0, len(HdfsPathCache(self.path)))
@@ -1,12 +1,18 @@
+import json
+import tempfile
 import unittest
 
 from policytool import policycache
 from policytool.policycache import PolicyCache
 
 
-class TestPolicyCacheClassMethods(unittest.TestCase):
+def _policy_cache(service_resources):
+    return PolicyCache({'serviceResources': service_resources, 'tags': {}, 'resourceToTagIds': {}})
 
-    def test__extract_resources_for_one_table_object(self):
+
+class TestPolicyCacheResources(unittest.TestCase):
+
+    def test_resources_for_one_table_object(self):
         indata = {'serviceResources': [
             {u'id': 109410,
              u'resourceElements': {u'table':
@@ -14,18 +20,46 @@ class TestPolicyCacheClassMethods(unittest.TestCase):
                                    u'database':
                                        {u'isExcludes': False, u'values': [u'db_name'], u'isRecursive': False}}
              }]}
-        result = PolicyCache._extract_resources(indata, 'table')
+        result = _policy_cache(indata['serviceResources']).tableResources
         self.assertEqual(result, {('db_name', 'table_name'): 109410})
 
-    def test__extract_resources_for_no_table_object(self):
+    def test_resources_for_no_table_object(self):
         indata = {'serviceResources': [
             {u'id': 109410,
              u'resourceElements': {u'database':
                                        {u'isExcludes': False, u'values': [u'db_name'], u'isRecursive': False}}
              }]}
-        result = PolicyCache._extract_resources(indata, 'table')
+        result = _policy_cache(indata['serviceResources']).tableResources
         self.assertEqual(result, {})
 
+    def test_resources_with_many_values(self):
+        service_resources = [
+            {u'id': 1,
+             u'resourceElements': {u'database': {u'values': [u'db1', u'db2']},
+                                   u'table': {u'values': [u't1']}}},
+            {u'id': 2,
+             u'resourceElements': {u'database': {u'values': [u'db1']},
+                                   u'table': {u'values': [u't1']},
+                                   u'column': {u'values': [u'c1', u'c2']}}},
+            {u'id': 3,
+             u'resourceElements': {u'database': {u'values': [u'db1']}}},
+            {u'id': 4,
+             u'resourceElements': {u'url': {u'values': [u'hdfs://x']}}}]
+        policy_cache = _policy_cache(service_resources)
+        self.assertEqual({(u'db1',): 3}, policy_cache.dbResources)
+        self.assertEqual({(u'db1', u't1'): 1, (u'db2', u't1'): 1}, policy_cache.tableResources)
+        self.assertEqual({(u'db1', u't1', u'c1'): 2, (u'db1', u't1', u'c2'): 2}, policy_cache.columnResources)
+
+    def test_resources_skip_excluded_values(self):
+        service_resources = [
+            {u'id': 1,
+             u'resourceElements': {u'database': {u'values': [u'db1'], u'isExcludes': False},
+                                   u'table': {u'values': [u't1'], u'isExcludes': True}}},
+            {u'id': 2,
+             u'resourceElements': {u'database': {u'values': [u'db1'], u'isExcludes': False},
+                                   u'table': {u'values': [u't2'], u'isExcludes': False}}}]
+        self.assertEqual({(u'db1', u't2'): 2}, _policy_cache(service_resources).tableResources)
+
 
 class TestPolicyCache(unittest.TestCase):
 
@@ -54,3 +88,36 @@ class TestPolicyCache(unittest.TestCase):
         policy_cache = PolicyCache(indata)
         tags = policy_cache._tags_for_resource("109410")
         self.assertEqual(tags, ['mytag', 'life'])
+
+    def test_from_file(self):
+        indata = {'serviceName': 'hive',
+                  'serviceResources': [
+                      {u'isEnabled': True,
+                       u'id': 109410,
+                       u'resourceElements': {u'database':
+                                                 {u'isExcludes': False, u'values': [u'db_name'], u'isRecursive': False}}
+                       }],
+                  'tags': {"81921": {"type": "mytag", "attributes": {}}},
+                  'resourceToTagIds': {"109410": [81921]}}
+        policy_cache_file = tempfile.NamedTemporaryFile(suffix='.json')
+        policy_cache_file.write(json.dumps(indata))
+        policy_cache_file.flush()
+        policy_cache = PolicyCache.from_file(policy_cache_file.name)
+        self.assertEqual({('db_name',): 109410}, policy_cache.dbResources)
+        self.assertEqual(['mytag'], policy_cache._tags_for_resource(109410))
+
+    def test_iter_tags_for_all_columns_share_tag_strings(self):
+        indata = {'serviceResources': [
+            {u'id': 1, u'resourceElements': {u'database': {u'values': [u'db']},
+                                             u'table': {u'values': [u't']},
+                                             u'column': {u'values': [u'c1']}}},
+            {u'id': 2, u'resourceElements': {u'database': {u'values': [u'db']},
+                                             u'table': {u'values': [u't']},
+                                             u'column': {u'values': [u'c2']}}}],
+            'tags': {"1": {"type": "PII"}, "2": {"type": "GDPR"}},
+            'resourceToTagIds': {"1": [1, 2], "2": [1, 2]}}
+        policy_cache = PolicyCache(indata)
+        result = sorted(policy_cache.iter_tags_for_all_columns(), key=lambda c: c['attribute'])
+        self.assertEqual([{'schema': u'db', 'table': u't', 'attribute': u'c1', 'tags': 'PII,GDPR'},
+                          {'schema': u'db', 'table': u't', 'attribute': u'c2', 'tags': 'PII,GDPR'}], result)
+        self.assertIs(result[0]['tags'], result[1]['tags'])
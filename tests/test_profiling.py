@@ -0,0 +1,29 @@
+import unittest
+
+from policytool import profiling
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_is_io(self):
+        self.assertTrue(profiling.is_io('/usr/lib/python2.7/site-packages/requests/sessions.py', 'send'))
+        self.assertTrue(profiling.is_io('/usr/lib/python2.7/site-packages/thrift/transport/TSocket.py', 'read'))
+        self.assertTrue(profiling.is_io('~', "<method 'recv' of '_socket.socket' objects>"))
+        self.assertFalse(profiling.is_io('/src/policytool/hive.py', 'get_location'))
+        self.assertFalse(profiling.is_io('~', '<len>'))
+
+    def test_hotspots_split_cpu_and_io(self):
+        profiler = profiling.Profiler()
+        profiler.start()
+        sorted(range(1000), key=lambda x: -x)
+        profiler.stop()
+
+        hotspots = profiler.hotspots(limit=3)
+
+        self.assertTrue(hotspots['cpu']['seconds'] > 0)
+        self.assertEqual(0, len(hotspots['io']['functions']))
+        self.assertTrue(len(hotspots['cpu']['functions']) <= 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
+import json
 import unittest
 from policytool import rangersync
+from policytool.ranger import RangerError
+from policytool.template import Context
 from mock import MagicMock
 import mock
 
@@ -205,6 +208,31 @@ class TestSync(unittest.TestCase):
         result = rangersync._convert_hive_resource_policy_to_hdfs_policy(policy_template_input, context, {"hdfsService": "service_hdfs"})
         self.assertEqual(policy_template_expected, result)
 
+    def test_apply_commands_looks_up_each_location_once(self):
+        def database_policy(name, tables):
+            return {
+                "command": "apply_rule",
+                "options": {"expandHiveResourceToHdfs": True, "hdfsService": "service_hdfs"},
+                "policy": {
+                    "service": "service_hive",
+                    "name": name,
+                    "policyType": 0,
+                    "resources": {
+                        "database": {"values": [u"db_${environment}"], "isExcludes": False, "isRecursive": False},
+                        "table": {"values": tables, "isExcludes": False, "isRecursive": False},
+                        "column": {"values": ["*"], "isExcludes": False, "isRecursive": False}},
+                    "policyItems": [{"accesses": [{"type": "select", "isAllowed": True}], "users": ["myuser"],
+                                     "delegateAdmin": False}]}}
+
+        hive_client = type('hive_client', (), {})()
+        hive_client.get_location = MagicMock(side_effect=lambda db, t: "hdfs://system/{}/{}".format(db, t))
+        context = Context({'hive_client': hive_client, 'environment': u'dev'})
+        policies = rangersync.apply_commands([database_policy("read", ["t1", "t2"]),
+                                              database_policy("write", ["t2", "t3"])], context)
+        self.assertEqual(["/db_dev/t1", "/db_dev/t2"], sorted(policies[1]["resources"]["path"]["values"]))
+        self.assertEqual(["/db_dev/t2", "/db_dev/t3"], sorted(policies[3]["resources"]["path"]["values"]))
+        self.assertEqual(3, hive_client.get_location.call_count)
+
     def test__convert_tag_access_rule_to_both_hive_and_hdfs(self):
         policy_template_input = {
             "service": "service_tag",
@@ -269,3 +297,88 @@ class TestSync(unittest.TestCase):
         self.assertEqual(policy_template_expected, result)
 
 
+class TestRangerSync(unittest.TestCase):
+
+    def setUp(self):
+        self.ranger_client = type('ranger_client', (), {})()
+        self.current_policies = {
+            'hive': [{'id': 1, 'service': 'hive', 'name': 'proj1_dev_old', 'isEnabled': True},
+                     {'id': 2, 'service': 'hive', 'name': 'proj2_dev_same', 'isEnabled': True},
+                     {'id': 3, 'service': 'hive', 'name': 'proj2_dev_changed', 'isEnabled': True},
+                     {'id': 4, 'service': 'hive', 'name': 'other_proj1_dev', 'isEnabled': True}]}
+        self.ranger_client.get_policies_by_name_part = MagicMock(
+            side_effect=lambda service, part: [p for p in self.current_policies[service] if part in p['name']])
+        self.ranger_client.get_policy_by_name = MagicMock(
+            return_value=type('response', (), {'status_code': 404})())
+        self.to_test = rangersync.RangerSync(self.ranger_client)
+
+    def test_plan_projects(self):
+        projects = [(['proj1_dev'], [{'service': 'hive', 'name': 'proj1_dev_new'}]),
+                    (['proj2_dev'], [{'service': 'hive', 'name': 'proj2_dev_same', 'isEnabled': True},
+                                     {'service': 'hive', 'name': 'proj2_dev_changed', 'isEnabled': False}])]
+        plan = self.to_test.plan_projects(projects)
+
+        # Names are matched by Ranger anywhere in the name, as when syncing one project.
+        self.assertEqual([{'service': 'hive', 'name': 'other_proj1_dev'},
+                          {'service': 'hive', 'name': 'proj1_dev_old'}], plan['delete'])
+        self.assertEqual([{'service': 'hive', 'name': 'proj1_dev_new'}], plan['create'])
+        self.assertEqual([{'id': 3, 'policy': {'id': 3, 'service': 'hive', 'name': 'proj2_dev_changed', 'isEnabled': False}}],
+                         plan['update'])
+        self.assertEqual(2, self.ranger_client.get_policies_by_name_part.call_count)
+        self.assertFalse(self.ranger_client.get_policy_by_name.called)
+
+    def test_plan_projects_looks_up_policies_without_prefix(self):
+        self.current_policies['hive'].append({'id': 5, 'service': 'hive', 'name': 'shared', 'isEnabled': True})
+        self.ranger_client.get_policy_by_name.return_value = type(
+            'response', (), {'status_code': 200, 'json': lambda response: self.current_policies['hive'][-1]})()
+
+        plan = self.to_test.plan_projects([(['proj2_dev'], [{'service': 'hive', 'name': 'shared', 'isEnabled': True},
+                                                             {'service': 'hive', 'name': 'proj2_dev_same',
+                                                              'isEnabled': True}])])
+
+        self.ranger_client.get_policy_by_name.assert_called_once_with('hive', 'shared')
+        self.assertEqual([{'service': 'hive', 'name': 'proj2_dev_changed'}], plan['delete'])
+        self.assertEqual([], plan['create'])
+        self.assertEqual([], plan['update'])
+
+    def test_plan_projects_raises_when_policy_lookup_fails(self):
+        self.ranger_client.get_policy_by_name.return_value = type(
+            'response', (), {'status_code': 500, 'text': 'Internal Server Error'})()
+
+        with self.assertRaises(RangerError) as context:
+            self.to_test.plan_projects([(['proj2_dev'], [{'service': 'hive', 'name': 'shared', 'isEnabled': True}])])
+        self.assertEqual(500, context.exception.http_code)
+
+    def test_apply_plan(self):
+        response = type('response', (), {'status_code': 200})()
+        self.ranger_client.delete_policy_by_name = MagicMock(return_value=response)
+        self.ranger_client.create_policy = MagicMock(return_value=response)
+        self.ranger_client.update_policy = MagicMock(return_value=response)
+        plan = json.loads(json.dumps({
+            'delete': [{'service': 'hive', 'name': 'proj1_dev_old'}],
+            'create': [{'service': 'hive', 'name': 'proj1_dev_new'}],
+            'update': [{'id': 3, 'policy': {'id': 3, 'service': 'hive', 'name': 'proj2_dev_changed'}}]}))
+
+        self.to_test.apply_plan(plan)
+
+        self.ranger_client.delete_policy_by_name.assert_called_once_with('hive', 'proj1_dev_old')
+        self.ranger_client.create_policy.assert_called_once_with({'service': 'hive', 'name': 'proj1_dev_new'})
+        self.ranger_client.update_policy.assert_called_once_with(
+            3, {'id': 3, 'service': 'hive', 'name': 'proj2_dev_changed'})
+        self.assertFalse(self.ranger_client.get_policies_by_name_part.called)
+
+    def test_apply_plan_writes_verbose_output_with_echo(self):
+        lines = []
+        self.ranger_client.create_policy = MagicMock(return_value=type('response', (), {'status_code': 200})())
+        to_test = rangersync.RangerSync(self.ranger_client, verbose=1, echo=lines.append)
+
+        to_test.apply_plan({'delete': [], 'create': [{'service': 'hive', 'name': 'proj1_dev_new'}], 'update': []})
+
+        self.assertEqual(2, len(lines))
+        self.assertIn('Create hive.proj1_dev_new', lines[0])
+
+    def test_plan_projects_with_conflicting_policies(self):
+        projects = [(['proj1_dev'], [{'service': 'hive', 'name': 'load_etl_x', 'isEnabled': True}]),
+                    (['proj2_dev'], [{'service': 'hive', 'name': 'load_etl_x', 'isEnabled': False}])]
+        with self.assertRaises(rangersync.RangerSyncError):
+            self.to_test.plan_projects(projects)
@@ -0,0 +1,77 @@
+import threading
+import unittest
+
+import requests
+import urllib3
+from mock import MagicMock
+
+from policytool import retry
+
+
+class TestRetry(unittest.TestCase):
+
+    def test_backoff_delay_is_capped(self):
+        for attempt in range(1, 20):
+            self.assertTrue(0 <= retry.backoff_delay(attempt, 1, 30) <= 30)
+
+    def test_call_with_retry_returns_first_accepted_result(self):
+        results = [503, 503, 200]
+        func = MagicMock(side_effect=lambda: results.pop(0))
+        sleep = MagicMock()
+        result = retry.call_with_retry(func, 3, 1, 10, lambda r, e: r == 503, sleep=sleep)
+        self.assertEqual(200, result)
+        self.assertEqual(3, func.call_count)
+        self.assertEqual(2, sleep.call_count)
+
+    def test_call_with_retry_gives_up_after_retries(self):
+        func = MagicMock(return_value=503)
+        result = retry.call_with_retry(func, 2, 1, 10, lambda r, e: r == 503, sleep=MagicMock())
+        self.assertEqual(503, result)
+        self.assertEqual(3, func.call_count)
+
+    def test_call_with_retry_raises_not_retryable_exception(self):
+        func = MagicMock(side_effect=ValueError("no"))
+        with self.assertRaises(ValueError):
+            retry.call_with_retry(func, 2, 1, 10, lambda r, e: False, sleep=MagicMock())
+        self.assertEqual(1, func.call_count)
+
+    def test_should_retry_http(self):
+        self.assertTrue(retry._should_retry_http(None, requests.ConnectionError()))
+        self.assertFalse(retry._should_retry_http(None, ValueError()))
+        self.assertTrue(retry._should_retry_http(type('response', (), {'status_code': 503})(), None))
+        self.assertFalse(retry._should_retry_http(type('response', (), {'status_code': 404})(), None))
+
+    def test_should_retry_http_not_idempotent_only_if_not_handled(self):
+        refused = requests.ConnectionError(urllib3.exceptions.MaxRetryError(
+            None, '/', urllib3.exceptions.NewConnectionError(None, 'Connection refused')))
+        self.assertTrue(retry._should_retry_http(None, refused, idempotent=False))
+        self.assertTrue(retry._should_retry_http(None, requests.ConnectTimeout(), idempotent=False))
+        self.assertFalse(retry._should_retry_http(None, requests.ConnectionError('Connection aborted.'),
+                                                  idempotent=False))
+        self.assertFalse(retry._should_retry_http(None, requests.ReadTimeout(), idempotent=False))
+        self.assertTrue(retry._should_retry_http(type('response', (), {'status_code': 503})(), None, False))
+        self.assertFalse(retry._should_retry_http(type('response', (), {'status_code': 502})(), None, False))
+
+    def test_post_is_not_retried_on_bad_gateway(self):
+        session = MagicMock()
+        session.request.return_value = MagicMock(status_code=502)
+        http = retry.HttpRetry(retries=2, base_delay=0, session=session)
+        self.assertEqual(502, http.request('POST', 'http://atlas/api/atlas/v2/entity/bulk').status_code)
+        self.assertEqual(1, session.request.call_count)
+        http.request('POST', 'http://atlas/api/atlas/v2/search/basic', idempotent=True)
+        self.assertEqual(4, session.request.call_count)
+
+    def test_other_threads_get_sessions_of_their_own(self):
+        session = MagicMock()
+        http = retry.HttpRetry(session=session)
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.extend([http._requester(), http._requester()]))
+        thread.start()
+        thread.join()
+        self.assertIs(session, http._requester())
+        self.assertIsNot(session, sessions[0])
+        self.assertIs(sessions[0], sessions[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,9 @@
+import json
 import unittest
 from policytool import tagsync
+from policytool import checkpoint
 from policytool.atlas import AtlasError
-from mock import MagicMock
+from mock import MagicMock, call
 
 
 class TestTagsyncModuleGlobal(unittest.TestCase):
@@ -139,6 +141,66 @@ class TestSync(unittest.TestCase):
         self.assertEqual({'run:3 test_schema.table1 added tag': set(['tag'])}, result)
         self.assertEqual(3, len(runs))
 
+    def test_sync_table_tags_rerun_continues_from_failed_table(self):
+        calls = []
+
+        def add_tags_on_guid(guid, tags):
+            calls.append(guid)
+            if guid == u'UUID2' and calls.count(u'UUID2') == 1:
+                raise AtlasError('Service unavailable', 503)
+
+        def table(name, guid):
+            return {u'guid': guid,
+                    u'attributes': {u'qualifiedName': u'test_schema.' + name + u'@dhadoopname'},
+                    u'classificationNames': []}
+
+        self.atlas_client.known_tags = lambda: [{'name': 'tag'}]
+        self.atlas_client.get_tables = lambda db: [table(u'table1', u'UUID1'), table(u'table2', u'UUID2')]
+        self.atlas_client.add_tags_on_guid = add_tags_on_guid
+
+        test_data = [{'schema': 'test_schema', 'table': 'table1', 'tags': 'tag'},
+                     {'schema': 'test_schema', 'table': 'table2', 'tags': 'tag'}]
+        result = self.to_test.sync_table_tags(test_data)
+
+        self.assertEqual([u'UUID1', u'UUID2', u'UUID2'], calls)
+        self.assertEqual({'run:1 test_schema.table1 added tag': set(['tag']),
+                          'run:2 test_schema.table2 added tag': set(['tag'])}, result)
+
+    def test_sync_table_tags_skip_tables_in_checkpoint_journal(self):
+        added_tags = []
+        self.atlas_client.known_tags = lambda: [{'name': 'tag'}]
+        self.atlas_client.get_tables = lambda db: [{u'guid': u'UUID1',
+                                                    u'attributes': {u'qualifiedName': db + u'.table1@dhadoopname'},
+                                                    u'classificationNames': []}]
+        self.atlas_client.add_tags_on_guid = lambda guid, tags: added_tags.append((guid, tags))
+        journal = checkpoint.Journal()
+        journal.record('table', 'test_schema.table1', {'tag'})
+        self.to_test.journal = journal
+
+        test_data = [{'schema': 'test_schema', 'table': 'table1', 'tags': 'tag'}]
+        result = self.to_test.sync_table_tags(test_data)
+
+        self.assertEqual([], added_tags)
+        self.assertEqual({'table already synced according to checkpoint': set(['test_schema.table1'])}, result)
+
+    def test_sync_table_tags_resumed_clears_only_tables_not_in_checkpoint_journal(self):
+        self.atlas_client.known_tags = lambda: [{'name': 'tag'}]
+        self.atlas_client.get_tables = lambda db: [
+            {u'guid': u'UUID' + t, u'attributes': {u'qualifiedName': db + u'.table' + t + u'@cluster'},
+             u'classificationNames': [u'tag']} for t in ['1', '2', '3']]
+        self.atlas_client.delete_tags_on_guid = MagicMock()
+        journal = checkpoint.Journal()
+        journal.record('table', 'test_schema.table1', {'tag'})
+        journal.record('table', 'test_schema.table2', set())
+        journal.record = MagicMock()
+        self.to_test.journal = journal
+
+        self.to_test.sync_table_tags([{'schema': 'test_schema', 'table': 'table1', 'tags': 'tag'}],
+                                     clear_not_listed=True)
+
+        self.atlas_client.delete_tags_on_guid.assert_called_once_with(u'UUID3', ['tag'])
+        journal.record.assert_called_once_with('table', 'test_schema.table3', set(), set(), {'tag'})
+
     def test_sync_column_tags_expect_tags_added_to_one_column(self):
         added_tags=[]
         self.atlas_client.known_tags = lambda : [{'name': 'tag'}]
@@ -267,34 +329,221 @@ class TestSync(unittest.TestCase):
         self.assertEqual({'run:3 test_schema.table1.column1 added tag': set(['tag'])}, result)
         self.assertEqual(3, len(runs))
 
-    def test_sync_tags_for_one_tables_storage(self):
-        self.to_test.hive_client.get_location = MagicMock(return_value="hdfs://system/my/path")
-        self.to_test.atlas_client.add_hdfs_path = MagicMock(return_value="12345")
-        self.to_test.atlas_client.get_tags_on_guid = MagicMock(return_value=set(['tag1', 'tag4']))
-        self.to_test.atlas_client.add_tags_on_guid = MagicMock()
-        self.to_test.atlas_client.delete_tags_on_guid = MagicMock()
-
-        self.to_test._sync_tags_for_one_tables_storage("myschema", "mytable", set(["tag1", "tag2"]))
-        self.hive_client.get_location.assert_called_with("myschema", "mytable")
-        self.atlas_client.add_hdfs_path.assert_called_with("hdfs://system/my/path")
-        self.atlas_client.get_tags_on_guid("12345")
-        self.atlas_client.add_tags_on_guid("12345", ["tag2"])
-        self.atlas_client.delete_tags_on_guid("12345", ["tag4"])
+    def test_sync_table_storage_tags_with_cached_guid(self):
+        self.to_test.hdfs_path_cache.update({"hdfs://system/cached": "12345", "hdfs://system/stale": "666"})
+        self.hive_client.get_location = lambda db, table: "hdfs://system/" + table
+        self.atlas_client.known_tags = lambda: [{'name': 'tag1'}]
+        self.atlas_client.add_hdfs_paths = MagicMock(return_value={"hdfs://system/stale": "777"})
+        self.atlas_client.get_classifications = MagicMock(
+            side_effect=lambda guids: dict((g, set(['tag1'])) for g in guids if g != "666"))
+        self.atlas_client.add_tag_on_guids = MagicMock()
+
+        self.to_test.sync_table_storage_tags([{'schema': 'myschema', 'table': 'cached', 'tags': 'tag1'},
+                                              {'schema': 'myschema', 'table': 'stale', 'tags': 'tag1'}])
+
+        self.atlas_client.add_hdfs_paths.assert_called_once_with(["hdfs://system/stale"])
+        self.assertEqual([call(["12345", "666"]), call(["777"])], self.atlas_client.get_classifications.call_args_list)
+        self.assertEqual("777", self.to_test.hdfs_path_cache.get("hdfs://system/stale"))
+        self.assertFalse(self.atlas_client.add_tag_on_guids.called)
+
+    def test_sync_table_storage_tags_in_bulk(self):
+        locations = {('myschema', 't1'): "hdfs://system/t1", ('myschema', 't2'): "hdfs://system/t2",
+                     ('myschema', 'v'): None}
+        self.hive_client.get_location = lambda db, table: locations[(db, table)]
+        self.atlas_client.known_tags = lambda: [{'name': 'tag1'}, {'name': 'tag2'}]
+        self.atlas_client.add_hdfs_paths = MagicMock(return_value={"hdfs://system/t1": "g1",
+                                                                   "hdfs://system/t2": "g2"})
+        self.atlas_client.get_classifications = MagicMock(
+            side_effect=lambda guids: dict((g, {"g1": set(['tag2']), "g2": set()}[g]) for g in guids))
+        self.atlas_client.add_tag_on_guids = MagicMock()
+        self.atlas_client.delete_tags_on_guid = MagicMock()
+
+        result = self.to_test.sync_table_storage_tags([{'schema': 'myschema', 'table': 't1', 'tags': 'tag1'},
+                                                       {'schema': 'myschema', 'table': 't2', 'tags': 'tag1,tag2'},
+                                                       {'schema': 'myschema', 'table': 'v', 'tags': 'tag1'}])
+
+        self.atlas_client.add_hdfs_paths.assert_called_once_with(["hdfs://system/t1", "hdfs://system/t2"])
+        self.atlas_client.get_classifications.assert_called_with(["g1", "g2"])
+        self.assertEqual([call('tag1', ['g1', 'g2']), call('tag2', ['g2'])],
+                         self.atlas_client.add_tag_on_guids.call_args_list)
+        self.atlas_client.delete_tags_on_guid.assert_called_once_with("g1", ['tag2'])
+        self.assertEqual({'hdfs://system/t1 added tag': set(['tag1']),
+                          'hdfs://system/t1 deleted tag': set(['tag2']),
+                          'hdfs://system/t2 added tag': set(['tag1', 'tag2']),
+                          'myschema.v is a view, not doing any hdfs tagging for it.': ''}, result)
+
+    def test_sync_table_storage_tags_clears_tables_only_in_atlas_after_failed_run(self):
+        tables = [[], [{'guid': 'T2', 'attributes': {'qualifiedName': 'myschema.t2@cluster'},
+                        'classificationNames': []}]]
+
+        def get_tables(db):
+            if len(tables) == 2:
+                tables.pop(0)
+                raise AtlasError("Search failed", 503)
+            return tables[0]
+        self.to_test.retry_delay = 0
+        self.hive_client.get_location = lambda db, table: "hdfs://system/" + table
+        self.atlas_client.known_tags = lambda: [{'name': 'tag1'}]
+        self.atlas_client.get_tables = get_tables
+        self.atlas_client.add_hdfs_paths = lambda paths: dict((p, p[-2:]) for p in paths)
+        self.atlas_client.get_classifications = lambda guids: dict((g, {'t1': set(), 't2': {'tag1'}}[g]) for g in guids)
+        self.atlas_client.add_tag_on_guids = MagicMock()
+        self.atlas_client.delete_tags_on_guid = MagicMock()
+
+        self.to_test.sync_table_storage_tags([{'schema': 'myschema', 'table': 't1', 'tags': 'tag1'}],
+                                             clear_not_listed=True)
+
+        self.atlas_client.add_tag_on_guids.assert_called_once_with('tag1', ['t1'])
+        self.atlas_client.delete_tags_on_guid.assert_called_once_with('t2', ['tag1'])
+
+    def test_sync_table_and_column_tags_with_one_fetch_of_schema(self):
+        self.to_test.fetch_whole_schemas = True
+        self.atlas_client.known_tags = lambda: [{'name': 'tag'}]
+
+        def header(guid, qualified_name, tags):
+            return {'guid': guid, 'attributes': {'qualifiedName': qualified_name}, 'classificationNames': tags}
+        self.atlas_client.get_schema = MagicMock(return_value=(
+            [header('T1', 's.t1@c', []), header('T2', 's.t2@c', [])],
+            [header('C1', 's.t1.c1@c', ['tag']), header('C2', 's.t2.c1@c', [])]))
+        self.atlas_client.add_tags_on_guid = MagicMock()
+        self.atlas_client.delete_tags_on_guid = MagicMock()
+
+        self.to_test.sync_table_tags([{'schema': 's', 'table': 't1', 'tags': 'tag'},
+                                      {'schema': 's', 'table': 't2', 'tags': ''}])
+        self.to_test.sync_column_tags([{'schema': 's', 'table': 't1', 'attribute': 'c1', 'tags': ''}])
+
+        self.atlas_client.get_schema.assert_called_once_with('s')
+        self.atlas_client.add_tags_on_guid.assert_called_once_with('T1', ['tag'])
+        self.atlas_client.delete_tags_on_guid.assert_called_once_with('C1', ['tag'])
+
+        self.to_test.sync_column_tags([{'schema': 's', 'table': 't1', 'attribute': 'c1', 'tags': ''}])
+        self.assertEqual(2, self.atlas_client.get_schema.call_count)
 
     def test_ensure_tags_in_atlas_add_new_tags(self):
         saved_tags = set()
 
         def add_tag_definitions_mock(tags):
             saved_tags.update(tags)
+            return set(tags)
 
         in_data = [{'tags': 'tag1'},
                    {'tags': 'tag1,tag2,tag3'}]
         self.atlas_client.add_tag_definitions = add_tag_definitions_mock
-        self.to_test.tags_from_atlas = MagicMock(return_value={'tag1', 'tag3'})
+        self.atlas_client.known_tags = lambda: [{'name': 'tag1'}, {'name': 'tag3'}]
         self.to_test.ensure_tags_in_atlas(in_data)
         self.assertEqual(saved_tags, {'tag2'})
-
-
+        self.assertEqual({'tag2'}, self.to_test.worklog['New tags added to Atlas'])
+
+    def test_shared_tag_definitions_create_required_tags_once(self):
+        self.atlas_client.known_tags = MagicMock(return_value=[{'name': 'tag1'}])
+        self.atlas_client.add_tag_definitions = MagicMock(side_effect=lambda tags: set(tags))
+        tag_definitions = tagsync.TagDefinitions(self.atlas_client, required_tags={'tag1', 'tag2', 'tag3'})
+        prod = tagsync.Sync(self.atlas_client, tag_definitions=tag_definitions)
+        test = tagsync.Sync(self.atlas_client, tag_definitions=tag_definitions)
+
+        prod.ensure_tags_in_atlas([{'tags': 'tag2'}])
+        test.ensure_tags_in_atlas([{'tags': 'tag3'}])
+        prod.ensure_tags_in_atlas([{'tags': 'tag1,tag3'}])
+
+        self.atlas_client.known_tags.assert_called_once_with()
+        self.atlas_client.add_tag_definitions.assert_called_once_with({'tag2', 'tag3'})
+        self.assertEqual({'tag1', 'tag2', 'tag3'}, test.tags_from_atlas())
+
+    def test_ensure_tags_in_atlas_with_cached_known_tags(self):
+        self.atlas_client.known_tags = MagicMock(return_value=[{'name': 'tag1'}])
+        self.atlas_client.add_tag_definitions = MagicMock()
+        to_test = tagsync.Sync(self.atlas_client, cache_known_tags=True)
+        to_test.ensure_tags_in_atlas([{'tags': 'tag1,tag2'}])
+        to_test.ensure_tags_in_atlas([{'tags': 'tag2'}])
+        self.atlas_client.known_tags.assert_called_once_with()
+        self.atlas_client.add_tag_definitions.assert_called_once_with({'tag2'})
+        to_test.forget_known_tags()
+        to_test.tags_from_atlas()
+        self.assertEqual(2, self.atlas_client.known_tags.call_count)
+
+    def test_plan_then_apply_plan(self):
+        self.atlas_client.known_tags = lambda: [{'name': 'tag1'}]
+        self.atlas_client.get_tables = lambda db: [
+            {u'guid': u'UUID1', u'attributes': {u'qualifiedName': db + u'.table1@cluster'},
+             u'classificationNames': [u'tag1']},
+            {u'guid': u'UUID2', u'attributes': {u'qualifiedName': db + u'.table2@cluster'},
+             u'classificationNames': [u'tag1']}]
+        self.atlas_client.add_tags_on_guid = MagicMock()
+        self.atlas_client.delete_tags_on_guid = MagicMock()
+        self.atlas_client.add_tag_definitions = MagicMock()
+        test_data = [{'schema': 'test_schema', 'table': 'table1', 'tags': 'tag1'},
+                     {'schema': 'test_schema', 'table': 'table2', 'tags': 'tag2'}]
+
+        plan = json.loads(json.dumps(self.to_test.plan(test_data, [])))
+
+        self.assertEqual(['tag2'], plan['tag_definitions'])
+        self.assertEqual([{'phase': 'table', 'entity': 'test_schema.table2', 'guid': 'UUID2',
+                           'tags': ['tag2'], 'add': ['tag2'], 'delete': ['tag1']}], plan['changes'])
+        self.assertFalse(self.atlas_client.add_tags_on_guid.called)
+
+        result = self.to_test.apply_plan(plan)
+
+        self.atlas_client.add_tag_definitions.assert_called_once_with({'tag2'})
+        self.atlas_client.add_tags_on_guid.assert_called_once_with('UUID2', ['tag2'])
+        self.atlas_client.delete_tags_on_guid.assert_called_once_with('UUID2', ['tag1'])
+        self.assertEqual({'tag2'}, result['test_schema.table2 added tag'])
+
+    def test_plan_storage_does_not_create_hdfs_path(self):
+        self.atlas_client.known_tags = lambda: [{'name': 'tag1'}]
+        self.atlas_client.get_tables = lambda db: [
+            {u'guid': u'UUID1', u'attributes': {u'qualifiedName': db + u'.table1@cluster'},
+             u'classificationNames': [u'tag1']}]
+        self.hive_client.get_location = MagicMock(return_value="hdfs://system/my/path")
+        self.atlas_client.get_classifications = lambda guids: {}
+        self.atlas_client.get_hdfs_path = MagicMock(return_value=None)
+        self.atlas_client.add_hdfs_path = MagicMock(return_value="12345")
+        self.atlas_client.add_tags_on_guid = MagicMock()
+
+        plan = self.to_test.plan([{'schema': 'test_schema', 'table': 'table1', 'tags': 'tag1'}], [], storage=True)
+
+        self.assertFalse(self.atlas_client.add_hdfs_path.called)
+        self.assertEqual([{'phase': 'storage', 'entity': 'test_schema.table1', 'guid': None,
+                           'hdfs_path': 'hdfs://system/my/path', 'tags': ['tag1'], 'add': ['tag1'], 'delete': []}],
+                         plan['changes'])
+
+        self.to_test.apply_plan(plan)
+
+        self.atlas_client.add_hdfs_path.assert_called_once_with("hdfs://system/my/path")
+        self.atlas_client.add_tags_on_guid.assert_called_once_with("12345", ['tag1'])
+
+    def test_plan_storage_looks_up_paths_in_bulk_and_merges_shared_locations(self):
+        locations = {'t1': "hdfs://system/shared", 't2': "hdfs://system/shared", 't3': "hdfs://system/t3"}
+        table_tags = {'t1': 'tag1', 't2': 'tag2', 't3': 'tag1'}
+        self.to_test.hdfs_path_cache.update({"hdfs://system/shared": "g1"})
+        self.atlas_client.known_tags = lambda: [{'name': 'tag1'}, {'name': 'tag2'}]
+        self.atlas_client.get_tables = lambda db: [
+            {u'guid': u'T' + t, u'attributes': {u'qualifiedName': db + u'.' + t + u'@cluster'},
+             u'classificationNames': [table_tags[t]]} for t in sorted(table_tags)]
+        self.hive_client.get_location = lambda db, table: locations[table]
+        self.atlas_client.get_classifications = MagicMock(return_value={"g1": set(['tag2', 'tag3'])})
+        self.atlas_client.get_hdfs_path = MagicMock(return_value=None)
+        self.atlas_client.add_hdfs_paths = MagicMock()
+        self.atlas_client.add_hdfs_path = MagicMock(return_value="g3")
+        self.atlas_client.add_tags_on_guid = MagicMock()
+        self.atlas_client.delete_tags_on_guid = MagicMock()
+
+        plan = self.to_test.plan([{'schema': 's', 'table': t, 'tags': table_tags[t]} for t in sorted(table_tags)], [],
+                                 storage=True)
+
+        self.atlas_client.get_classifications.assert_called_once_with(["g1"])
+        self.atlas_client.get_hdfs_path.assert_called_once_with("hdfs://system/t3")
+        self.assertFalse(self.atlas_client.add_hdfs_paths.called)
+        self.assertEqual([{'phase': 'storage', 'entity': 's.t1', 'guid': 'g1', 'hdfs_path': 'hdfs://system/shared',
+                           'tables': ['s.t1', 's.t2'], 'tags': ['tag1', 'tag2'], 'add': ['tag1'], 'delete': ['tag3']},
+                          {'phase': 'storage', 'entity': 's.t3', 'guid': None, 'hdfs_path': 'hdfs://system/t3',
+                           'tags': ['tag1'], 'add': ['tag1'], 'delete': []}], plan['changes'])
+
+        self.to_test.apply_plan(plan, parallel=2)
+
+        self.atlas_client.add_hdfs_path.assert_called_once_with("hdfs://system/t3")
+        self.assertEqual([call('g1', ['tag1']), call('g3', ['tag1'])],
+                         sorted(self.atlas_client.add_tags_on_guid.call_args_list))
+        self.atlas_client.delete_tags_on_guid.assert_called_once_with('g1', ['tag3'])
 
 
 if __name__ == '__main__':